@@ -1,7 +1,37 @@
+import json
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import ReferralStats, User
+from .phones import NON_DIGITS, InvalidPhoneNumber, normalize_phone
+
 
-from .models import User
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор без COUNT(*) по большим выборкам.
+
+    В PostgreSQL число строк берётся из оценки планировщика (EXPLAIN).
+    Точный COUNT выполняется, только если оценка меньше
+    ``ADMIN_EXACT_COUNT_LIMIT``, и на других СУБД.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor == "postgresql":
+            plan = queryset.explain(format="json")
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = int(plan[0]["Plan"]["Plan Rows"])
+            if estimate >= settings.ADMIN_EXACT_COUNT_LIMIT:
+                return estimate
+        return super().count
 
 
 class UserAdmin(BaseUserAdmin):
@@ -11,9 +41,21 @@ class UserAdmin(BaseUserAdmin):
         "invited_by",
         "is_staff",
         "is_superuser",
+        "invited_count",
+        "total_referrals",
     )
+    list_select_related = ("referral_stats", "invited_by")
     search_fields = ("phone_number", "invite_code")
+    search_help_text = (
+        "Номер или инвайт-код целиком, начало номера с «+» или часть "
+        "номера/кода от трёх символов."
+    )
     ordering = ("phone_number", )
+    # Выбор пригласившего из списка всех пользователей не отрисовать
+    raw_id_fields = ("invited_by", )
+    paginator = EstimatedCountPaginator
+    # Без второго COUNT(*) по всей таблице при поиске
+    show_full_result_count = False
     fieldsets = (
         (None, {
             "fields": ("phone_number", "password")
@@ -37,5 +79,47 @@ class UserAdmin(BaseUserAdmin):
         },
     ), )
 
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Поиск только по индексируемым условиям вместо ``ILIKE '%...%'``.
+
+        Точный номер и код ищутся по уникальным индексам, начало номера —
+        по индексу ``*_like`` (``LIKE '+7917%'``), подстрока — по
+        триграммным индексам (миграция 0011).
+        """
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        code = term.upper()
+        condition = Q(invite_code=code)
+        try:
+            condition |= Q(phone_number=normalize_phone(term))
+        except InvalidPhoneNumber:
+            pass
+        digits = NON_DIGITS.sub("", term)
+        if term.startswith("+") and digits:
+            condition |= Q(phone_number__startswith=f"+{digits}")
+        elif len(term) >= 3:
+            condition |= Q(invite_code__contains=code)
+            if len(digits) >= 3:
+                condition |= Q(phone_number__contains=digits)
+        return queryset.filter(condition), False
+
+    def _stats(self, obj):
+        try:
+            return obj.referral_stats
+        except ReferralStats.DoesNotExist:
+            return ReferralStats(user=obj)
+
+    @admin.display(description="Приглашено",
+                   ordering="referral_stats__direct_count")
+    def invited_count(self, obj):
+        return self._stats(obj).direct_count
+
+    @admin.display(description="Всего рефералов",
+                   ordering="referral_stats__total_descendants")
+    def total_referrals(self, obj):
+        return self._stats(obj).total_descendants
+
 
 admin.site.register(User, UserAdmin)
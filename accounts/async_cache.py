@@ -0,0 +1,43 @@
+import asyncio
+import weakref
+
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.core.cache import cache
+
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis():
+    """
+    Асинхронный клиент Redis для текущего цикла событий.
+
+    Соединения redis.asyncio привязаны к циклу событий, поэтому клиент
+    создаётся для каждого цикла отдельно; в воркере uvicorn цикл один.
+    Клиент работает с той же базой Redis, что и кэш Django. Когда все
+    соединения пула заняты, запрос ждёт свободное, а не получает ошибку.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        pool = aioredis.BlockingConnectionPool.from_url(
+            settings.ASYNC_REDIS_URL, **settings.ASYNC_REDIS_POOL_KWARGS
+        )
+        client = aioredis.Redis(connection_pool=pool)
+        _clients[loop] = client
+    return client
+
+
+async def aget(key, default=None):
+    """Асинхронный ``cache.get`` в формате значений django-redis."""
+    value = await get_async_redis().get(cache.make_key(key))
+    if value is None:
+        return default
+    return cache.client.decode(value)
+
+
+async def aset(key, value, timeout):
+    """Асинхронный ``cache.set`` в формате значений django-redis."""
+    await get_async_redis().set(
+        cache.make_key(key), cache.client.encode(value), ex=timeout
+    )
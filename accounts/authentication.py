@@ -0,0 +1,200 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import async_cache
+
+# Поля пользователя, которые access-токен несёт в подписанных claims
+USER_CLAIMS = ("phone_number", "invite_code", "is_active", "is_staff")
+# Версия токенов пользователя на момент выдачи (см. TokenVersions)
+VERSION_CLAIM = "ver"
+
+
+def token_version_key(user_id):
+    return f"auth_token_version_{user_id}"
+
+
+class TokenVersions:
+    """
+    Отзыв access-токенов пользователя без обращения к БД.
+
+    Версия — время последнего отзыва в миллисекундах, хранится в Redis.
+    Она сдвигается (:meth:`bump`), когда меняются поля из claims или
+    пользователя блокируют; токены, выданные с меньшей версией, больше не
+    принимаются, и клиент получает новый по refresh-токену. Прочитанная
+    версия кэшируется в процессе на ``AUTH_TOKEN_VERSION_CACHE_TTL``
+    секунд: с такой задержкой отзыв доходит до остальных воркеров.
+    """
+
+    def __init__(self):
+        self._local = {}
+        self._lock = threading.Lock()
+
+    def _cached(self, user_id):
+        entry = self._local.get(user_id)
+        ttl = settings.AUTH_TOKEN_VERSION_CACHE_TTL
+        if entry is not None and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        return None
+
+    def _remember(self, user_id, version):
+        with self._lock:
+            if len(self._local) >= settings.AUTH_TOKEN_VERSION_CACHE_SIZE:
+                self._local.clear()
+            self._local[user_id] = (time.monotonic(), version)
+        return version
+
+    def get(self, user_id, fresh=False):
+        """
+        Текущая версия токенов пользователя.
+
+        :param fresh: Прочитать из Redis в обход локального кэша; нужно
+            при выдаче токена, чтобы он не получил устаревшую версию.
+        """
+        version = None if fresh else self._cached(user_id)
+        if version is None:
+            version = self._remember(
+                user_id, cache.get(token_version_key(user_id), 0)
+            )
+        return version
+
+    async def aget(self, user_id):
+        """Асинхронный вариант :meth:`get`."""
+        version = self._cached(user_id)
+        if version is None:
+            version = self._remember(
+                user_id,
+                await async_cache.aget(token_version_key(user_id), 0),
+            )
+        return version
+
+    def bump(self, user_id):
+        """Отзыв всех выданных пользователю access-токенов."""
+        version = max(time.time_ns() // 1_000_000,
+                      self.get(user_id, fresh=True) + 1)
+        # После отсутствия ключа версия снова растёт со временем, поэтому
+        # хранить её нужно только пока живут отозванные access-токены
+        timeout = int(jwt_settings.ACCESS_TOKEN_LIFETIME.total_seconds())
+        cache.set(token_version_key(user_id), version, timeout=timeout)
+        return self._remember(user_id, version)
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+
+
+token_versions = TokenVersions()
+
+
+def set_user_claims(token, user):
+    """Запись полей пользователя и текущей версии в claims токена."""
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[VERSION_CLAIM] = token_versions.get(user.pk, fresh=True)
+
+
+class ClaimsRefreshToken(RefreshToken):
+    """Refresh-токен, access-токены которого несут claims пользователя."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        set_user_claims(token, user)
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """
+    Пользователь, собранный из claims access-токена.
+
+    Поля из ``USER_CLAIMS`` доступны как атрибуты; остальные поля модели
+    (например, ``invited_by_id``) равны ``None`` — за ними нужно идти в БД.
+    """
+
+    @cached_property
+    def is_active(self):
+        return bool(self.token.get("is_active"))
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT-аутентификация без запроса к таблице пользователей.
+
+    ``request.user`` — :class:`ClaimsUser` из подписанных claims. Токен
+    отклоняется, если пользователь заблокирован или токен отозван
+    (:class:`TokenVersions`). Токены без claims, выданные до перехода на
+    эту схему, проверяются по БД, как в ``JWTAuthentication``.
+    """
+
+    def get_user(self, validated_token):
+        if VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+        user = jwt_settings.TOKEN_USER_CLASS(validated_token)
+        self.check_user(user, token_versions.get(user.pk))
+        return user
+
+    async def aget_user(self, validated_token):
+        """Асинхронный вариант :meth:`get_user` для async-представлений."""
+        if VERSION_CLAIM not in validated_token:
+            user = await get_user_model().objects.filter(
+                pk=validated_token[jwt_settings.USER_ID_CLAIM],
+                is_active=True,
+            ).afirst()
+            if user is None:
+                raise AuthenticationFailed("Пользователь не найден.",
+                                           code="user_not_found")
+            return user
+        user = jwt_settings.TOKEN_USER_CLASS(validated_token)
+        self.check_user(user, await token_versions.aget(user.pk))
+        return user
+
+    @staticmethod
+    def check_user(user, version):
+        if not user.is_active:
+            raise AuthenticationFailed("Пользователь заблокирован.",
+                                       code="user_inactive")
+        if user.token[VERSION_CLAIM] < version:
+            raise AuthenticationFailed("Токен отозван, обновите его.",
+                                       code="token_revoked")
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Обновление access-токена со свежими claims.
+
+    Единственное место, где аутентификация по токену читает пользователя
+    из БД: раз в ``ACCESS_TOKEN_LIFETIME``, а не на каждый запрос.
+    """
+
+    token_class = ClaimsRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = self.token_class(attrs["refresh"])
+        user = get_user_model().objects.filter(
+            pk=refresh[jwt_settings.USER_ID_CLAIM]
+        ).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed("Пользователь не найден или "
+                                       "заблокирован.", code="user_inactive")
+        access = refresh.access_token
+        set_user_claims(access, user)
+        data["access"] = str(access)
+        return data
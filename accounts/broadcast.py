@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+
+from referral_project import db_router
+
+from .models import SMSCampaign
+from .sms import get_sms_client
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Потокобезопасный ограничитель скорости «ведро с токенами».
+
+    :param rate: Допустимое число сообщений в секунду.
+    :param burst: Ёмкость ведра (по умолчанию равна ``rate``).
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Блокирует поток, пока в ведре не окажется ``tokens`` токенов."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.rate,
+                )
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class BroadcastRunner:
+    """
+    Отправка рассылки всем активным пользователям.
+
+    Получатели читаются из таблицы пользователей порциями серверного
+    курсора в порядке pk. Каждая порция делится на пакеты для массовой
+    отправки, которые уходят в шлюз из пула потоков с ограничением
+    скорости. После каждой порции в кампании сохраняется контрольная
+    точка, поэтому прерванная рассылка продолжается с места остановки.
+
+    Рассылку выполняет один исполнитель: перед отправкой он захватывает
+    кампанию условным UPDATE, а каждая контрольная точка продлевает
+    захват. Кампанию без контрольных точек дольше
+    ``BROADCAST_LEASE_SECONDS`` может продолжить другой исполнитель;
+    прежний тогда останавливается на следующей контрольной точке.
+    """
+
+    def __init__(self, campaign, chunk_size=None, concurrency=None,
+                 rate=None, batch_size=None, progress=None):
+        self.campaign = campaign
+        self.chunk_size = chunk_size or settings.BROADCAST_CHUNK_SIZE
+        self.concurrency = concurrency or settings.BROADCAST_CONCURRENCY
+        self.batch_size = batch_size or settings.SMSAERO_BULK_SIZE
+        self.bucket = TokenBucket(rate or settings.SMSAERO_RATE_LIMIT)
+        self.progress = progress or self._log_progress
+        self.client = get_sms_client()
+
+    def recipients(self):
+        return (
+            get_user_model().objects
+            .filter(is_active=True, pk__gt=self.campaign.last_user_id)
+            .order_by("pk")
+            .values_list("pk", "phone_number")
+            .iterator(chunk_size=self.chunk_size)
+        )
+
+    def chunks(self):
+        chunk = []
+        for row in self.recipients():
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def send_batch(self, phones):
+        self.bucket.acquire(len(phones))
+        if len(phones) == 1:
+            result = self.client.send(phones[0], self.campaign.message)
+        else:
+            result = self.client.send_bulk(phones, self.campaign.message)
+        if result.get("status") == "error":
+            return 0, len(phones)
+        return len(phones), 0
+
+    def claim(self):
+        """
+        Захват кампании: новой или брошенной прежним исполнителем.
+
+        :return: True, если кампания захвачена; контрольная точка
+            перечитывается из БД.
+        """
+        campaign = self.campaign
+        now = timezone.now()
+        stale = now - timedelta(seconds=settings.BROADCAST_LEASE_SECONDS)
+        claimed = SMSCampaign.objects.filter(
+            Q(status=SMSCampaign.STATUS_PENDING)
+            | Q(status=SMSCampaign.STATUS_RUNNING, updated_at__lt=stale),
+            pk=campaign.pk,
+        ).update(status=SMSCampaign.STATUS_RUNNING, updated_at=now)
+        if not claimed:
+            return False
+        # Реплика может ещё не видеть последнюю контрольную точку
+        with db_router.use_primary():
+            campaign.refresh_from_db()
+        return True
+
+    def checkpoint(self, **fields):
+        """
+        Сохранение полей кампании, если она всё ещё захвачена этим
+        исполнителем.
+
+        :return: False, если кампанию захватил другой исполнитель.
+        """
+        campaign = self.campaign
+        now = timezone.now()
+        saved = SMSCampaign.objects.filter(
+            pk=campaign.pk,
+            status=SMSCampaign.STATUS_RUNNING,
+            updated_at=campaign.updated_at,
+        ).update(updated_at=now, **fields)
+        if saved:
+            campaign.updated_at = now
+        return bool(saved)
+
+    def run(self):
+        """
+        Выполнение рассылки.
+
+        :return: Кампания или None, если её выполняет другой исполнитель
+            либо она уже завершена.
+        """
+        campaign = self.campaign
+        if not self.claim():
+            return None
+
+        started = time.monotonic()
+        processed = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            for chunk in self.chunks():
+                phones = [phone for _, phone in chunk]
+                batches = [
+                    phones[start:start + self.batch_size]
+                    for start in range(0, len(phones), self.batch_size)
+                ]
+                for sent, failed in pool.map(self.send_batch, batches):
+                    campaign.sent += sent
+                    campaign.failed += failed
+
+                campaign.last_user_id = chunk[-1][0]
+                if not self.checkpoint(last_user_id=campaign.last_user_id,
+                                       sent=campaign.sent,
+                                       failed=campaign.failed):
+                    logger.warning(
+                        f"Рассылка #{campaign.pk} продолжена другим "
+                        f"исполнителем, остановка"
+                    )
+                    return None
+                processed += len(chunk)
+                elapsed = time.monotonic() - started
+                self.progress(campaign, processed / elapsed if elapsed else 0)
+
+        if not self.checkpoint(status=SMSCampaign.STATUS_FINISHED):
+            return None
+        campaign.status = SMSCampaign.STATUS_FINISHED
+        return campaign
+
+    @staticmethod
+    def _log_progress(campaign, rate):
+        logger.info(
+            f"Рассылка #{campaign.pk}: отправлено {campaign.sent}, "
+            f"ошибок {campaign.failed}, {rate:.1f} сообщ./с"
+        )
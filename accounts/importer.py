@@ -0,0 +1,404 @@
+import csv
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .invite_codes import invite_code_allocator
+from .invite_filter import invite_filter
+from .models import ReferralStats
+from .phones import normalize_phones
+
+logger = logging.getLogger(__name__)
+
+REJECT_INVALID_PHONE = "invalid_phone"
+REJECT_DUPLICATE = "duplicate"
+REJECT_EXISTS = "exists"
+REJECT_INVALID_INVITER = "invalid_inviter"
+REJECT_INVITER_NOT_FOUND = "inviter_not_found"
+REJECT_INVALID_JSON = "invalid_json"
+REJECT_INVALID_ROW = "invalid_row"
+REJECT_CYCLE = "cycle"
+
+# Временная таблица импорта: номера, созданные из файла (для поиска
+# дубликатов), и исходные ссылки на пригласивших для второго прохода
+IMPORTED_TABLE = "accounts_import_rows"
+
+
+class InvalidRow(dict):
+    """
+    Строка, которую не удалось разобрать. Пустой словарь, чтобы
+    обработчик отклонённых строк мог читать её поля как обычно.
+    """
+
+    def __init__(self, reason):
+        super().__init__()
+        self.reason = reason
+
+
+def read_rows(stream, fmt="csv"):
+    """
+    Потоковое чтение строк импорта.
+
+    :param stream: Текстовый файловый объект.
+    :param fmt: ``csv`` (с заголовком) или ``ndjson``.
+    :return: Генератор словарей с ключами ``phone_number`` и
+        ``invited_by`` (номер пригласившего, необязателен). Вместо
+        строки NDJSON с ошибкой разбора выдаётся :class:`InvalidRow`,
+        чтобы импорт отклонил её и продолжил.
+    """
+    if fmt == "ndjson":
+        for line in stream:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield InvalidRow(REJECT_INVALID_JSON)
+    else:
+        yield from csv.DictReader(stream)
+
+
+class ImportStats:
+
+    def __init__(self):
+        self.read = 0
+        self.created = 0
+        self.linked = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.read / elapsed if elapsed else 0
+
+
+class UserImporter:
+    """
+    Массовый импорт пользователей.
+
+    Первый проход читает вход порциями: номера нормализуются пакетом,
+    дубликаты и уже существующие номера отбрасываются, остальные
+    пользователи создаются одним ``bulk_create`` на порцию с заранее
+    выданными инвайт-кодами и без хеширования пароля (вход только по
+    SMS). Созданные номера и ссылки на пригласивших записываются во
+    временную таблицу БД, а не в память процесса. Ссылки проставляются
+    вторым проходом, когда все пользователи файла уже есть в БД; ссылки,
+    замыкающие цикл в дереве приглашений, отклоняются. После этого
+    статистика приглашений пересчитывается целиком.
+
+    :param chunk_size: Размер порции строк.
+    :param reject: Функция ``reject(line, row, reason)`` для отклонённых
+        строк.
+    :param progress: Функция ``progress(stats)``, вызывается после каждой
+        порции.
+    """
+
+    def __init__(self, chunk_size=None, reject=None, progress=None):
+        self.chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+        self.reject_row = reject
+        self.progress = progress or self._log_progress
+        self.stats = ImportStats()
+        self.model = get_user_model()
+        self.table = connection.ops.quote_name(self.model._meta.db_table)
+        self.imported = connection.ops.quote_name(IMPORTED_TABLE)
+
+    def reject(self, line, row, reason):
+        self.stats.rejected += 1
+        if self.reject_row:
+            self.reject_row(line, row, reason)
+
+    def chunks(self, rows):
+        chunk = []
+        for line, row in enumerate(rows, start=1):
+            chunk.append((line, row))
+            if len(chunk) == self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def create_chunk(self, chunk):
+        self.stats.read += len(chunk)
+        # Не словарь — например, массив или число в строке NDJSON
+        chunk = [
+            (line, row if isinstance(row, dict)
+             else InvalidRow(REJECT_INVALID_ROW))
+            for line, row in chunk
+        ]
+        phones = normalize_phones(
+            str(row.get("phone_number") or "") for _, row in chunk
+        )
+        seen = set()
+        accepted = []
+        for (line, row), (_, phone) in zip(chunk, phones):
+            if isinstance(row, InvalidRow):
+                self.reject(line, row, row.reason)
+            elif phone is None:
+                self.reject(line, row, REJECT_INVALID_PHONE)
+            elif phone in seen:
+                self.reject(line, row, REJECT_DUPLICATE)
+            else:
+                seen.add(phone)
+                accepted.append((line, row, phone))
+
+        existing = set(
+            self.model.objects
+            .filter(phone_number__in=[phone for _, _, phone in accepted])
+            .values_list("phone_number", flat=True)
+        )
+        # Номер из предыдущей порции этого же файла — дубликат
+        duplicates = self.imported_phones(existing) if existing else set()
+        users = []
+        imported = []
+        for line, row, phone in accepted:
+            if phone in existing:
+                self.reject(line, row, REJECT_DUPLICATE
+                            if phone in duplicates else REJECT_EXISTS)
+                continue
+            users.append(self.model(
+                phone_number=phone,
+                # Без случайного хвоста make_password(None): пароль
+                # всё равно непригоден для входа
+                password=UNUSABLE_PASSWORD_PREFIX,
+                invite_code=invite_code_allocator.next_code(),
+            ))
+            imported.extend((
+                line, phone, str(row["phone_number"]),
+                str(row["invited_by"]) if row.get("invited_by") else None,
+            ))
+
+        self.model.objects.bulk_create(users, batch_size=self.chunk_size)
+        if imported:
+            values = ", ".join(["(%s, %s, %s, %s)"] * (len(imported) // 4))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {self.imported} "
+                    f"(line, phone, phone_number, invited_by) "
+                    f"VALUES {values}",
+                    imported,
+                )
+        self.stats.created += len(users)
+        return [user.invite_code for user in users]
+
+    def imported_phones(self, phones):
+        phones = list(phones)
+        placeholders = ", ".join(["%s"] * len(phones))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT phone FROM {self.imported} "
+                f"WHERE phone IN ({placeholders})",
+                phones,
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def pending_chunks(self):
+        """
+        Строки со ссылкой на пригласившего порциями в порядке файла.
+
+        :return: Генератор списков кортежей (строка, исходная запись,
+            номер).
+        """
+        last_line = 0
+        while True:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"""
+                    SELECT line, phone, phone_number, invited_by
+                    FROM {self.imported}
+                    WHERE invited_by IS NOT NULL AND line > %s
+                    ORDER BY line LIMIT %s
+                    """,
+                    [last_line, self.chunk_size],
+                )
+                rows = cursor.fetchall()
+            if not rows:
+                return
+            yield [
+                (line, {"phone_number": phone_number,
+                        "invited_by": invited_by}, phone)
+                for line, phone, phone_number, invited_by in rows
+            ]
+            last_line = rows[-1][0]
+
+    def link_chunk(self, chunk):
+        inviters = [
+            inviter for _, inviter in normalize_phones(
+                str(row["invited_by"]) for _, row, _ in chunk
+            )
+        ]
+        lookup = {inviter for inviter in inviters if inviter}
+        lookup.update(phone for _, _, phone in chunk)
+        ids = dict(
+            self.model.objects.filter(phone_number__in=lookup)
+            .values_list("phone_number", "pk")
+        )
+
+        candidates = []
+        for (line, row, phone), inviter in zip(chunk, inviters):
+            if inviter is None or inviter == phone:
+                self.reject(line, row, REJECT_INVALID_INVITER)
+            elif inviter not in ids:
+                self.reject(line, row, REJECT_INVITER_NOT_FOUND)
+            else:
+                candidates.append((line, row, ids[phone], ids[inviter]))
+
+        # Цепочки пригласивших из БД дополняются ссылками порции по мере
+        # их принятия, так что цикл находится и внутри файла, и через
+        # пользователей, связанных раньше
+        parents = self.inviter_chains(
+            {inviter_id for *_, inviter_id in candidates}
+        )
+        links = []
+        for line, row, user_id, inviter_id in candidates:
+            if self.closes_cycle(parents, user_id, inviter_id):
+                self.reject(line, row, REJECT_CYCLE)
+            else:
+                parents[user_id] = inviter_id
+                links.append((line, row, user_id, inviter_id))
+        self.stats.linked += self.apply_links(links)
+
+    def inviter_chains(self, inviter_ids):
+        """
+        Цепочки пригласивших для заданных пользователей одним рекурсивным
+        CTE, глубиной до ``REFERRAL_MAX_DEPTH``.
+
+        :return: Словарь ``{id: invited_by_id}``.
+        """
+        if not inviter_ids:
+            return {}
+        inviter_ids = list(inviter_ids)
+        placeholders = ", ".join(["%s"] * len(inviter_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH RECURSIVE chain(id, invited_by_id, depth) AS (
+                    SELECT id, invited_by_id, 0 FROM {self.table}
+                    WHERE id IN ({placeholders})
+                    UNION ALL
+                    SELECT u.id, u.invited_by_id, chain.depth + 1
+                    FROM {self.table} u JOIN chain
+                        ON u.id = chain.invited_by_id
+                    WHERE chain.depth < %s
+                )
+                SELECT DISTINCT id, invited_by_id FROM chain
+                """,
+                [*inviter_ids, settings.REFERRAL_MAX_DEPTH],
+            )
+            return dict(cursor.fetchall())
+
+    @staticmethod
+    def closes_cycle(parents, user_id, inviter_id):
+        ancestor = inviter_id
+        visited = set()
+        while ancestor is not None and ancestor not in visited:
+            if ancestor == user_id:
+                return True
+            visited.add(ancestor)
+            ancestor = parents.get(ancestor)
+        return False
+
+    def apply_links(self, links):
+        """
+        Запись ссылок порции.
+
+        :param links: Кортежи (строка, запись, id, id пригласившего).
+        :return: Число записанных ссылок.
+        """
+        if not links:
+            return 0
+        try:
+            with transaction.atomic():
+                self.update_links(links)
+            return len(links)
+        except IntegrityError:
+            # Цикл глубже REFERRAL_MAX_DEPTH нашёл триггер PostgreSQL:
+            # ссылки порции записываются по одной, чтобы отклонить только
+            # замыкающие его
+            pass
+        linked = 0
+        for link in links:
+            try:
+                with transaction.atomic():
+                    self.update_links([link])
+                linked += 1
+            except IntegrityError:
+                self.reject(link[0], link[1], REJECT_CYCLE)
+        return linked
+
+    def update_links(self, links):
+        # Один UPDATE ... FROM VALUES на порцию вместо CASE WHEN,
+        # который строит bulk_update
+        values = ", ".join(["(%s, %s)"] * len(links))
+        params = [pk for *_, user_id, inviter_id in links
+                  for pk in (user_id, inviter_id)]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH links(id, inviter_id) AS (VALUES {values})
+                UPDATE {self.table} SET invited_by_id = links.inviter_id,
+                                        invited_at = %s
+                FROM links WHERE {self.table}.id = links.id
+                """,
+                [*params, timezone.now()],
+            )
+
+    def run(self, rows):
+        """
+        Импорт строк.
+
+        :param rows: Итерируемое словарей, см. :func:`read_rows`.
+        :return: :class:`ImportStats`.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                CREATE TEMPORARY TABLE {self.imported} (
+                    line integer PRIMARY KEY,
+                    phone varchar(16) NOT NULL UNIQUE,
+                    phone_number text NOT NULL,
+                    invited_by text
+                )
+                """
+            )
+        try:
+            self.create_all(rows)
+            for chunk in self.pending_chunks():
+                with transaction.atomic():
+                    self.link_chunk(chunk)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {self.imported}")
+
+        if self.stats.linked:
+            if connection.vendor == "postgresql":
+                # Без свежей статистики планировщик выбирает для
+                # рекурсивного CTE в rebuild() вложенные циклы по всей
+                # таблице
+                with connection.cursor() as cursor:
+                    cursor.execute(f"ANALYZE {self.table}")
+            ReferralStats.objects.rebuild()
+            # Сигналы при массовых операциях не срабатывают
+            cache.delete_pattern("profile_json_*")
+        return self.stats
+
+    def create_all(self, rows):
+        for chunk in self.chunks(rows):
+            with transaction.atomic():
+                codes = self.create_chunk(chunk)
+            invite_filter.add(codes)
+            self.progress(self.stats)
+
+    @staticmethod
+    def _log_progress(stats):
+        logger.info(
+            f"Импорт: прочитано {stats.read}, создано {stats.created}, "
+            f"отклонено {stats.rejected}, {stats.rate:.1f} строк/с"
+        )
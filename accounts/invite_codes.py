@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Base32 Крокфорда: без I, L, O и U, которые легко спутать с 1, 0 и V
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+CODE_LENGTH = 8
+# 8 символов по 5 бит — 2^40 (около 10^12) различных кодов
+CODE_BITS = 5 * CODE_LENGTH
+HALF_BITS = CODE_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+FEISTEL_ROUNDS = 4
+# Номер блока занимает старшие биты порядкового номера кода, поэтому
+# размер блока задан константой: её изменение приведёт к пересечению
+# диапазонов уже выданных блоков
+BLOCK_BITS = 10
+BLOCK_SIZE = 1 << BLOCK_BITS
+
+
+def encode(number):
+    """Запись 40-битного числа восемью символами base32."""
+    chars = []
+    for _ in range(CODE_LENGTH):
+        number, index = divmod(number, 32)
+        chars.append(ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def decode(code):
+    number = 0
+    for char in code.upper():
+        number = number * 32 + ALPHABET.index(char)
+    return number
+
+
+class FeistelPermutation:
+    """
+    Ключевая перестановка 40-битных чисел (сеть Фейстеля).
+
+    Разные порядковые номера всегда дают разные коды, а соседние номера
+    превращаются в непредсказуемые коды без видимой последовательности.
+    """
+
+    def __init__(self, key):
+        self.key = key.encode() if isinstance(key, str) else key
+
+    def _round(self, round_index, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(4, "big"),
+            key=self.key[:64],
+            person=round_index.to_bytes(16, "big"),
+            digest_size=4,
+        ).digest()
+        return int.from_bytes(digest, "big") & HALF_MASK
+
+    @property
+    def fingerprint(self):
+        """Отпечаток ключа: по нему нельзя восстановить сам ключ."""
+        return hashlib.blake2b(b"invite-code-key", key=self.key[:64],
+                               digest_size=8).hexdigest()
+
+    def permute(self, number):
+        left, right = number >> HALF_BITS, number & HALF_MASK
+        for round_index in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(round_index, right)
+        return (left << HALF_BITS) | right
+
+    def invert(self, number):
+        left, right = number >> HALF_BITS, number & HALF_MASK
+        for round_index in reversed(range(FEISTEL_ROUNDS)):
+            left, right = right ^ self._round(round_index, left), left
+        return (left << HALF_BITS) | right
+
+
+class InviteCodeAllocator:
+    """
+    Выдача уникальных инвайт-кодов без обращения к БД на каждый код.
+
+    Процесс резервирует блок из ``BLOCK_SIZE`` порядковых номеров одной
+    вставкой в ``InviteCodeBlock``: номер блока берётся из
+    последовательности первичного ключа, которая не откатывается вместе
+    с транзакцией, поэтому два процесса никогда не получат один блок.
+    Номера блока раздаются из памяти и превращаются в коды перестановкой
+    Фейстеля. Неиспользованный остаток блока при перезапуске теряется.
+
+    Блок запоминает отпечаток ключа перестановки. Если ключ сменился,
+    новые коды могли бы совпасть с выданными, поэтому блоки не выдаются.
+    """
+
+    def __init__(self, key=None):
+        self._key = key
+        self._permutation = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._end = 0
+
+    @property
+    def permutation(self):
+        if self._permutation is None:
+            self._permutation = FeistelPermutation(
+                self._key or settings.INVITE_CODE_KEY
+            )
+        return self._permutation
+
+    def _allocate_block(self, using=None):
+        from .models import InviteCodeBlock
+
+        blocks = InviteCodeBlock.objects.using(using)
+        fingerprint = self.permutation.fingerprint
+        if blocks.exclude(key_fingerprint__in=["", fingerprint]).exists():
+            raise ImproperlyConfigured(
+                "INVITE_CODE_KEY не совпадает с ключом, которым выданы "
+                "инвайт-коды"
+            )
+        block = blocks.create(key_fingerprint=fingerprint)
+        return block.pk << BLOCK_BITS, (block.pk + 1) << BLOCK_BITS
+
+    def next_code(self, using=None):
+        """
+        Следующий свободный инвайт-код.
+
+        :param using: Алиас БД, в которой резервируется блок.
+        :return: Код из восьми символов base32 Крокфорда.
+        """
+        with self._lock:
+            # После fork дочерний процесс не должен продолжать блок
+            # родителя
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._next, self._end = self._allocate_block(using)
+                self._pid = os.getpid()
+            number = self._next
+            self._next += 1
+        return encode(self.permutation.permute(number))
+
+
+invite_code_allocator = InviteCodeAllocator()
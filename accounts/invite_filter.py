@@ -0,0 +1,258 @@
+import hashlib
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from .async_cache import get_async_redis
+from .invite_codes import CODE_LENGTH
+
+# Установка битов новых кодов одной атомарной операцией, чтобы она не
+# перемежалась с подменой карты в rebuild(). Биты ставятся только в
+# существующие карты: рабочая могла быть вытеснена из Redis, и частично
+# заполненная карта давала бы ложноотрицательные ответы.
+# KEYS: рабочая карта, строящаяся копия, ключи промахов кэша.
+# ARGV: номера битов.
+ADD_SCRIPT = """
+for i = 1, 2 do
+    if redis.call("EXISTS", KEYS[i]) == 1 then
+        for j = 1, #ARGV do
+            redis.call("SETBIT", KEYS[i], ARGV[j], 1)
+        end
+    end
+end
+for i = 3, #KEYS do
+    redis.call("DEL", KEYS[i])
+end
+return 0
+"""
+
+# Проверка кода и учёт результата за одно обращение к Redis. Готов, только
+# если карта на месте: после вытеснения ключа из Redis отметка о
+# готовности ещё может оставаться.
+# KEYS: отметка о готовности, рабочая карта, ключ промаха кэша, счётчики.
+# ARGV: номера битов.
+# Возвращает имя увеличенного счётчика.
+CHECK_SCRIPT = """
+local counter = "passed"
+if redis.call("EXISTS", KEYS[3]) == 1 then
+    counter = "negative_hits"
+elseif redis.call("EXISTS", KEYS[1], KEYS[2]) < 2 then
+    counter = "unavailable"
+else
+    for i = 1, #ARGV do
+        if redis.call("GETBIT", KEYS[2], ARGV[i]) == 0 then
+            counter = "rejected"
+            break
+        end
+    end
+end
+redis.call("HINCRBY", KEYS[4], counter, 1)
+return counter
+"""
+# Счётчики, при которых код нужно искать в БД
+PASSING = {"passed", "unavailable"}
+
+
+class InviteCodeFilter:
+    """
+    Фильтр Блума по всем выданным инвайт-кодам в битовой карте Redis.
+
+    Фильтр не даёт ложноотрицательных ответов, поэтому код, которого в нём
+    нет, отклоняется без запроса к БД. Ложноположительные ответы доходят
+    до БД, и промах запоминается в кэше на ``INVITE_CODE_MISS_TTL``
+    секунд. Пока фильтр не построен командой ``rebuild_invite_filter``
+    или если его битовая карта пропала из Redis, все коды проверяются
+    по БД.
+
+    Счётчики для подбора размера фильтра (см. :meth:`stats`):
+    ``rejected`` — отклонено фильтром, ``negative_hits`` — отклонено
+    кэшем промахов, ``passed`` — пропущено в БД, ``db_misses`` —
+    пропущено, но кода в БД нет (при построенном фильтре это
+    ложноположительные ответы), ``unavailable`` — фильтр не построен.
+    """
+
+    def __init__(self, capacity=None, error_rate=None, prefix="invite_code"):
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self.prefix = prefix
+        self._add = None
+        self._check = None
+
+    @property
+    def capacity(self):
+        return self._capacity or settings.INVITE_FILTER_CAPACITY
+
+    @property
+    def error_rate(self):
+        return self._error_rate or settings.INVITE_FILTER_ERROR_RATE
+
+    @property
+    def bits(self):
+        return math.ceil(
+            -self.capacity * math.log(self.error_rate) / math.log(2) ** 2
+        )
+
+    @property
+    def hashes(self):
+        return max(1, round(self.bits / self.capacity * math.log(2)))
+
+    def key(self, name):
+        return cache.make_key(f"{self.prefix}_{name}")
+
+    def miss_key(self, code):
+        return self.key(f"miss_{code}")
+
+    @property
+    def redis(self):
+        return get_redis_connection("default")
+
+    def positions(self, code):
+        # Двойное хеширование: k позиций из двух 64-битных хешей
+        digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        second = int.from_bytes(digest[8:], "big") | 1
+        bits = self.bits
+        return [(first + i * second) % bits for i in range(self.hashes)]
+
+    def _set_bits(self, pipe, key, codes):
+        args = []
+        for code in codes:
+            for position in self.positions(code):
+                args += ["SET", "u1", position, 1]
+        if args:
+            pipe.execute_command("BITFIELD", key, *args)
+
+    def add(self, codes, batch_size=1000):
+        """
+        Добавление новых кодов.
+
+        Если фильтр в этот момент перестраивается, коды попадают и в
+        строящуюся копию. Пакет из ``batch_size`` кодов добавляется
+        атомарно.
+        """
+        codes = [code for code in codes if code]
+        if self._add is None:
+            self._add = self.redis.register_script(ADD_SCRIPT)
+        for start in range(0, len(codes), batch_size):
+            batch = codes[start:start + batch_size]
+            self._add(
+                keys=[self.key("bloom"), self.key("bloom_building"),
+                      *[self.miss_key(code) for code in batch]],
+                args=[position for code in batch
+                      for position in self.positions(code)],
+            )
+
+    def might_exist(self, code):
+        """
+        Проверка кода перед обращением к БД.
+
+        :return: ``False``, если кода точно нет; ``True``, если код нужно
+            искать в БД.
+        """
+        if not code or len(code) > CODE_LENGTH:
+            return False
+        if self._check is None:
+            self._check = self.redis.register_script(CHECK_SCRIPT)
+        counter = self._check(keys=self._check_keys(code),
+                              args=self.positions(code))
+        return counter.decode() in PASSING
+
+    async def amight_exist(self, code):
+        """Асинхронный вариант :meth:`might_exist`."""
+        if not code or len(code) > CODE_LENGTH:
+            return False
+        script = get_async_redis().register_script(CHECK_SCRIPT)
+        counter = await script(keys=self._check_keys(code),
+                               args=self.positions(code))
+        return counter.decode() in PASSING
+
+    def _check_keys(self, code):
+        return [self.key("bloom_ready"), self.key("bloom"),
+                self.miss_key(code), self.key("bloom_stats")]
+
+    def record_miss(self, code):
+        """Запоминает код, которого не оказалось в БД."""
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_miss(pipe, code)
+        pipe.execute()
+
+    async def arecord_miss(self, code):
+        """Асинхронный вариант :meth:`record_miss`."""
+        pipe = get_async_redis().pipeline(transaction=False)
+        self._queue_miss(pipe, code)
+        await pipe.execute()
+
+    def _queue_miss(self, pipe, code):
+        pipe.set(self.miss_key(code), 1, ex=settings.INVITE_CODE_MISS_TTL)
+        pipe.hincrby(self.key("bloom_stats"), "db_misses")
+
+    def rebuild(self, codes, batch_size=1000):
+        """
+        Построение фильтра заново.
+
+        Копия строится рядом и атомарно подменяет рабочую битовую карту.
+
+        :param codes: Итерируемое всех выданных кодов.
+        :return: Число добавленных кодов.
+        """
+        redis = self.redis
+        building = self.key("bloom_building")
+        redis.delete(building)
+        # Сразу выделяем всю карту: по наличию ключа add() понимает, что
+        # идёт перестроение
+        redis.setbit(building, self.bits - 1, 0)
+
+        count = 0
+        batch = []
+        for code in codes:
+            batch.append(code)
+            if len(batch) == batch_size:
+                count += self._add_batch(building, batch)
+                batch = []
+        count += self._add_batch(building, batch)
+
+        pipe = redis.pipeline()
+        pipe.rename(building, self.key("bloom"))
+        pipe.set(self.key("bloom_ready"), 1)
+        pipe.execute()
+        return count
+
+    def _add_batch(self, key, codes):
+        codes = [code for code in codes if code]
+        pipe = self.redis.pipeline(transaction=False)
+        self._set_bits(pipe, key, codes)
+        pipe.execute()
+        return len(codes)
+
+    def stats(self):
+        """
+        Счётчики и оценка заполнения фильтра.
+
+        ``false_positive_rate`` — доля несуществующих кодов, прошедших
+        фильтр; ``expected_false_positive_rate`` — оценка по доле
+        установленных битов. Если они растут выше
+        ``INVITE_FILTER_ERROR_RATE``, нужно увеличить
+        ``INVITE_FILTER_CAPACITY`` и перестроить фильтр.
+        """
+        counters = {
+            name.decode(): int(value)
+            for name, value in
+            self.redis.hgetall(self.key("bloom_stats")).items()
+        }
+        fill = self.redis.bitcount(self.key("bloom")) / self.bits
+        unknown = counters.get("rejected", 0) + counters.get("db_misses", 0)
+        return {
+            **counters,
+            "bits": self.bits,
+            "hashes": self.hashes,
+            "fill_ratio": round(fill, 6),
+            "expected_false_positive_rate": round(fill ** self.hashes, 6),
+            "false_positive_rate": round(
+                counters.get("db_misses", 0) / unknown, 6
+            ) if unknown else 0,
+        }
+
+
+invite_filter = InviteCodeFilter()
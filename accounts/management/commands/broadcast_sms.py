@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.broadcast import BroadcastRunner
+from accounts.models import SMSCampaign
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовая рассылка SMS всем активным пользователям. "
+        "Прерванную рассылку можно продолжить, указав --campaign."
+    )
+
+    def add_arguments(self, parser):
+        group = parser.add_mutually_exclusive_group(required=True)
+        group.add_argument("--message", help="Текст новой рассылки.")
+        group.add_argument("--campaign", type=int,
+                           help="ID рассылки, которую нужно продолжить.")
+        parser.add_argument("--chunk-size", type=int,
+                            help="Размер порции получателей из БД.")
+        parser.add_argument("--concurrency", type=int,
+                            help="Число параллельных запросов к шлюзу.")
+        parser.add_argument("--rate", type=float,
+                            help="Ограничение скорости, сообщений в секунду.")
+
+    def handle(self, *args, **options):
+        if options["campaign"]:
+            try:
+                campaign = SMSCampaign.objects.get(pk=options["campaign"])
+            except SMSCampaign.DoesNotExist:
+                raise CommandError(
+                    f"Рассылка #{options['campaign']} не найдена."
+                )
+            if campaign.status == SMSCampaign.STATUS_FINISHED:
+                raise CommandError(f"Рассылка #{campaign.pk} уже завершена.")
+        else:
+            campaign = SMSCampaign.objects.create(message=options["message"])
+
+        self.stdout.write(
+            f"Рассылка #{campaign.pk}: начинаем после пользователя "
+            f"{campaign.last_user_id}"
+        )
+        runner = BroadcastRunner(
+            campaign,
+            chunk_size=options["chunk_size"],
+            concurrency=options["concurrency"],
+            rate=options["rate"],
+            progress=self.report,
+        )
+        if runner.run() is None:
+            raise CommandError(
+                f"Рассылка #{campaign.pk} выполняется другим процессом."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Рассылка #{campaign.pk} завершена: отправлено "
+            f"{campaign.sent}, ошибок {campaign.failed}"
+        ))
+
+    def report(self, campaign, rate):
+        self.stdout.write(
+            f"Отправлено {campaign.sent}, ошибок {campaign.failed}, "
+            f"{rate:.1f} сообщ./с"
+        )
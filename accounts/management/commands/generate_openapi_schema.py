@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from referral_project.drf_yasg import (
+    SCHEMA_FORMATS,
+    generate_schema,
+    schema_path,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Сборка схемы OpenAPI в OPENAPI_SCHEMA_DIR. Воркеры отдают готовый "
+        "файл и не обходят представления API при первом запросе."
+    )
+
+    def handle(self, *args, **options):
+        os.makedirs(settings.OPENAPI_SCHEMA_DIR, exist_ok=True)
+        for fmt in SCHEMA_FORMATS:
+            started = time.monotonic()
+            body = generate_schema(fmt)
+            with open(schema_path(fmt), "wb") as f:
+                f.write(body)
+            self.stdout.write(self.style.SUCCESS(
+                f"{schema_path(fmt)}: {len(body)} байт за "
+                f"{time.monotonic() - started:.2f} с"
+            ))
@@ -0,0 +1,67 @@
+import csv
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.importer import UserImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Массовый импорт пользователей из CSV или NDJSON. Ожидаются поля "
+        "phone_number и необязательное invited_by (номер пригласившего)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Файл для импорта, '-' — stdin.")
+        parser.add_argument("--format", choices=["csv", "ndjson"],
+                            help="Формат входа (по умолчанию по расширению).")
+        parser.add_argument("--chunk-size", type=int,
+                            help="Размер порции строк.")
+        parser.add_argument("--rejects",
+                            help="CSV-файл для отклонённых строк.")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or (
+            "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+        )
+        try:
+            source = (sys.stdin if path == "-"
+                      else open(path, encoding="utf-8", newline=""))
+        except OSError as e:
+            raise CommandError(f"Не удалось открыть {path}: {e}")
+
+        rejects_file = None
+        reject = None
+        if options["rejects"]:
+            rejects_file = open(options["rejects"], "w", encoding="utf-8",
+                                newline="")
+            writer = csv.writer(rejects_file)
+            writer.writerow(["line", "phone_number", "invited_by", "reason"])
+
+            def reject(line, row, reason):
+                writer.writerow([line, row.get("phone_number"),
+                                 row.get("invited_by"), reason])
+
+        importer = UserImporter(chunk_size=options["chunk_size"],
+                                reject=reject, progress=self.report)
+        try:
+            stats = importer.run(read_rows(source, fmt))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Импорт завершён: прочитано {stats.read}, создано "
+            f"{stats.created}, связано с пригласившими {stats.linked}, "
+            f"отклонено {stats.rejected}, {stats.rate:.1f} строк/с"
+        ))
+
+    def report(self, stats):
+        self.stdout.write(
+            f"Прочитано {stats.read}, создано {stats.created}, "
+            f"отклонено {stats.rejected}, {stats.rate:.1f} строк/с"
+        )
@@ -0,0 +1,34 @@
+import json
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from accounts.invite_filter import invite_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Перестроение фильтра Блума по инвайт-кодам. С --stats выводит "
+        "только счётчики фильтра."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stats", action="store_true",
+                            help="Показать счётчики без перестроения.")
+
+    def handle(self, *args, **options):
+        if not options["stats"]:
+            started = time.monotonic()
+            codes = (
+                get_user_model().objects
+                .exclude(invite_code="")
+                .values_list("invite_code", flat=True)
+                .iterator(chunk_size=10000)
+            )
+            count = invite_filter.rebuild(codes)
+            self.stdout.write(self.style.SUCCESS(
+                f"Фильтр построен: {count} кодов за "
+                f"{time.monotonic() - started:.1f} с"
+            ))
+        self.stdout.write(json.dumps(invite_filter.stats(), indent=2))
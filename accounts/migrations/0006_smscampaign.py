@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_alter_user_invite_code_alter_user_invited_by"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SMSCampaign",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("message", models.TextField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "В очереди"),
+                            ("running", "Выполняется"),
+                            ("finished", "Завершена"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("last_user_id", models.BigIntegerField(default=0)),
+                ("sent", models.PositiveIntegerField(default=0)),
+                ("failed", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
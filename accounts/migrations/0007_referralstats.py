@@ -0,0 +1,50 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:20
+
+import accounts.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rebuild_referral_stats(apps, schema_editor):
+    ReferralStats = apps.get_model("accounts", "ReferralStats")
+    ReferralStats.objects.db_manager(schema_editor.connection.alias).rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_smscampaign"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="invited_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ReferralStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="referral_stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("direct_count", models.PositiveIntegerField(default=0)),
+                ("total_descendants", models.PositiveIntegerField(default=0)),
+                ("last_invite_at",
+                 models.DateTimeField(blank=True, null=True)),
+            ],
+            managers=[
+                ("objects", accounts.models.ReferralStatsManager()),
+            ],
+        ),
+        migrations.RunPython(rebuild_referral_stats,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0007_referralstats"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(fields=["invited_by", "id"],
+                               name="user_invitees_keyset_idx"),
+        ),
+    ]
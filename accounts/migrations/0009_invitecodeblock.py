@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0008_user_invitees_keyset_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="InviteCodeBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(auto_created=True,
+                                        primary_key=True,
+                                        serialize=False,
+                                        verbose_name="ID"),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="invite_code",
+            field=models.CharField(blank=True, max_length=8, unique=True),
+        ),
+    ]
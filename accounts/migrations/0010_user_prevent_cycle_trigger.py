@@ -0,0 +1,62 @@
+from django.db import migrations
+
+# Перед сменой invited_by_id триггер проходит по цепочке новых
+# пригласивших и блокирует каждую строку FOR SHARE: встречная активация,
+# которая замкнула бы цикл, ждёт коммита и затем видит новую ссылку.
+CREATE_TRIGGER = """
+CREATE OR REPLACE FUNCTION accounts_user_prevent_cycle() RETURNS trigger AS $$
+DECLARE
+    ancestor bigint := NEW.invited_by_id;
+    depth integer := 0;
+BEGIN
+    WHILE ancestor IS NOT NULL LOOP
+        IF ancestor = NEW.id THEN
+            RAISE EXCEPTION 'invite cycle: user % is an ancestor of %',
+                NEW.id, NEW.invited_by_id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        depth := depth + 1;
+        IF depth > 10000 THEN
+            RAISE EXCEPTION 'invite chain of user % is too deep', NEW.id
+                USING ERRCODE = 'check_violation';
+        END IF;
+        SELECT invited_by_id INTO ancestor
+        FROM accounts_user WHERE id = ancestor FOR SHARE;
+    END LOOP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER accounts_user_prevent_cycle
+BEFORE UPDATE OF invited_by_id ON accounts_user
+FOR EACH ROW
+WHEN (NEW.invited_by_id IS NOT NULL
+      AND NEW.invited_by_id IS DISTINCT FROM OLD.invited_by_id)
+EXECUTE FUNCTION accounts_user_prevent_cycle();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS accounts_user_prevent_cycle ON accounts_user;
+DROP FUNCTION IF EXISTS accounts_user_prevent_cycle();
+"""
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_TRIGGER, params=None)
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_TRIGGER, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0009_invitecodeblock"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
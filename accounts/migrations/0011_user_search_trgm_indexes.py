@@ -0,0 +1,59 @@
+import logging
+
+from django.db import migrations
+
+logger = logging.getLogger(__name__)
+
+# Поиск подстроки в админке (LIKE '%...%') по триграммным индексам.
+# Префиксный поиск (LIKE '...%') использует индексы *_like, которые
+# PostgreSQL-бэкенд Django создаёт для уникальных полей. Индексы строятся
+# CONCURRENTLY, не блокируя запись в большую таблицу.
+CREATE_INDEXES = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_phone_trgm_idx "
+    "ON accounts_user USING gin (phone_number gin_trgm_ops)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_user_code_trgm_idx "
+    "ON accounts_user USING gin (invite_code gin_trgm_ops)",
+]
+
+DROP_INDEXES = [
+    "DROP INDEX CONCURRENTLY IF EXISTS accounts_user_phone_trgm_idx",
+    "DROP INDEX CONCURRENTLY IF EXISTS accounts_user_code_trgm_idx",
+]
+
+
+def create_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'"
+        )
+        if cursor.fetchone() is None:
+            logger.warning(
+                "Расширение pg_trgm недоступно, поиск подстроки в админке "
+                "будет работать без индекса"
+            )
+            return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm",
+                          params=None)
+    for sql in CREATE_INDEXES:
+        schema_editor.execute(sql, params=None)
+
+
+def drop_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        for sql in DROP_INDEXES:
+            schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY нельзя выполнять в транзакции
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0010_user_prevent_cycle_trigger"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
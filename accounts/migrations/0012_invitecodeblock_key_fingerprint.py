@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0011_user_search_trgm_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="invitecodeblock",
+            name="key_fingerprint",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
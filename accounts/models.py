@@ -1,22 +1,53 @@
-import uuid
-
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
-from django.db import models
+from django.conf import settings
+from django.db import (
+    IntegrityError,
+    OperationalError,
+    connections,
+    models,
+    router,
+    transaction,
+)
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .invite_codes import invite_code_allocator
+
+
+class WriteDatabaseMixin:
 
+    @property
+    def write_db(self):
+        # Manager.db выбирается роутером для чтения и может указывать на
+        # реплику; транзакции и сырые запросы на запись идут сюда
+        return self._db or router.db_for_write(self.model)
 
-class UserManager(BaseUserManager):
+
+class UserManager(WriteDatabaseMixin, BaseUserManager):
+    # Результаты activate_invite
+    ACTIVATED = "activated"
+    CODE_NOT_FOUND = "code_not_found"
+    ALREADY_ACTIVATED = "already_activated"
+    OWN_CODE = "own_code"
+    CYCLE = "cycle"
 
     def create_user(self, phone_number, password=None, **extra_fields):
         if not phone_number:
             raise ValueError("Номер телефона должен быть установлен")
         user = self.model(phone_number=phone_number, **extra_fields)
         user.set_password(password)
-        user.invite_code = self.generate_invite_code()
-        user.save(using=self._db)
+        if not user.invite_code:
+            user.invite_code = self.generate_invite_code()
+        if user.invited_by_id and not user.invited_at:
+            user.invited_at = timezone.now()
+        # Статистику приглашений обновляет сигнал post_save
+        with transaction.atomic(using=self._db):
+            user.save(using=self._db)
         return user
 
     def create_superuser(self, phone_number, password=None, **extra_fields):
@@ -24,13 +55,257 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         return self.create_user(phone_number, password, **extra_fields)
 
+    def bulk_import(self, rows, **kwargs):
+        """
+        Массовое создание пользователей, см.
+        :class:`accounts.importer.UserImporter`.
+
+        :return: ImportStats со счётчиками импорта.
+        """
+        from .importer import UserImporter
+
+        return UserImporter(**kwargs).run(rows)
+
+    def activate_invite(self, user, invite_code, retries=3):
+        """
+        Активация инвайт-кода одним условным UPDATE.
+
+        Поиск пригласившего по коду и проверка ``invited_by IS NULL``
+        выполняются в самом UPDATE, поэтому из параллельных запросов
+        успешен только один; id пригласившего возвращает RETURNING. Цикл
+        в дереве приглашений (A пригласил B, B пригласил A) в PostgreSQL
+        отклоняет триггер ``accounts_user_prevent_cycle``; на других СУБД
+        проверка выполняется запросом перед UPDATE.
+
+        :param user: Пользователь, активирующий код. При успехе у него
+            обновляются ``invited_by_id`` и ``invited_at``.
+        :param invite_code: Инвайт-код пригласившего.
+        :param retries: Число попыток при взаимной блокировке.
+        :return: Кортеж (результат, цепочка). Результат — одна из констант
+            ``ACTIVATED``, ``CODE_NOT_FOUND``, ``ALREADY_ACTIVATED``,
+            ``OWN_CODE``, ``CYCLE``; цепочка — id пригласившего и всех его
+            предков, у которых изменилась статистика (пустая, если код не
+            активирован).
+        """
+        now = timezone.now()
+        db = self.write_db
+        connection = connections[db]
+        if connection.vendor != "postgresql":
+            inviter_id = self.filter(invite_code=invite_code).exclude(
+                pk=user.pk
+            ).values_list("pk", flat=True).first()
+            if inviter_id and any(
+                ancestor.pk == user.pk
+                for ancestor in self.ancestors(inviter_id)
+            ):
+                return self.CYCLE, []
+
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        for attempt in range(retries):
+            try:
+                with transaction.atomic(using=db):
+                    with connection.cursor() as cursor:
+                        cursor.execute(
+                            f"""
+                            UPDATE {table}
+                            SET invited_by_id = inviter.id, invited_at = %s
+                            FROM (
+                                SELECT id FROM {table}
+                                WHERE invite_code = %s AND id <> %s
+                            ) inviter
+                            WHERE {table}.id = %s
+                                AND {table}.invited_by_id IS NULL
+                            RETURNING {table}.invited_by_id
+                            """,
+                            [connection.ops.adapt_datetimefield_value(now),
+                             invite_code, user.pk, user.pk],
+                        )
+                        row = cursor.fetchone()
+                    if row:
+                        user.invited_by_id = row[0]
+                        user.invited_at = now
+                        chain = ReferralStats.objects.record_invite(user)
+                        return self.ACTIVATED, chain
+                break
+            except IntegrityError:
+                return self.CYCLE, []
+            except OperationalError as e:
+                # Встречные активации (A -> B и B -> A) блокируют строки
+                # друг друга в триггере; PostgreSQL прерывает одну из них
+                cause = e.__cause__
+                sqlstate = (getattr(cause, "sqlstate", None)
+                            or getattr(cause, "pgcode", None))
+                deadlock = sqlstate == "40P01"
+                if not deadlock or attempt == retries - 1:
+                    raise
+
+        # Причину отказа определяем там же, где проверялось условие UPDATE:
+        # реплика могла ещё не получить новый код
+        owner_id = self.using(db).filter(
+            invite_code=invite_code
+        ).values_list("pk", flat=True).first()
+        if owner_id is None:
+            return self.CODE_NOT_FOUND, []
+        if owner_id == user.pk:
+            return self.OWN_CODE, []
+        return self.ALREADY_ACTIVATED, []
+
     def generate_invite_code(self):
-        return uuid.uuid4().hex[:6].upper()
+        return invite_code_allocator.next_code(using=self._db)
+
+    def invitees_page(self, user, after=None, limit=None):
+        """
+        Страница прямых приглашённых с пагинацией по ключу (pk).
+
+        :param user: Пользователь или его pk.
+        :param after: pk последнего приглашённого предыдущей страницы.
+        :param limit: Размер страницы.
+        :return: Кортеж (список телефонов, курсор следующей страницы или
+            ``None``).
+        """
+        queryset, limit = self._invitees_query(user, after, limit)
+        return self._invitees_result(list(queryset), limit)
+
+    async def ainvitees_page(self, user, after=None, limit=None):
+        """Асинхронный вариант :meth:`invitees_page`."""
+        queryset, limit = self._invitees_query(user, after, limit)
+        return self._invitees_result([row async for row in queryset], limit)
+
+    def _invitees_query(self, user, after, limit):
+        limit = max(1, min(limit or settings.INVITEES_PAGE_SIZE,
+                           settings.INVITEES_MAX_PAGE_SIZE))
+        queryset = self.filter(
+            invited_by_id=getattr(user, "pk", user)
+        ).order_by("pk")
+        if after:
+            queryset = queryset.filter(pk__gt=after)
+        return queryset.values_list("pk", "phone_number")[:limit + 1], limit
+
+    @staticmethod
+    def _invitees_result(rows, limit):
+        next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+        return [phone for _, phone in rows[:limit]], next_cursor
+
+    # Дерево приглашений. Все запросы строятся на рекурсивных CTE
+    # (WITH RECURSIVE), которые одинаково поддерживают PostgreSQL и
+    # SQLite, поэтому любой обход дерева — один SQL-запрос. Глубина
+    # обхода всегда ограничена, что защищает и от циклов в данных.
+
+    def _tree_sql(self):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        descendants = f"""
+            WITH RECURSIVE tree(id, depth) AS (
+                SELECT id, 1 FROM {table} WHERE invited_by_id = %s
+                UNION ALL
+                SELECT u.id, tree.depth + 1
+                FROM {table} u JOIN tree ON u.invited_by_id = tree.id
+                WHERE tree.depth < %s
+            )
+        """
+        ancestors = f"""
+            WITH RECURSIVE chain(id, invited_by_id, depth) AS (
+                SELECT id, invited_by_id, 0 FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT u.id, u.invited_by_id, chain.depth + 1
+                FROM {table} u JOIN chain ON u.id = chain.invited_by_id
+                WHERE chain.depth < %s
+            )
+        """
+        return table, descendants, ancestors
+
+    @staticmethod
+    def _depth(max_depth):
+        return max_depth or settings.REFERRAL_MAX_DEPTH
+
+    def descendants(self, user, max_depth=None, limit=None):
+        """
+        Приглашённые пользователем на всех уровнях, включая рефералов
+        рефералов.
+
+        :param user: Пользователь или его pk.
+        :param max_depth: Максимальная глубина (1 — только прямые).
+        :param limit: Максимальное число записей.
+        :return: RawQuerySet пользователей с атрибутом ``depth``,
+            упорядоченный по глубине.
+        """
+        table, cte, _ = self._tree_sql()
+        limit = limit or settings.REFERRAL_RESULT_LIMIT
+        return self.raw(
+            f"""{cte}
+            SELECT u.*, tree.depth FROM tree JOIN {table} u ON u.id = tree.id
+            ORDER BY tree.depth, u.id
+            LIMIT %s""",
+            [getattr(user, "pk", user), self._depth(max_depth), limit],
+        )
+
+    def iter_descendants(self, user, max_depth=None, chunk_size=2000):
+        """
+        Потоковый обход большого поддерева через серверный курсор.
+
+        :return: Генератор кортежей (id, phone_number, invited_by_id, depth).
+        """
+        table, cte, _ = self._tree_sql()
+        with connections[self.db].chunked_cursor() as cursor:
+            cursor.execute(
+                f"""{cte}
+                SELECT u.id, u.phone_number, u.invited_by_id, tree.depth
+                FROM tree JOIN {table} u ON u.id = tree.id
+                ORDER BY tree.depth, u.id""",
+                [getattr(user, "pk", user), self._depth(max_depth)],
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    return
+                yield from rows
+
+    def ancestors(self, user, max_depth=None):
+        """
+        Цепочка пригласивших: от того, кто пригласил пользователя, к корню.
+
+        :return: RawQuerySet пользователей с атрибутом ``depth``.
+        """
+        table, _, cte = self._tree_sql()
+        return self.raw(
+            f"""{cte}
+            SELECT u.*, chain.depth
+            FROM chain JOIN {table} u ON u.id = chain.id
+            WHERE chain.depth > 0
+            ORDER BY chain.depth""",
+            [getattr(user, "pk", user), self._depth(max_depth)],
+        )
+
+    def depth_counts(self, user, max_depth=None):
+        """
+        Число приглашённых на каждом уровне дерева.
+
+        :return: Словарь ``{глубина: количество}``.
+        """
+        _, cte, _ = self._tree_sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"""{cte}
+                SELECT depth, COUNT(*) FROM tree
+                GROUP BY depth ORDER BY depth""",
+                [getattr(user, "pk", user), self._depth(max_depth)],
+            )
+            return dict(cursor.fetchall())
+
+    def subtree_size(self, user, max_depth=None):
+        """Общее число приглашённых на всех уровнях."""
+        _, cte, _ = self._tree_sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f"{cte} SELECT COUNT(*) FROM tree",
+                [getattr(user, "pk", user), self._depth(max_depth)],
+            )
+            return cursor.fetchone()[0]
 
 
 class User(AbstractBaseUser, PermissionsMixin):
     phone_number = models.CharField(max_length=15, unique=True)
-    invite_code = models.CharField(max_length=6, unique=True, blank=True)
+    invite_code = models.CharField(max_length=8, unique=True, blank=True)
     invited_by = models.ForeignKey(
         "self",
         null=True,
@@ -38,6 +313,7 @@ class User(AbstractBaseUser, PermissionsMixin):
         on_delete=models.SET_NULL,
         related_name="invitees",
     )
+    invited_at = models.DateTimeField(null=True, blank=True)
 
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
@@ -47,5 +323,214 @@ class User(AbstractBaseUser, PermissionsMixin):
     USERNAME_FIELD = "phone_number"
     REQUIRED_FIELDS = []
 
+    class Meta:
+        indexes = [
+            # Постраничный вывод приглашённых: invited_by_id = X AND id > Y
+            models.Index(fields=["invited_by", "id"],
+                         name="user_invitees_keyset_idx"),
+        ]
+
     def __str__(self):
         return self.phone_number
+
+
+class InviteCodeBlock(models.Model):
+    """
+    Зарезервированный блок порядковых номеров инвайт-кодов.
+
+    Первичный ключ задаёт диапазон номеров блока (см.
+    ``accounts.invite_codes``), отпечаток — ключ перестановки, которым
+    выдавались коды блока.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Пусто у блоков, выданных до появления отпечатка
+    key_fingerprint = models.CharField(max_length=16, blank=True)
+
+    def __str__(self):
+        return f"Блок инвайт-кодов #{self.pk}"
+
+
+class SMSCampaign(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_FINISHED = "finished"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "В очереди"),
+        (STATUS_RUNNING, "Выполняется"),
+        (STATUS_FINISHED, "Завершена"),
+    ]
+
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES,
+                              default=STATUS_PENDING)
+    # Контрольная точка: все пользователи с pk <= last_user_id обработаны
+    last_user_id = models.BigIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Рассылка #{self.pk} ({self.get_status_display()})"
+
+
+class ReferralStatsManager(WriteDatabaseMixin, models.Manager):
+    # Нужен миграции, которая заполняет таблицу по существующим данным
+    use_in_migrations = True
+
+    def for_user(self, user):
+        """
+        Статистика пользователя одним запросом по первичному ключу.
+
+        :return: ReferralStats; для пользователя без приглашённых —
+            несохранённый объект с нулями.
+        """
+        pk = getattr(user, "pk", user)
+        return self.filter(user_id=pk).first() or self.model(user_id=pk)
+
+    async def afor_user(self, user):
+        """Асинхронный вариант :meth:`for_user`."""
+        pk = getattr(user, "pk", user)
+        return (await self.filter(user_id=pk).afirst()
+                or self.model(user_id=pk))
+
+    def record_invite(self, invitee):
+        """
+        Инкрементальное обновление статистики после того, как
+        пользователю ``invitee`` назначили пригласившего.
+
+        Пригласивший получает +1 к прямым приглашениям, а все его предки —
+        приглашённого вместе с его собственным поддеревом.
+
+        :return: Список id пригласившего и всех его предков.
+        """
+        # invitee может быть пользователем из claims токена, а не моделью
+        user_model = self.model._meta.get_field("user").related_model
+        ancestor_ids = [
+            user.pk for user in user_model.objects.ancestors(invitee)
+        ]
+        own = self.filter(user_id=invitee.pk).values_list(
+            "total_descendants", flat=True
+        ).first()
+        added = 1 + (own or 0)
+
+        with transaction.atomic(using=self.write_db):
+            self.bulk_create(
+                [self.model(user_id=pk) for pk in ancestor_ids],
+                ignore_conflicts=True,
+            )
+            self.filter(user_id__in=ancestor_ids).update(
+                total_descendants=F("total_descendants") + added
+            )
+            self.filter(user_id=invitee.invited_by_id).update(
+                direct_count=F("direct_count") + 1,
+                last_invite_at=invitee.invited_at or timezone.now(),
+            )
+        return ancestor_ids
+
+    def record_uninvite(self, invitee, inviter_id):
+        """
+        Обратное :meth:`record_invite`: пользователя ``invitee`` отвязали
+        от пригласившего ``inviter_id`` (смена пригласившего в админке или
+        удаление пользователя).
+
+        Пригласивший теряет одно прямое приглашение, а он и все его
+        предки — приглашённого вместе с его поддеревом.
+
+        :return: Список id бывшего пригласившего и всех его предков.
+        """
+        user_model = self.model._meta.get_field("user").related_model
+        with transaction.atomic(using=self.write_db):
+            chain_ids = [inviter_id] + [
+                user.pk for user in user_model.objects.ancestors(inviter_id)
+            ]
+            own = self.filter(user_id=invitee.pk).values_list(
+                "total_descendants", flat=True
+            ).first()
+            removed = 1 + (own or 0)
+            self.filter(user_id__in=chain_ids).update(
+                total_descendants=Greatest(
+                    F("total_descendants") - removed, 0
+                )
+            )
+            self.filter(user_id=inviter_id).update(
+                direct_count=Greatest(F("direct_count") - 1, 0)
+            )
+        return chain_ids
+
+    def rebuild(self):
+        """
+        Полный пересчёт статистики по таблице пользователей.
+
+        Прямые приглашения считаются группировкой по invited_by_id, все
+        потомки — рекурсивным CTE по всем парам (предок, потомок).
+        Строки создаются только для пользователей с приглашёнными.
+
+        :return: Число созданных строк.
+        """
+        db = self.write_db
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        stats = qn(self.model._meta.db_table)
+        users = qn(self.model._meta.get_field("user").related_model
+                   ._meta.db_table)
+        with transaction.atomic(using=db):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DELETE FROM {stats}")
+                cursor.execute(
+                    f"""
+                    INSERT INTO {stats}
+                        (user_id, direct_count, total_descendants,
+                         last_invite_at)
+                    WITH RECURSIVE closure(ancestor_id, id, depth) AS (
+                        SELECT invited_by_id, id, 1 FROM {users}
+                        WHERE invited_by_id IS NOT NULL
+                        UNION ALL
+                        SELECT closure.ancestor_id, u.id, closure.depth + 1
+                        FROM {users} u JOIN closure
+                            ON u.invited_by_id = closure.id
+                        WHERE closure.depth < %s
+                    )
+                    SELECT direct.invited_by_id, direct.direct_count,
+                           total.total_descendants, direct.last_invite_at
+                    FROM (
+                        SELECT invited_by_id, COUNT(*) AS direct_count,
+                               MAX(invited_at) AS last_invite_at
+                        FROM {users}
+                        WHERE invited_by_id IS NOT NULL
+                        GROUP BY invited_by_id
+                    ) direct
+                    JOIN (
+                        SELECT ancestor_id, COUNT(*) AS total_descendants
+                        FROM closure GROUP BY ancestor_id
+                    ) total ON total.ancestor_id = direct.invited_by_id
+                    """,
+                    [settings.REFERRAL_MAX_DEPTH],
+                )
+                return cursor.rowcount
+
+
+class ReferralStats(models.Model):
+    """
+    Денормализованная статистика приглашений пользователя.
+
+    Обновляется инкрементально при активации инвайт-кода, смене
+    пригласившего и удалении пользователя (``signals.py``) и полностью
+    пересчитывается командой ``rebuild_referral_stats``.
+    """
+
+    user = models.OneToOneField(
+        User,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="referral_stats",
+    )
+    direct_count = models.PositiveIntegerField(default=0)
+    total_descendants = models.PositiveIntegerField(default=0)
+    last_invite_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ReferralStatsManager()
+
+    def __str__(self):
+        return f"Статистика {self.user_id}"
@@ -0,0 +1,146 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from referral_project.metrics import observe_otp
+
+from .async_cache import get_async_redis
+
+# Код хранится в хеше {code, attempts[, locked]}. Новый код не выдаётся,
+# пока номер заблокирован после исчерпания попыток.
+# ARGV: код, время жизни кода в секундах.
+ISSUE_SCRIPT = """
+if redis.call("HEXISTS", KEYS[1], "locked") == 1 then
+    return 0
+end
+redis.call("DEL", KEYS[1])
+redis.call("HSET", KEYS[1], "code", ARGV[1], "attempts", 0)
+redis.call("EXPIRE", KEYS[1], ARGV[2])
+return 1
+"""
+
+# Проверка и погашение кода одной атомарной операцией: верный код
+# удаляется сразу, поэтому его нельзя использовать дважды. Неверная
+# попытка увеличивает счётчик, после N неудач номер блокируется.
+# ARGV: введённый код, максимум попыток, время блокировки в секундах.
+VERIFY_SCRIPT = """
+local state = redis.call("HMGET", KEYS[1], "code", "locked")
+if not state[1] then
+    return -1
+end
+if state[2] then
+    return -2
+end
+if state[1] == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+    return 1
+end
+local attempts = redis.call("HINCRBY", KEYS[1], "attempts", 1)
+if attempts >= tonumber(ARGV[2]) then
+    redis.call("HSET", KEYS[1], "locked", 1)
+    redis.call("EXPIRE", KEYS[1], ARGV[3])
+    return -2
+end
+return 0
+"""
+
+
+class OTPStore:
+    """
+    Хранилище кодов подтверждения в Redis.
+
+    Выдача и проверка кода выполняются Lua-скриптами, то есть каждая
+    операция — один сетевой запрос к Redis без гонок между воркерами.
+    Методы с префиксом ``a`` — варианты для async-представлений.
+    """
+
+    VERIFIED = 1
+    INVALID = 0
+    EXPIRED = -1
+    LOCKED = -2
+
+    def __init__(self, prefix="otp"):
+        self.prefix = prefix
+        self._issue = None
+        self._verify = None
+
+    def key(self, phone):
+        return cache.make_key(f"{self.prefix}_{phone}")
+
+    def _scripts(self):
+        if self._issue is None:
+            redis = get_redis_connection("default")
+            self._issue = redis.register_script(ISSUE_SCRIPT)
+            self._verify = redis.register_script(VERIFY_SCRIPT)
+        return self._issue, self._verify
+
+    def issue(self, phone, code, ttl=None):
+        """
+        Сохранение нового кода для номера.
+
+        :param phone: Номер телефона в формате E.164 без знака '+'.
+        :param code: Код подтверждения.
+        :param ttl: Время жизни кода в секундах.
+        :return: ``False``, если номер заблокирован после неудачных попыток.
+        """
+        issue, _ = self._scripts()
+        ttl = ttl or settings.OTP_CODE_TTL
+        started = time.perf_counter()
+        issued = bool(issue(keys=[self.key(phone)], args=[code, ttl]))
+        observe_otp("issue", started, self._issue_result(issued))
+        return issued
+
+    async def aissue(self, phone, code, ttl=None):
+        """Асинхронный вариант :meth:`issue`."""
+        issue = get_async_redis().register_script(ISSUE_SCRIPT)
+        ttl = ttl or settings.OTP_CODE_TTL
+        started = time.perf_counter()
+        issued = bool(await issue(keys=[self.key(phone)], args=[code, ttl]))
+        observe_otp("issue", started, self._issue_result(issued))
+        return issued
+
+    def verify(self, phone, code):
+        """
+        Проверка и погашение кода.
+
+        :param phone: Номер телефона в формате E.164 без знака '+'.
+        :param code: Введённый пользователем код.
+        :return: Одна из констант ``VERIFIED``, ``INVALID``, ``EXPIRED``,
+            ``LOCKED``.
+        """
+        if phone is None or not code:
+            return self.EXPIRED if phone is None else self.INVALID
+        _, verify = self._scripts()
+        started = time.perf_counter()
+        result = verify(keys=[self.key(phone)], args=self._verify_args(code))
+        observe_otp("verify", started, self._verify_result(result))
+        return result
+
+    async def averify(self, phone, code):
+        """Асинхронный вариант :meth:`verify`."""
+        if phone is None or not code:
+            return self.EXPIRED if phone is None else self.INVALID
+        verify = get_async_redis().register_script(VERIFY_SCRIPT)
+        started = time.perf_counter()
+        result = await verify(keys=[self.key(phone)],
+                              args=self._verify_args(code))
+        observe_otp("verify", started, self._verify_result(result))
+        return result
+
+    @staticmethod
+    def _verify_args(code):
+        return [code, settings.OTP_MAX_ATTEMPTS, settings.OTP_LOCK_TIME]
+
+    @staticmethod
+    def _issue_result(issued):
+        return "stored" if issued else "locked"
+
+    def _verify_result(self, result):
+        if result == self.EXPIRED:
+            return "miss"
+        return "locked" if result == self.LOCKED else "hit"
+
+
+otp_store = OTPStore()
@@ -0,0 +1,89 @@
+import functools
+import logging
+import re
+
+import phonenumbers
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Номер уже в формате E.164: его не нужно переформатировать
+CANONICAL_PHONE = re.compile(r"^\+[1-9]\d{6,14}$")
+# Символы, которые допустимы в записи номера помимо цифр
+PHONE_PUNCTUATION = re.compile(r"[\s()\-.]")
+# Всё, кроме цифр: для поиска по фрагменту номера
+NON_DIGITS = re.compile(r"\D")
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=settings.PHONE_NORMALIZE_CACHE_SIZE)
+def _normalize(raw):
+    if CANONICAL_PHONE.match(raw):
+        try:
+            parsed = phonenumbers.parse(raw, None)
+        except phonenumbers.NumberParseException:
+            return None
+        return raw if phonenumbers.is_valid_number(parsed) else None
+
+    # Отсекаем заведомо неверный ввод без обращения к метаданным
+    compact = PHONE_PUNCTUATION.sub("", raw)
+    digits = compact[1:] if compact.startswith("+") else compact
+    if not digits.isdigit() or not 7 <= len(digits) <= 15:
+        return None
+
+    try:
+        parsed = phonenumbers.parse(raw, None)
+    except phonenumbers.NumberParseException:
+        return None
+    if not phonenumbers.is_valid_number(parsed):
+        return None
+    return phonenumbers.format_number(parsed,
+                                      phonenumbers.PhoneNumberFormat.E164)
+
+
+def normalize_phone(raw):
+    """
+    Приведение номера телефона к формату E.164.
+
+    Результаты, включая неверные номера, кэшируются в памяти процесса.
+
+    :param raw: Номер в том виде, в каком его ввёл пользователь.
+    :return: Номер в формате E.164, например ``+79174044144``.
+    :raises InvalidPhoneNumber: Если номер не удалось распознать.
+    """
+    phone = _normalize(raw.strip()) if raw else None
+    if phone is None:
+        raise InvalidPhoneNumber("Неверный номер телефона")
+    return phone
+
+
+def normalize_phones(values):
+    """
+    Пакетная нормализация списка номеров.
+
+    :param values: Итерируемое номеров в произвольном формате.
+    :return: Генератор пар (исходное значение, номер E.164 или ``None``).
+    """
+    for raw in values:
+        yield raw, _normalize(raw.strip()) if raw else None
+
+
+def preload_metadata(regions=None):
+    """
+    Загрузка метаданных phonenumbers для заданных регионов.
+
+    Вызывается при старте воркера, чтобы первый запрос не тратил время
+    на чтение метаданных и компиляцию регулярных выражений.
+    """
+    regions = settings.PHONE_PRELOAD_REGIONS if regions is None else regions
+    for region in regions:
+        example = phonenumbers.example_number(region)
+        if example is None:
+            logger.warning(f"Нет метаданных phonenumbers для {region}")
+            continue
+        _normalize(phonenumbers.format_number(
+            example, phonenumbers.PhoneNumberFormat.E164
+        ))
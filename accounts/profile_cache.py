@@ -0,0 +1,176 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django_redis import get_redis_connection
+from rest_framework.renderers import JSONRenderer
+
+from referral_project import db_router
+
+from .async_cache import get_async_redis
+from .models import ReferralStats
+
+# Собранный профиль кладётся в кэш, только если версия профиля не
+# изменилась с момента чтения кэша. Иначе запрос, собравший профиль по
+# данным до коммита, записал бы устаревшее тело уже после сброса кэша
+# сигналом, и оно жило бы весь PROFILE_CACHE_TTL.
+# KEYS: тело, версия; ARGV: прочитанная версия ("" — не было), тело, TTL.
+SET_IF_CURRENT_SCRIPT = """
+if (redis.call("GET", KEYS[2]) or "") ~= ARGV[1] then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+return 1
+"""
+
+# Сброс профилей: тело удаляется, версия увеличивается.
+# KEYS: пары (тело, версия); ARGV: время жизни версии.
+INVALIDATE_SCRIPT = """
+for i = 1, #KEYS, 2 do
+    redis.call("DEL", KEYS[i])
+    redis.call("INCR", KEYS[i + 1])
+    redis.call("EXPIRE", KEYS[i + 1], ARGV[1])
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def _script(source):
+    script = _scripts.get(source)
+    if script is None:
+        script = get_redis_connection("default").register_script(source)
+        _scripts[source] = script
+    return script
+
+
+def profile_cache_key(user_id):
+    return f"profile_json_{user_id}"
+
+
+def profile_version_key(user_id):
+    return f"profile_version_{user_id}"
+
+
+def _redis_keys(user_id):
+    return [cache.make_key(profile_cache_key(user_id)),
+            cache.make_key(profile_version_key(user_id))]
+
+
+def invitees_next_url(next_cursor, limit=None):
+    """Относительная ссылка на следующую страницу приглашённых."""
+    if next_cursor is None:
+        return None
+    query = {"after": next_cursor}
+    if limit:
+        query["limit"] = limit
+    return f"{reverse('api_profile_invitees')}?{urlencode(query)}"
+
+
+PROFILE_FIELDS = ("phone_number", "invite_code", "invited_by__phone_number")
+
+
+def build_profile(user):
+    """
+    Данные профиля пользователя для API.
+
+    Поля пользователя читаются из БД по ``user.pk``: при аутентификации по
+    claims токена (``accounts.authentication``) объект пользователя не
+    загружается из таблицы.
+    """
+    users = get_user_model().objects
+    row = users.filter(pk=user.pk).values(*PROFILE_FIELDS).get()
+    stats = ReferralStats.objects.for_user(user)
+    # В профиле только первая страница, остальное — через InviteesAPIView
+    page = users.invitees_page(user)
+    return _profile_data(row, stats, page)
+
+
+async def abuild_profile(user):
+    """Асинхронный вариант :func:`build_profile`."""
+    users = get_user_model().objects
+    row = await users.filter(pk=user.pk).values(*PROFILE_FIELDS).aget()
+    stats = await ReferralStats.objects.afor_user(user)
+    page = await users.ainvitees_page(user)
+    return _profile_data(row, stats, page)
+
+
+def _profile_data(row, stats, page):
+    invited_users, next_cursor = page
+    return {
+        "phone_number": row["phone_number"],
+        "invite_code": row["invite_code"],
+        "invited_by": row["invited_by__phone_number"],
+        "invited_count": stats.direct_count,
+        "total_referrals": stats.total_descendants,
+        "invited_users": invited_users,
+        "invited_users_next": invitees_next_url(next_cursor),
+    }
+
+
+def get_profile_json(user):
+    """
+    Профиль в виде готового JSON из кэша.
+
+    Тело и версия профиля читаются одной командой MGET. При промахе
+    профиль собирается, сериализуется один раз и кладётся в кэш вместе с
+    ETag, если версию за это время не сменил сброс из ``signals.py``.
+    Собирается профиль из основной БД: данные отстающей реплики остались
+    бы в кэше на весь ``PROFILE_CACHE_TTL`` и после сброса сигналом.
+
+    :return: Кортеж (ETag, тело ответа в байтах).
+    """
+    keys = _redis_keys(user.pk)
+    cached, version = get_redis_connection("default").mget(keys)
+    if cached is not None:
+        return cache.client.decode(cached)
+
+    with db_router.use_primary():
+        cached = _render_profile(build_profile(user))
+    _script(SET_IF_CURRENT_SCRIPT)(
+        keys=keys, args=_set_args(version, cached)
+    )
+    return cached
+
+
+async def aget_profile_json(user):
+    """Асинхронный вариант :func:`get_profile_json`."""
+    redis = get_async_redis()
+    keys = _redis_keys(user.pk)
+    cached, version = await redis.mget(keys)
+    if cached is not None:
+        return cache.client.decode(cached)
+
+    with db_router.use_primary():
+        cached = _render_profile(await abuild_profile(user))
+    await redis.register_script(SET_IF_CURRENT_SCRIPT)(
+        keys=keys, args=_set_args(version, cached)
+    )
+    return cached
+
+
+def _set_args(version, cached):
+    return [version or "", cache.client.encode(cached),
+            settings.PROFILE_CACHE_TTL]
+
+
+def _render_profile(data):
+    body = JSONRenderer().render(data)
+    return f'"{hashlib.md5(body).hexdigest()}"', body
+
+
+def invalidate_profiles(user_ids):
+    """
+    Сброс закэшированных профилей пользователей.
+
+    Вместе с телом меняется версия профиля, поэтому запрос, который
+    собирал профиль до сброса, уже не запишет его в кэш.
+    """
+    keys = [key for pk in set(user_ids) if pk for key in _redis_keys(pk)]
+    if keys:
+        _script(INVALIDATE_SCRIPT)(keys=keys,
+                                   args=[settings.PROFILE_CACHE_TTL])
@@ -0,0 +1,181 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from phonenumbers import COUNTRY_CODE_TO_REGION_CODE
+
+from .async_cache import get_async_redis
+
+# Ведро с токенами для нескольких ключей сразу. Запрос проходит, только
+# если токен есть во всех вёдрах; иначе ни одно ведро не списывается и
+# возвращается номер отказавшего ведра и время до появления токена.
+# ARGV: now, затем пары (ёмкость, скорость пополнения в секунду).
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tokens = {}
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local state = redis.call("HMGET", KEYS[i], "t", "ts")
+    local t = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    t = math.min(capacity, t + math.max(0, now - ts) * rate)
+    if t < 1 then
+        return {i, math.ceil((1 - t) / rate)}
+    end
+    tokens[i] = t
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call("HSET", KEYS[i], "t", tokens[i] - 1, "ts", now)
+    redis.call("EXPIRE", KEYS[i], math.ceil(capacity / rate))
+end
+return {0, 0}
+"""
+
+
+class RateLimitExceeded(Exception):
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"Превышен лимит запросов ({scope})")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+def country_prefix(digits):
+    """
+    Код страны по началу номера без разбора номера целиком.
+
+    :param digits: Номер телефона, только цифры.
+    :return: Код страны (1-3 цифры) или ``None``.
+    """
+    for length in (1, 2, 3):
+        prefix = digits[:length]
+        if prefix and int(prefix) in COUNTRY_CODE_TO_REGION_CODE:
+            return prefix
+    return None
+
+
+_token_bucket = None
+
+
+def _token_bucket_script():
+    global _token_bucket
+    if _token_bucket is None:
+        _token_bucket = get_redis_connection("default").register_script(
+            TOKEN_BUCKET_SCRIPT
+        )
+    return _token_bucket
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты запросов на общем Redis.
+
+    Все лимиты проверяются и списываются атомарно одним вызовом
+    Lua-скрипта, то есть за один сетевой запрос к Redis.
+
+    :param limits: Словарь ``{область: (число запросов, период в секундах)}``.
+    :param overrides: Лимиты для отдельных значений области:
+        ``{область: {значение: (число запросов, период)}}``.
+    :param prefix: Префикс ключей в кэше.
+    """
+
+    def __init__(self, limits, overrides=None, prefix="ratelimit"):
+        self.limits = limits
+        self.overrides = overrides or {}
+        self.prefix = prefix
+
+    def get_limit(self, scope, value):
+        overrides = self.overrides.get(scope, {})
+        if value in overrides:
+            return overrides[value]
+        return self.limits.get(scope)
+
+    def check(self, **identifiers):
+        """
+        Списание по одному токену для каждого переданного идентификатора.
+
+        :param identifiers: Пары область=значение, например ``ip="1.2.3.4"``.
+            Области без значения или без настроенного лимита пропускаются.
+        :raises RateLimitExceeded: Если исчерпан хотя бы один лимит.
+        """
+        scopes, keys, args = self._buckets(identifiers)
+        if keys:
+            self._raise_if_failed(
+                scopes, _token_bucket_script()(keys=keys, args=args)
+            )
+
+    async def acheck(self, **identifiers):
+        """Асинхронный вариант :meth:`check`."""
+        scopes, keys, args = self._buckets(identifiers)
+        if keys:
+            script = get_async_redis().register_script(TOKEN_BUCKET_SCRIPT)
+            self._raise_if_failed(
+                scopes, await script(keys=keys, args=args)
+            )
+
+    def _buckets(self, identifiers):
+        scopes, keys, args = [], [], [time.time()]
+        for scope, value in identifiers.items():
+            limit = self.get_limit(scope, value)
+            if value is None or limit is None:
+                continue
+            requests, period = limit
+            scopes.append(scope)
+            keys.append(cache.make_key(f"{self.prefix}_{scope}_{value}"))
+            args.extend([requests, requests / period])
+        return scopes, keys, args
+
+    @staticmethod
+    def _raise_if_failed(scopes, result):
+        failed, retry_after = result
+        if failed:
+            raise RateLimitExceeded(scopes[failed - 1], int(retry_after))
+
+
+def _otp_limiter():
+    return RateLimiter(
+        settings.OTP_RATE_LIMITS,
+        overrides={"country": settings.OTP_COUNTRY_RATE_LIMITS},
+        prefix="ratelimit_otp",
+    )
+
+
+def _phone_identifiers(phone):
+    digits = str(phone)
+    return {"phone": digits, "country": country_prefix(digits)}
+
+
+def check_otp_ip_limit(ip):
+    """
+    Проверка лимита выдачи кода на IP-адрес до разбора номера телефона.
+
+    Запросы с неразборчивым номером тоже расходуют этот лимит.
+
+    :param ip: IP-адрес клиента.
+    :raises RateLimitExceeded: Если запрос нужно отклонить.
+    """
+    _otp_limiter().check(ip=ip)
+
+
+async def acheck_otp_ip_limit(ip):
+    """Асинхронный вариант :func:`check_otp_ip_limit`."""
+    await _otp_limiter().acheck(ip=ip)
+
+
+def check_otp_rate_limit(phone):
+    """
+    Проверка лимитов выдачи кода на номер и код страны.
+
+    :param phone: Проверенный номер в формате E.164 без знака '+'.
+    :raises RateLimitExceeded: Если запрос нужно отклонить.
+    """
+    _otp_limiter().check(**_phone_identifiers(phone))
+
+
+async def acheck_otp_rate_limit(phone):
+    """Асинхронный вариант :func:`check_otp_rate_limit`."""
+    await _otp_limiter().acheck(**_phone_identifiers(phone))
@@ -1,7 +1,7 @@
-import phonenumbers
 from rest_framework import serializers
 
-from .models import User
+from .models import SMSCampaign, User
+from .phones import InvalidPhoneNumber, normalize_phone
 
 
 class PhoneNumberSerializer(serializers.Serializer):
@@ -9,25 +9,17 @@ class PhoneNumberSerializer(serializers.Serializer):
 
     def validate_phone_number(self, value):
         try:
-            # Парсим номер телефона
-            parsed_number = phonenumbers.parse(value, None)
-            # Проверяем валидность номера
-            if not phonenumbers.is_valid_number(parsed_number):
-                raise serializers.ValidationError("Неверный номер телефона")
-        except phonenumbers.NumberParseException:
-            raise serializers.ValidationError(
-                "Неверный формат номера телефона")
-        return phonenumbers.format_number(parsed_number,
-                                          phonenumbers.PhoneNumberFormat.E164)
-
-
-class VerificationCodeSerializer(serializers.Serializer):
-    phone_number = serializers.CharField(max_length=20)
+            return normalize_phone(value)
+        except InvalidPhoneNumber:
+            raise serializers.ValidationError("Неверный номер телефона")
+
+
+class VerificationCodeSerializer(PhoneNumberSerializer):
     code = serializers.CharField(max_length=4)
 
 
 class InviteCodeSerializer(serializers.Serializer):
-    invite_code = serializers.CharField(max_length=6)
+    invite_code = serializers.CharField(max_length=8)
 
 
 class UserProfileSerializer(serializers.ModelSerializer):
@@ -40,4 +32,15 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ["phone_number", "invite_code", "invited_by", "invited_users"]
 
     def get_invited_users(self, obj):
-        return obj.invitees.values_list("phone_number", flat=True)
+        invited_users, _ = User.objects.invitees_page(obj)
+        return invited_users
+
+
+class SMSCampaignSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = SMSCampaign
+        fields = ["id", "message", "status", "sent", "failed", "created_at",
+                  "updated_at"]
+        read_only_fields = ["status", "sent", "failed", "created_at",
+                            "updated_at"]
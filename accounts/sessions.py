@@ -0,0 +1,18 @@
+import json
+
+from django_redis.serializers.json import JSONSerializer
+
+
+class CompactJSONSerializer(JSONSerializer):
+    """
+    JSON без пробелов для значений в Redis.
+
+    Данные сессии и так должны сериализоваться в JSON (как у
+    ``django.contrib.sessions.serializers.JSONSerializer``), а в таком виде
+    они короче, чем в pickle, и читаются не только из Python.
+    """
+
+    def dumps(self, value):
+        return json.dumps(
+            value, cls=self.encoder_class, separators=(",", ":")
+        ).encode()
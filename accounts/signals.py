@@ -0,0 +1,137 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .authentication import USER_CLAIMS, token_versions
+from .invite_filter import invite_filter
+from .models import ReferralStats
+from .profile_cache import invalidate_profiles
+
+User = get_user_model()
+
+# Поля, которые попадают в закэшированный профиль
+PROFILE_FIELDS = {"phone_number", "invite_code", "invited_by"}
+# Поля, которые попадают в claims access-токена
+TOKEN_FIELDS = set(USER_CLAIMS)
+
+
+def inviter_chain(inviter_id):
+    """Пригласивший и все его предки: у них меняются счётчики."""
+    if inviter_id is None:
+        return []
+    ancestors = User.objects.ancestors(inviter_id)
+    return [inviter_id] + [user.pk for user in ancestors]
+
+
+def invalidate_on_commit(user_ids):
+    user_ids = set(user_ids)
+    transaction.on_commit(lambda: invalidate_profiles(user_ids))
+
+
+def revoke_tokens_on_commit(user_id):
+    transaction.on_commit(lambda: token_versions.bump(user_id))
+
+
+def add_invite_code_on_commit(code):
+    # После коммита код виден и перестроению фильтра, поэтому он не
+    # потеряется, даже если перестроение идёт прямо сейчас
+    transaction.on_commit(lambda: invite_filter.add([code]))
+
+
+@receiver(pre_save, sender=User)
+def remember_profile_fields(sender, instance, update_fields=None, **kwargs):
+    """Запоминает прежние значения полей профиля и claims до сохранения."""
+    instance._profile_before = None
+    if instance.pk is None or kwargs.get("raw"):
+        return
+    tracked = PROFILE_FIELDS | TOKEN_FIELDS
+    if update_fields is not None and not tracked & set(update_fields):
+        return
+    instance._profile_before = (
+        User.objects.filter(pk=instance.pk)
+        .values("invited_by_id", *TOKEN_FIELDS)
+        .first()
+    )
+
+
+@receiver(post_save, sender=User)
+def invalidate_profile_on_save(sender, instance, created, **kwargs):
+    if kwargs.get("raw"):
+        return
+    if created:
+        add_invite_code_on_commit(instance.invite_code)
+        if instance.invited_by_id:
+            invalidate_on_commit(
+                ReferralStats.objects.record_invite(instance)
+            )
+        return
+
+    before = getattr(instance, "_profile_before", None)
+    if before is None:
+        return
+    if any(before[field] != getattr(instance, field)
+           for field in TOKEN_FIELDS):
+        # Access-токены со старыми claims больше не принимаются
+        revoke_tokens_on_commit(instance.pk)
+    user_ids = set()
+    if before["invite_code"] != instance.invite_code:
+        add_invite_code_on_commit(instance.invite_code)
+        user_ids.add(instance.pk)
+    if before["invited_by_id"] != instance.invited_by_id:
+        # Пригласившего меняют только через save() (админка); активация
+        # кода обновляет статистику сама
+        with transaction.atomic():
+            if before["invited_by_id"]:
+                user_ids.update(ReferralStats.objects.record_uninvite(
+                    instance, before["invited_by_id"]
+                ))
+            if instance.invited_by_id:
+                user_ids.update(
+                    ReferralStats.objects.record_invite(instance)
+                )
+        user_ids.add(instance.pk)
+    if before["phone_number"] != instance.phone_number:
+        # Номер виден в профиле пригласившего и у всех приглашённых
+        user_ids.add(instance.pk)
+        user_ids.add(instance.invited_by_id)
+        user_ids.update(
+            User.objects.filter(invited_by_id=instance.pk)
+            .values_list("pk", flat=True)
+        )
+    if user_ids:
+        invalidate_on_commit(user_ids)
+
+
+@receiver(pre_delete, sender=User)
+def invalidate_profile_on_delete(sender, instance, **kwargs):
+    # Приглашённых отвязывает SET_NULL без сигналов, поэтому собираем их
+    # до удаления
+    user_ids = [instance.pk] + inviter_chain(instance.invited_by_id)
+    user_ids.extend(
+        User.objects.filter(invited_by_id=instance.pk)
+        .values_list("pk", flat=True)
+    )
+    invalidate_on_commit(user_ids)
+    revoke_tokens_on_commit(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def update_stats_on_delete(sender, instance, **kwargs):
+    """
+    Вычитание удаляемого пользователя и его поддерева из статистики
+    предков.
+
+    Пригласивший читается из БД, и ссылка на него сразу снимается: при
+    удалении нескольких пользователей одного дерева (QuerySet.delete)
+    удалённый потомок не вычитается из предков дважды.
+    """
+    inviter_id = (
+        User.objects.filter(pk=instance.pk)
+        .values_list("invited_by_id", flat=True)
+        .first()
+    )
+    if inviter_id is None:
+        return
+    ReferralStats.objects.record_uninvite(instance, inviter_id)
+    User.objects.filter(pk=instance.pk).update(invited_by=None)
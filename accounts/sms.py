@@ -0,0 +1,169 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from referral_project.metrics import (
+    SMS_GATEWAY_DURATION,
+    SMS_GATEWAY_RETRIES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SMSAeroClient:
+    """
+    Клиент SMSAero API с общим пулом соединений.
+
+    Один экземпляр переиспользует TCP/TLS-соединения между вызовами,
+    ограничивает время ожидания шлюза и повторяет запрос при сбоях
+    соединения и ответах 429/5xx с экспоненциальной задержкой.
+    """
+
+    # Ответы, при которых шлюз гарантированно не принял сообщение,
+    # поэтому повтор не приведёт к дублированию SMS.
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    def __init__(
+        self,
+        url,
+        email,
+        api_key,
+        connect_timeout=3.05,
+        read_timeout=10,
+        max_retries=2,
+        backoff_factor=0.3,
+        pool_size=10,
+    ):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.auth = (email, api_key)
+        # Повторяем только то, что не могло дойти до шлюза: ошибки
+        # соединения и явные отказы по статусу. Таймаут чтения не
+        # повторяем, иначе пользователь может получить два кода.
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retry,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            url=settings.SMSAERO_URL,
+            email=settings.SMSAERO_EMAIL,
+            api_key=settings.SMSAERO_API_KEY,
+            connect_timeout=settings.SMSAERO_CONNECT_TIMEOUT,
+            read_timeout=settings.SMSAERO_READ_TIMEOUT,
+            max_retries=settings.SMSAERO_MAX_RETRIES,
+            backoff_factor=settings.SMSAERO_BACKOFF_FACTOR,
+            pool_size=settings.SMSAERO_POOL_SIZE,
+        )
+
+    def _post(self, data, operation):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.post(
+                self.url, data=data, timeout=self.timeout
+            )
+            status = response.status_code
+            retries = getattr(response.raw, "retries", None)
+            if retries is not None and retries.history:
+                SMS_GATEWAY_RETRIES.labels(operation).inc(
+                    len(retries.history)
+                )
+            response.raise_for_status()
+            result = response.json()
+            logger.debug(f"SMS отправлено успешно: {result}")
+            return result
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Ошибка при отправке SMS: {e}")
+            return {"status": "error", "error": str(e),
+                    "retryable": self.is_retryable(e)}
+        finally:
+            SMS_GATEWAY_DURATION.labels(operation, status).observe(
+                time.perf_counter() - started
+            )
+
+    @classmethod
+    def is_retryable(cls, error):
+        """
+        Временный ли сбой: сбой соединения, таймаут, 429 или 5xx.
+
+        Отказ шлюза с другим кодом 4xx (неверный номер или текст, ошибка
+        авторизации) при повторе не изменится, а ответ 2xx, который не
+        удалось разобрать, мог означать, что SMS уже принято.
+        """
+        response = getattr(error, "response", None)
+        if response is not None:
+            return (response.status_code in cls.RETRY_STATUSES
+                    or response.status_code >= 500)
+        return not isinstance(error, ValueError)
+
+    def send(self, phone, message):
+        """
+        Отправка одного SMS.
+
+        :param phone: Номер телефона в формате E.164 (со знаком '+' или без).
+        :param message: Текст сообщения.
+        :return: Словарь с результатом отправки.
+        """
+        return self._post({"number": phone, "text": message}, "send")
+
+    def send_bulk(self, phones, message):
+        """
+        Отправка одного и того же текста нескольким получателям
+        одним запросом к шлюзу.
+
+        :param phones: Список номеров телефонов.
+        :param message: Текст сообщения.
+        :return: Словарь с результатом отправки.
+        """
+        return self._post({"numbers[]": list(phones), "text": message},
+                          "send_bulk")
+
+    async def asend(self, phone, message):
+        """Асинхронный вариант :meth:`send` для asyncio-кода."""
+        return await asyncio.to_thread(self.send, phone, message)
+
+    async def asend_bulk(self, phones, message):
+        """Асинхронный вариант :meth:`send_bulk` для asyncio-кода."""
+        return await asyncio.to_thread(self.send_bulk, phones, message)
+
+    def close(self):
+        self.session.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _client_for_pid(pid):
+    return SMSAeroClient.from_settings()
+
+
+def get_sms_client():
+    """
+    Общий клиент SMSAero текущего процесса.
+
+    Клиент создаётся лениво и отдельно в каждом процессе, поэтому
+    воркеры gunicorn и Celery не делят сокеты, открытые до fork.
+    """
+    return _client_for_pid(os.getpid())
@@ -0,0 +1,242 @@
+import logging
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+from . import async_cache
+from .broadcast import BroadcastRunner
+from .models import SMSCampaign
+from .sms import get_sms_client
+
+logger = logging.getLogger(__name__)
+
+OTP_SMS_TEXT = "Ваш код подтверждения: {code}"
+
+SMS_STATUS_QUEUED = "queued"
+SMS_STATUS_SENT = "sent"
+SMS_STATUS_FAILED = "failed"
+
+# Пакет переносится из буфера в список, принадлежащий задаче отправки, и
+# удаляется оттуда только после ответа шлюза. Если в списке остался пакет
+# с прошлой попытки (падение воркера или повтор задачи), возвращается он.
+# KEYS: буфер, список задачи; ARGV: размер пакета.
+TAKE_BATCH_SCRIPT = """
+if redis.call("EXISTS", KEYS[2]) == 0 then
+    local items = redis.call("LRANGE", KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #items == 0 then
+        return {}
+    end
+    redis.call("LTRIM", KEYS[1], #items, -1)
+    redis.call("RPUSH", KEYS[2], unpack(items))
+end
+return redis.call("LRANGE", KEYS[2], 0, -1)
+"""
+
+_take_batch = None
+
+
+def _take_batch_script():
+    global _take_batch
+    if _take_batch is None:
+        _take_batch = get_redis_connection("default").register_script(
+            TAKE_BATCH_SCRIPT
+        )
+    return _take_batch
+
+
+def sms_status_key(phone):
+    # Один ключ для номера с '+' и без него
+    return f"sms_status_{str(phone).lstrip('+')}"
+
+
+def _otp_claim_key(phone, code):
+    return f"sms_otp_{phone}_{code}"
+
+
+def enqueue_otp_sms(phone, code):
+    """
+    Постановка отправки кода подтверждения в очередь Celery.
+
+    :param phone: Номер телефона в формате E.164 без знака '+'.
+    :param code: Код подтверждения.
+    """
+    cache.set(sms_status_key(phone), SMS_STATUS_QUEUED,
+              timeout=settings.OTP_CODE_TTL)
+    send_otp_sms.apply_async(
+        args=(phone, code), priority=settings.OTP_SMS_PRIORITY
+    )
+
+
+async def aenqueue_otp_sms(phone, code):
+    """Асинхронный вариант :func:`enqueue_otp_sms`."""
+    await async_cache.aset(sms_status_key(phone), SMS_STATUS_QUEUED,
+                           timeout=settings.OTP_CODE_TTL)
+    # Публикация в брокер блокирующая, поэтому выполняется в пуле
+    # потоков, а не в цикле событий
+    await sync_to_async(send_otp_sms.apply_async, thread_sensitive=False)(
+        args=(phone, code), priority=settings.OTP_SMS_PRIORITY
+    )
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=2,
+             ignore_result=True, acks_late=True)
+def send_otp_sms(self, phone, code):
+    """
+    Отправка кода подтверждения.
+
+    Задача идемпотентна по паре (телефон, код): повторная доставка
+    сообщения брокером после успешной отправки не приводит к повторному
+    SMS. Отметка об отправке ставится только после ответа шлюза, поэтому
+    при падении воркера до отправки повторная доставка отправит код.
+    Отправка повторяется только при временном сбое шлюза.
+    """
+    claim_key = _otp_claim_key(phone, code)
+    if cache.get(claim_key) == SMS_STATUS_SENT:
+        logger.debug(f"Код для номера {phone} уже отправлен, пропускаем")
+        return
+
+    result = get_sms_client().send(phone, OTP_SMS_TEXT.format(code=code))
+    if result.get("status") == "error":
+        # Отказ шлюза вроде неверного номера повторять бесполезно
+        if (result.get("retryable")
+                and self.request.retries < self.max_retries):
+            raise self.retry()
+        cache.set(sms_status_key(phone), SMS_STATUS_FAILED,
+                  timeout=settings.OTP_CODE_TTL)
+        logger.error(f"Не удалось отправить код на номер {phone}")
+        return
+
+    cache.set(claim_key, SMS_STATUS_SENT, timeout=settings.OTP_CODE_TTL)
+    cache.set(sms_status_key(phone), SMS_STATUS_SENT,
+              timeout=settings.OTP_CODE_TTL)
+
+
+def _buffer_key():
+    return cache.make_key("sms_buffer")
+
+
+def queue_sms(phone, message):
+    """
+    Постановка произвольного SMS в буфер для пакетной отправки.
+
+    Сообщения копятся в Redis в течение ``SMS_BATCH_WINDOW`` секунд,
+    после чего :func:`flush_sms_buffer` отправляет их, объединяя
+    одинаковые тексты в один запрос к шлюзу. Статус отправки на номер
+    хранится по ключу :func:`sms_status_key`.
+    """
+    cache.set(sms_status_key(phone), SMS_STATUS_QUEUED,
+              timeout=settings.SMS_STATUS_TTL)
+    get_redis_connection("default").rpush(
+        _buffer_key(), f"{phone}\n{message}"
+    )
+    if cache.add("sms_buffer_flush_scheduled", 1,
+                 timeout=settings.SMS_BATCH_WINDOW):
+        flush_sms_buffer.apply_async(countdown=settings.SMS_BATCH_WINDOW)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=2,
+             ignore_result=True, acks_late=True)
+def flush_sms_buffer(self):
+    """
+    Отправка накопленных в буфере SMS пакетами.
+
+    Пакет остаётся в Redis, в списке этой задачи, пока шлюз не ответит:
+    задача подтверждается брокеру только после завершения, поэтому при
+    падении воркера повторная доставка (с тем же id задачи) отправит
+    пакет снова. Сообщения, не принятые из-за временного сбоя шлюза,
+    остаются в списке и отправляются повтором задачи, остальным
+    ставится статус отправки.
+    """
+    redis = get_redis_connection("default")
+    cache.delete("sms_buffer_flush_scheduled")
+    processing = cache.make_key(f"sms_buffer_processing_{self.request.id}")
+    while True:
+        items = _take_batch_script()(
+            keys=[_buffer_key(), processing], args=[settings.SMS_BATCH_MAX]
+        )
+        if not items:
+            return
+        messages = [item.decode().split("\n", 1) for item in items]
+        try:
+            failed = send_sms_batch(messages)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке пакета SMS: {e}")
+            failed = [(phone, text, True) for phone, text in messages]
+
+        can_retry = self.request.retries < self.max_retries
+        retry = [(phone, text) for phone, text, retryable in failed
+                 if retryable and can_retry]
+        statuses = {
+            sms_status_key(phone): SMS_STATUS_SENT for phone, _ in messages
+        }
+        statuses.update(
+            (sms_status_key(phone), SMS_STATUS_QUEUED
+             if retryable and can_retry else SMS_STATUS_FAILED)
+            for phone, _, retryable in failed
+        )
+        cache.set_many(statuses, timeout=settings.SMS_STATUS_TTL)
+
+        with redis.pipeline() as pipe:
+            pipe.delete(processing)
+            if retry:
+                pipe.rpush(processing,
+                           *(f"{phone}\n{text}" for phone, text in retry))
+            pipe.execute()
+        if retry:
+            logger.warning(
+                f"Шлюз не принял {len(retry)} SMS, повторная отправка"
+            )
+            raise self.retry()
+        if failed:
+            logger.error(f"Не удалось отправить {len(failed)} SMS")
+
+
+def send_sms_batch(messages):
+    """
+    Отправка списка SMS с объединением одинаковых текстов.
+
+    :param messages: Итерируемое пар (телефон, текст).
+    :return: Список троек (телефон, текст, временный ли сбой) для
+        сообщений, которые шлюз не принял.
+    """
+    by_text = defaultdict(list)
+    for phone, text in messages:
+        by_text[text].append(phone)
+
+    client = get_sms_client()
+    failed = []
+    for text, phones in by_text.items():
+        for start in range(0, len(phones), settings.SMSAERO_BULK_SIZE):
+            chunk = phones[start:start + settings.SMSAERO_BULK_SIZE]
+            if len(chunk) == 1:
+                result = client.send(chunk[0], text)
+            else:
+                result = client.send_bulk(chunk, text)
+            if result.get("status") == "error":
+                retryable = bool(result.get("retryable"))
+                failed.extend((phone, text, retryable) for phone in chunk)
+    return failed
+
+
+@shared_task(bind=True, ignore_result=True, acks_late=True,
+             max_retries=None)
+def run_broadcast(self, campaign_id):
+    """
+    Выполнение массовой рассылки.
+
+    Задача подтверждается только после завершения, поэтому при падении
+    воркера брокер доставит её повторно и рассылка продолжится с
+    последней контрольной точки. Если рассылку уже выполняет другой
+    воркер (повторная доставка при живом исполнителе), задача
+    откладывается на ``BROADCAST_LEASE_SECONDS`` и продолжит рассылку,
+    если тот воркер упадёт.
+    """
+    campaign = SMSCampaign.objects.get(pk=campaign_id)
+    if campaign.status == SMSCampaign.STATUS_FINISHED:
+        return
+    if BroadcastRunner(campaign).run() is None:
+        raise self.retry(countdown=settings.BROADCAST_LEASE_SECONDS)
@@ -1,11 +1,100 @@
 # accounts/tests.py
 
-from unittest.mock import patch
-from django.test import Client, TestCase
+import csv
+import json
+import os
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, patch
+
+import phonenumbers
+import requests
+from celery.exceptions import Retry
+from prometheus_client import REGISTRY
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection, connections, router, transaction
+from django.http import HttpResponse
+from django.test import (
+    AsyncRequestFactory,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 from rest_framework_simplejwt.tokens import AccessToken
-from django.core.cache import cache
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.management import call_command
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from accounts.admin import EstimatedCountPaginator
+from accounts.authentication import ClaimsRefreshToken, token_versions
+from accounts.broadcast import BroadcastRunner
+from accounts.invite_codes import (
+    ALPHABET,
+    BLOCK_SIZE,
+    FeistelPermutation,
+    InviteCodeAllocator,
+    decode,
+    encode,
+)
+from accounts.invite_filter import invite_filter
+from accounts.models import InviteCodeBlock, ReferralStats, SMSCampaign
+from accounts.otp import OTPStore, otp_store
+from accounts.phones import (
+    InvalidPhoneNumber,
+    normalize_phone,
+    normalize_phones,
+)
+from accounts.profile_cache import (
+    abuild_profile,
+    aget_profile_json,
+    build_profile,
+    get_profile_json,
+    invalidate_profiles,
+)
+from accounts.ratelimit import RateLimiter, RateLimitExceeded
+from accounts.sms import SMSAeroClient
+from accounts.tasks import (
+    _take_batch_script,
+    flush_sms_buffer,
+    queue_sms,
+    run_broadcast,
+    send_otp_sms,
+    send_sms_batch,
+    sms_status_key,
+)
+from accounts.views import (
+    AsyncActivateInviteCodeView,
+    AsyncLoginView,
+    AsyncUserProfileView,
+)
+from benchmarks.stub_smsaero import StubSMSAeroServer
+from referral_project import db_router, drf_yasg
+from referral_project.profiling import (
+    BudgetExceeded,
+    RequestProfilingMiddleware,
+    Sampler,
+    capture_profiles,
+)
 
 User = get_user_model()
 
@@ -84,10 +173,16 @@ class UserAuthenticationTests(TestCase):
         self.password = "password123"
         self.invalid_phone_number = "12345"
         self.user = User.objects.get(pk=1)
+        cache.delete_pattern("ratelimit_*")
+        cache.delete_pattern("otp_*")
 
-    @patch("accounts.views.send_sms")
-    def test_login_valid_phone_number(self, mock_send_sms):
-        mock_send_sms.return_value = {"status": "success"}
+    def set_session_phone(self, phone_number_int):
+        session = self.client.session
+        session["phone_number"] = phone_number_int
+        session.save()
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_login_valid_phone_number(self, mock_enqueue_otp_sms):
         response = self.client.post(
             "/accounts/login/",
             {"phone_number": self.phone_number}
@@ -98,8 +193,9 @@ class UserAuthenticationTests(TestCase):
             "Введите код из SMS"
         )
         phone_number_int = int(self.phone_number.replace("+", ""))
-        cache_key = f"sms_code_{phone_number_int}"
-        cached_code = cache.get(cache_key)
+        cached_code = get_redis_connection("default").hget(
+            otp_store.key(phone_number_int), "code"
+        ).decode()
         self.assertIsNotNone(
             cached_code,
             "Код подтверждения должен быть установлен в кэше."
@@ -108,6 +204,9 @@ class UserAuthenticationTests(TestCase):
             cached_code.isdigit() and len(cached_code) == 4,
             "Код подтверждения должен быть 4-значным числом."
         )
+        mock_enqueue_otp_sms.assert_called_once_with(
+            phone_number_int, cached_code
+        )
 
     def test_login_invalid_phone_number(self):
         response = self.client.post(
@@ -120,23 +219,21 @@ class UserAuthenticationTests(TestCase):
             "Введите корректный номер телефона."
         )
 
-    @patch("accounts.views.send_sms")
-    def test_verify_code_correct(self, mock_send_sms):
-        mock_send_sms.return_value = {"status": "success"}
+    @patch("accounts.views.queue_sms")
+    def test_verify_code_correct(self, mock_queue_sms):
         phone_number_int = int(self.phone_number.replace("+", ""))
-        cache_key = f"sms_code_{phone_number_int}"
-        cache.set(cache_key, "1234", timeout=300)
+        otp_store.issue(phone_number_int, "1234")
+        self.set_session_phone(phone_number_int)
         response = self.client.post("/accounts/login/", {"code": "1234"})
         self.assertIn(response.status_code, [200, 302])
         if response.status_code == 302:
             self.assertRedirects(response, "/accounts/profile-page/")
 
-    @patch("accounts.views.send_sms")
-    def test_verify_code_incorrect(self, mock_send_sms):
-        mock_send_sms.return_value = {"status": "success"}
+    @patch("accounts.views.queue_sms")
+    def test_verify_code_incorrect(self, mock_queue_sms):
         phone_number_int = int(self.phone_number.replace("+", ""))
-        cache_key = f"sms_code_{phone_number_int}"
-        cache.set(cache_key, "1234", timeout=300)
+        otp_store.issue(phone_number_int, "1234")
+        self.set_session_phone(phone_number_int)
         response = self.client.post("/accounts/login/", {"code": "0000"})
         self.assertEqual(response.status_code, 200)
         self.assertContains(
@@ -148,6 +245,31 @@ class UserAuthenticationTests(TestCase):
             "Пользователь не должен быть аутентифицирован с неверным кодом."
         )
 
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_login_flow_keeps_session_out_of_db(self, mock_enqueue_otp_sms):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post("/accounts/login/",
+                             {"phone_number": self.phone_number})
+            code = mock_enqueue_otp_sms.call_args.args[1]
+            response = self.client.post("/accounts/login/", {"code": code})
+        self.assertRedirects(response, "/accounts/profile-page/",
+                             fetch_redirect_response=False)
+        writes = [q["sql"] for q in queries.captured_queries
+                  if not q["sql"].startswith("SELECT")]
+        # Остаётся только обновление last_login
+        self.assertEqual(len(writes), 1, writes)
+        self.assertNotIn("django_session", writes[0])
+        self.assertFalse(Session.objects.exists())
+
+        session_key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        raw = get_redis_connection("sessions").get(
+            caches["sessions"].make_key(
+                f"django.contrib.sessions.cache{session_key}"
+            )
+        )
+        self.assertEqual(json.loads(raw)["_auth_user_id"], str(self.user.pk))
+        self.assertIn("messages", response.cookies)
+
 
 class ReferralCodeTests(TestCase):
     fixtures = ['test_users.json']
@@ -218,3 +340,1781 @@ class ReferralCodeTests(TestCase):
             f"Expected 200 but got {response.status_code}. "
             f"Response content: {response.content}"
         )
+
+
+class SMSAeroClientTests(SimpleTestCase):
+
+    def setUp(self):
+        self.server = StubSMSAeroServer().start()
+        self.addCleanup(self.server.stop)
+
+    def make_client(self, **kwargs):
+        client = SMSAeroClient(url=self.server.url, email="test",
+                               api_key="test", backoff_factor=0, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_send_reuses_connection(self):
+        client = self.make_client()
+        for _ in range(3):
+            result = client.send("79174044144", "Тест")
+            self.assertEqual(result["status"], "success")
+        self.assertEqual(self.server.stats()["requests"], 3)
+        self.assertEqual(
+            self.server.stats()["connections"], 1,
+            "Клиент должен переиспользовать соединение из пула."
+        )
+
+    def test_send_retries_on_unavailable_gateway(self):
+        self.server.error_rate = 1.0
+        client = self.make_client(max_retries=2)
+        result = client.send("79174044144", "Тест")
+        self.assertEqual(result["status"], "error")
+        self.assertEqual(self.server.stats()["requests"], 3)
+
+    def test_only_transient_errors_are_retryable(self):
+        def http_error(status):
+            response = requests.Response()
+            response.status_code = status
+            return requests.HTTPError(response=response)
+
+        self.assertTrue(SMSAeroClient.is_retryable(http_error(503)))
+        self.assertTrue(SMSAeroClient.is_retryable(http_error(429)))
+        self.assertTrue(
+            SMSAeroClient.is_retryable(requests.ConnectionError())
+        )
+        self.assertFalse(SMSAeroClient.is_retryable(http_error(400)))
+        self.assertFalse(SMSAeroClient.is_retryable(ValueError()))
+
+    def test_send_bulk(self):
+        client = self.make_client()
+        result = client.send_bulk(["79174044144", "79174044145"], "Тест")
+        self.assertEqual(len(result["data"]), 2)
+        self.assertEqual(self.server.stats()["requests"], 1)
+
+
+class SMSTaskTests(TestCase):
+
+    def setUp(self):
+        self.phone = 79174044144
+        cache.delete_many([
+            sms_status_key(self.phone),
+            f"sms_otp_{self.phone}_1234",
+        ])
+        cache.delete_pattern("sms_buffer*")
+
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_otp_sms_is_idempotent(self, mock_get_client):
+        mock_get_client.return_value.send.return_value = {
+            "status": "success"
+        }
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        mock_get_client.return_value.send.assert_called_once_with(
+            self.phone, "Ваш код подтверждения: 1234"
+        )
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "sent")
+
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_otp_sms_redelivered_after_crash(self, mock_get_client):
+        mock_get_client.return_value.send.side_effect = [
+            ConnectionError, {"status": "success"}
+        ]
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        self.assertEqual(mock_get_client.return_value.send.call_count, 2)
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "sent")
+
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_otp_sms_marks_failure(self, mock_get_client):
+        mock_get_client.return_value.send.return_value = {
+            "status": "error", "error": "timeout", "retryable": True
+        }
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        self.assertEqual(mock_get_client.return_value.send.call_count, 4)
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "failed")
+
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_otp_sms_does_not_retry_rejection(self, mock_get_client):
+        mock_get_client.return_value.send.return_value = {
+            "status": "error", "error": "400 Bad Request",
+            "retryable": False,
+        }
+        send_otp_sms.apply(args=(self.phone, "1234"))
+        mock_get_client.return_value.send.assert_called_once()
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "failed")
+
+    @patch("accounts.tasks.flush_sms_buffer.apply_async")
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_sms_page_queues_message(self, mock_get_client,
+                                          mock_schedule):
+        client = mock_get_client.return_value
+        client.send.return_value = {"status": "success"}
+        response = self.client.post("/accounts/send-sms/", {
+            "phone": "+79174044144", "message": "Привет",
+        })
+        self.assertRedirects(response, "/accounts/send-sms/",
+                             fetch_redirect_response=False)
+        client.send.assert_not_called()
+        mock_schedule.assert_called_once_with(
+            countdown=settings.SMS_BATCH_WINDOW
+        )
+
+        self.assertEqual(cache.get(sms_status_key("+79174044144")),
+                         "queued")
+        flush_sms_buffer.apply()
+        client.send.assert_called_once_with("+79174044144", "Привет")
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "sent")
+        self.assertEqual(cache.keys("sms_buffer*"), [])
+
+    @patch("accounts.tasks.flush_sms_buffer.apply_async")
+    @patch("accounts.tasks.get_sms_client")
+    def test_flush_retries_transient_failures(self, mock_get_client,
+                                              mock_schedule):
+        client = mock_get_client.return_value
+        client.send.side_effect = [
+            {"status": "error", "error": "503", "retryable": True},
+            {"status": "success"},
+            {"status": "error", "error": "400", "retryable": False},
+        ]
+        queue_sms("+79174044144", "Привет")
+        flush_sms_buffer.apply()
+        self.assertEqual(client.send.call_count, 2)
+        self.assertEqual(cache.get(sms_status_key(self.phone)), "sent")
+
+        queue_sms("+79174044145", "Привет")
+        flush_sms_buffer.apply()
+        self.assertEqual(client.send.call_count, 3)
+        self.assertEqual(cache.get(sms_status_key("79174044145")),
+                         "failed")
+        self.assertEqual(cache.keys("sms_buffer*"), [])
+
+    @patch("accounts.tasks.flush_sms_buffer.apply_async")
+    @patch("accounts.tasks.get_sms_client")
+    def test_flush_resends_batch_after_crash(self, mock_get_client,
+                                             mock_schedule):
+        client = mock_get_client.return_value
+        client.send.return_value = {"status": "success"}
+        queue_sms("+79174044144", "Привет")
+        processing = cache.make_key("sms_buffer_processing_crashed")
+        # Воркер забрал пакет из буфера и упал до ответа шлюза
+        _take_batch_script()(
+            keys=[cache.make_key("sms_buffer"), processing], args=[10]
+        )
+        flush_sms_buffer.apply()
+        client.send.assert_not_called()
+
+        # Брокер доставляет задачу повторно с тем же id
+        flush_sms_buffer.apply(task_id="crashed")
+        client.send.assert_called_once_with("+79174044144", "Привет")
+        self.assertEqual(cache.keys("sms_buffer*"), [])
+
+    @patch("accounts.tasks.get_sms_client")
+    def test_send_sms_batch_groups_same_text(self, mock_get_client):
+        client = mock_get_client.return_value
+        client.send_bulk.return_value = {"status": "success"}
+        client.send.return_value = {"status": "success"}
+        failed = send_sms_batch([
+            ("79174044144", "Акция"),
+            ("79174044145", "Акция"),
+            ("79174044146", "Другое"),
+        ])
+        self.assertEqual(failed, [])
+        client.send_bulk.assert_called_once_with(
+            ["79174044144", "79174044145"], "Акция"
+        )
+        client.send.assert_called_once_with("79174044146", "Другое")
+
+
+class BroadcastTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        for i in range(5):
+            User.objects.create_user(phone_number=f"+7917404415{i}")
+        self.campaign = SMSCampaign.objects.create(message="Новости")
+
+    def make_runner(self, client, **kwargs):
+        with patch("accounts.broadcast.get_sms_client", return_value=client):
+            return BroadcastRunner(self.campaign, rate=1000,
+                                   progress=lambda *args: None, **kwargs)
+
+    def test_broadcast_sends_in_bulk_chunks(self):
+        client = MagicMock()
+        client.send_bulk.return_value = {"status": "success"}
+        client.send.return_value = {"status": "success"}
+        runner = self.make_runner(client, chunk_size=4, batch_size=2)
+        runner.run()
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, SMSCampaign.STATUS_FINISHED)
+        self.assertEqual(self.campaign.sent, 7)
+        self.assertEqual(self.campaign.failed, 0)
+        self.assertEqual(
+            self.campaign.last_user_id,
+            User.objects.order_by("-pk").values_list("pk", flat=True)[0],
+        )
+        sent_to = [
+            phone
+            for call in client.send_bulk.call_args_list
+            for phone in call.args[0]
+        ] + [call.args[0] for call in client.send.call_args_list]
+        self.assertEqual(len(sent_to), 7)
+
+    def test_broadcast_resumes_from_checkpoint(self):
+        pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        self.campaign.last_user_id = pks[3]
+        self.campaign.sent = 4
+        self.campaign.save()
+
+        client = MagicMock()
+        client.send_bulk.return_value = {"status": "error"}
+        self.make_runner(client, batch_size=10).run()
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.sent, 4)
+        self.assertEqual(self.campaign.failed, 3)
+        client.send_bulk.assert_called_once()
+        self.assertEqual(len(client.send_bulk.call_args.args[0]), 3)
+
+    def test_running_campaign_is_not_started_twice(self):
+        client = MagicMock()
+        runner = self.make_runner(client)
+        self.assertTrue(runner.claim())
+
+        self.assertIsNone(self.make_runner(client).run())
+        client.send_bulk.assert_not_called()
+        client.send.assert_not_called()
+
+    def test_abandoned_campaign_is_resumed(self):
+        pks = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        SMSCampaign.objects.filter(pk=self.campaign.pk).update(
+            status=SMSCampaign.STATUS_RUNNING, last_user_id=pks[3],
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.BROADCAST_LEASE_SECONDS + 1
+            ),
+        )
+        client = MagicMock()
+        client.send_bulk.return_value = {"status": "success"}
+        self.assertEqual(self.make_runner(client).run().sent, 3)
+        self.assertEqual(len(client.send_bulk.call_args.args[0]), 3)
+
+    def test_runner_stops_when_campaign_taken_over(self):
+        client = MagicMock()
+        client.send_bulk.return_value = {"status": "success"}
+        runner = self.make_runner(client, chunk_size=2, batch_size=2)
+
+        def take_over(*args):
+            SMSCampaign.objects.filter(pk=self.campaign.pk).update(
+                updated_at=timezone.now()
+            )
+
+        runner.progress = take_over
+        self.assertIsNone(runner.run())
+        # Порция, отправленная до обнаружения, не попадает в контрольную
+        # точку, и рассылка не доходит до конца
+        self.assertEqual(client.send_bulk.call_count, 2)
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.sent, 2)
+        self.assertEqual(self.campaign.status, SMSCampaign.STATUS_RUNNING)
+
+    @patch("accounts.tasks.BroadcastRunner")
+    def test_task_retries_while_campaign_running(self, runner):
+        runner.return_value.run.return_value = None
+        with self.assertRaises(Retry):
+            run_broadcast.apply(args=(self.campaign.pk, ), throw=True)
+
+    @patch("accounts.views.run_broadcast")
+    def test_broadcast_api_requires_staff(self, mock_run_broadcast):
+        api_client = APIClient()
+        api_client.force_authenticate(User.objects.get(pk=1))
+        response = api_client.post("/accounts/api/broadcast/",
+                                   {"message": "Новости"})
+        self.assertEqual(response.status_code, 403)
+
+        api_client.force_authenticate(User.objects.get(pk=2))
+        response = api_client.post("/accounts/api/broadcast/",
+                                   {"message": "Новости"})
+        self.assertEqual(response.status_code, 202)
+        mock_run_broadcast.delay.assert_called_once_with(response.data["id"])
+
+
+@override_settings(
+    OTP_RATE_LIMITS={"ip": (3, 3600), "phone": (1, 3600)},
+    OTP_COUNTRY_RATE_LIMITS={},
+)
+class OTPRateLimitTests(TestCase):
+
+    def setUp(self):
+        cache.delete_pattern("ratelimit_*")
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_phone_limit_blocks_before_sms(self, mock_enqueue_otp_sms):
+        response = self.client.post("/accounts/login/",
+                                    {"phone_number": "+79174044144"})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post("/accounts/login/",
+                                    {"phone_number": "+7 917 404-41-44"})
+        self.assertEqual(response.status_code, 429)
+        self.assertContains(response, "Слишком много запросов кода",
+                            status_code=429)
+        mock_enqueue_otp_sms.assert_called_once()
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_ip_limit(self, mock_enqueue_otp_sms):
+        for i in range(3):
+            self.client.post("/accounts/login/",
+                             {"phone_number": f"+7917404415{i}"})
+        response = self.client.post("/accounts/login/",
+                                    {"phone_number": "+79174044159"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(mock_enqueue_otp_sms.call_count, 3)
+
+    @patch("accounts.views.normalize_phone", wraps=normalize_phone)
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_ip_limit_short_circuits_parsing(self, mock_enqueue_otp_sms,
+                                             mock_parse):
+        for i in range(3):
+            self.client.post("/accounts/login/",
+                             {"phone_number": f"+7917404415{i}"})
+        mock_parse.reset_mock()
+        response = self.client.post("/accounts/login/",
+                                    {"phone_number": "+79174044159"})
+        self.assertEqual(response.status_code, 429)
+        mock_parse.assert_not_called()
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_invalid_phones_spend_ip_limit(self, mock_enqueue_otp_sms):
+        for _ in range(3):
+            response = self.client.post("/accounts/login/",
+                                        {"phone_number": "12345"})
+            self.assertContains(response, "Введите корректный номер")
+        response = self.client.post("/accounts/login/",
+                                    {"phone_number": "+79174044159"})
+        self.assertEqual(response.status_code, 429)
+        mock_enqueue_otp_sms.assert_not_called()
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_api_rejects_malformed_phone_before_phone_limits(
+            self, mock_enqueue_otp_sms):
+        api_client = APIClient()
+        for data in ({"phone_number": 79174044144},
+                     {"phone_number": ["+79174044144"]},
+                     ["+79174044144"]):
+            response = api_client.post("/accounts/api/otp/request/", data,
+                                       format="json")
+            self.assertEqual(response.status_code, 400, data)
+        mock_enqueue_otp_sms.assert_not_called()
+        self.assertEqual(cache.keys("ratelimit_*"),
+                         ["ratelimit_otp_ip_127.0.0.1"])
+        response = api_client.post("/accounts/api/otp/request/",
+                                   {"phone_number": "+79174044144"},
+                                   format="json")
+        self.assertEqual(response.status_code, 429)
+
+    def test_country_override(self):
+        limiter = RateLimiter({"country": (100, 60)},
+                              overrides={"country": {"7": (1, 60)}},
+                              prefix="ratelimit_test")
+        limiter.check(country="7")
+        with self.assertRaises(RateLimitExceeded) as ctx:
+            limiter.check(country="7")
+        self.assertEqual(ctx.exception.scope, "country")
+        self.assertGreater(ctx.exception.retry_after, 0)
+        limiter.check(country="44")
+
+
+@override_settings(OTP_MAX_ATTEMPTS=3)
+class OTPStoreTests(TestCase):
+
+    def setUp(self):
+        self.phone = 79174044144
+        cache.delete_pattern("otp_*")
+
+    def test_code_cannot_be_used_twice(self):
+        otp_store.issue(self.phone, "1234")
+        self.assertEqual(otp_store.verify(self.phone, "1234"),
+                         OTPStore.VERIFIED)
+        self.assertEqual(otp_store.verify(self.phone, "1234"),
+                         OTPStore.EXPIRED)
+
+    def test_code_locked_after_failed_attempts(self):
+        otp_store.issue(self.phone, "1234")
+        self.assertEqual(otp_store.verify(self.phone, "0000"),
+                         OTPStore.INVALID)
+        self.assertEqual(otp_store.verify(self.phone, "0001"),
+                         OTPStore.INVALID)
+        self.assertEqual(otp_store.verify(self.phone, "0002"),
+                         OTPStore.LOCKED)
+        self.assertEqual(otp_store.verify(self.phone, "1234"),
+                         OTPStore.LOCKED)
+        self.assertFalse(
+            otp_store.issue(self.phone, "5678"),
+            "Новый код не должен выдаваться заблокированному номеру."
+        )
+
+    def test_code_stored_as_hash(self):
+        otp_store.issue(self.phone, "1234")
+        redis = get_redis_connection("default")
+        self.assertEqual(
+            redis.hgetall(otp_store.key(self.phone)),
+            {b"code": b"1234", b"attempts": b"0"},
+        )
+        self.assertGreater(redis.ttl(otp_store.key(self.phone)), 0)
+
+
+class OTPAPITests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        self.api_client = APIClient()
+        self.phone_number = "+79174044144"
+        cache.delete_pattern("ratelimit_*")
+        cache.delete_pattern("otp_*")
+
+    @patch("accounts.views.enqueue_otp_sms")
+    def test_request_and_verify_issue_jwt(self, mock_enqueue_otp_sms):
+        response = self.api_client.post(
+            "/accounts/api/otp/request/",
+            {"phone_number": "+7 917 404 41 44"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        phone, code = mock_enqueue_otp_sms.call_args.args
+        self.assertEqual(phone, 79174044144)
+
+        response = self.api_client.post(
+            "/accounts/api/otp/verify/",
+            {"phone_number": self.phone_number, "code": code},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            AccessToken(response.data["access"])["user_id"], 1
+        )
+        self.assertIn("refresh", response.data)
+        self.assertFalse(
+            Session.objects.exists(),
+            "Вход через API не должен создавать сессии."
+        )
+
+    def test_verify_wrong_code(self):
+        otp_store.issue(79174044144, "1234")
+        response = self.api_client.post(
+            "/accounts/api/otp/verify/",
+            {"phone_number": self.phone_number, "code": "0000"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn("access", response.data)
+
+    def test_request_invalid_phone(self):
+        response = self.api_client.post(
+            "/accounts/api/otp/request/",
+            {"phone_number": "12345"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("phone_number", response.data)
+
+
+class PhoneNormalizationTests(SimpleTestCase):
+
+    def test_normalize_formats_to_e164(self):
+        self.assertEqual(normalize_phone("+7 (917) 404-41-44"),
+                         "+79174044144")
+        self.assertEqual(normalize_phone("+79174044144"), "+79174044144")
+
+    def test_normalize_rejects_invalid(self):
+        for value in ["12345", "+7917", "+7abc4044144", "", None,
+                      "+79174044144" * 3]:
+            with self.assertRaises(InvalidPhoneNumber):
+                normalize_phone(value)
+
+    @patch("accounts.phones.phonenumbers.parse",
+           wraps=phonenumbers.parse)
+    def test_normalize_caches_results(self, mock_parse):
+        normalize_phone("+7 917 404 41 99")
+        normalize_phone("+7 917 404 41 99")
+        self.assertEqual(mock_parse.call_count, 1)
+
+    def test_normalize_phones_batch(self):
+        self.assertEqual(
+            list(normalize_phones(["+7 917 404 41 44", "12345"])),
+            [("+7 917 404 41 44", "+79174044144"), ("12345", None)],
+        )
+
+
+class ReferralTreeTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        # pk=1 -> a1, a2; a1 -> b1, b2; b1 -> c1
+        self.root = User.objects.get(pk=1)
+        self.a1 = User.objects.create_user("+79174044150",
+                                           invited_by=self.root)
+        self.a2 = User.objects.create_user("+79174044151",
+                                           invited_by=self.root)
+        self.b1 = User.objects.create_user("+79174044152",
+                                           invited_by=self.a1)
+        self.b2 = User.objects.create_user("+79174044153",
+                                           invited_by=self.a1)
+        self.c1 = User.objects.create_user("+79174044154",
+                                           invited_by=self.b1)
+
+    def test_descendants_single_query(self):
+        with self.assertNumQueries(1):
+            found = [(u.pk, u.depth)
+                     for u in User.objects.descendants(self.root)]
+        self.assertEqual(found, [
+            (self.a1.pk, 1), (self.a2.pk, 1),
+            (self.b1.pk, 2), (self.b2.pk, 2),
+            (self.c1.pk, 3),
+        ])
+
+    def test_descendants_limits(self):
+        self.assertEqual(
+            len(list(User.objects.descendants(self.root, max_depth=2))), 4
+        )
+        self.assertEqual(
+            len(list(User.objects.descendants(self.root, limit=2))), 2
+        )
+
+    def test_ancestors(self):
+        self.assertEqual(
+            [(u.pk, u.depth) for u in User.objects.ancestors(self.c1)],
+            [(self.b1.pk, 1), (self.a1.pk, 2), (self.root.pk, 3)],
+        )
+
+    def test_counts(self):
+        with self.assertNumQueries(1):
+            counts = User.objects.depth_counts(self.root)
+        self.assertEqual(counts, {1: 2, 2: 2, 3: 1})
+        self.assertEqual(User.objects.subtree_size(self.root), 5)
+        self.assertEqual(User.objects.subtree_size(self.a1.pk), 3)
+
+    def test_iter_descendants(self):
+        rows = list(User.objects.iter_descendants(self.a1, chunk_size=1))
+        self.assertEqual(
+            [(row[0], row[3]) for row in rows],
+            [(self.b1.pk, 1), (self.b2.pk, 1), (self.c1.pk, 2)],
+        )
+
+
+class ReferralStatsTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        self.api_client = APIClient()
+        self.root = User.objects.get(pk=1)
+        self.a1 = User.objects.create_user("+79174044150",
+                                           invited_by=self.root)
+        self.b1 = User.objects.create_user("+79174044152",
+                                           invited_by=self.a1)
+        # У нового пользователя уже есть своё поддерево
+        self.orphan = User.objects.create_user("+79174044160")
+        User.objects.create_user("+79174044161", invited_by=self.orphan)
+
+    def snapshot(self):
+        return {
+            stats.user_id: (stats.direct_count, stats.total_descendants)
+            for stats in ReferralStats.objects.all()
+        }
+
+    def test_activation_updates_all_ancestors(self):
+        self.api_client.force_authenticate(self.orphan)
+        response = self.api_client.post(
+            "/accounts/api/activate-invite/",
+            {"invite_code": self.b1.invite_code},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.snapshot(), {
+            self.root.pk: (1, 4),
+            self.a1.pk: (1, 3),
+            self.b1.pk: (1, 2),
+            self.orphan.pk: (1, 1),
+        })
+        self.assertIsNotNone(
+            ReferralStats.objects.get(pk=self.b1.pk).last_invite_at
+        )
+
+    def test_rebuild_matches_incremental(self):
+        incremental = self.snapshot()
+        ReferralStats.objects.all().delete()
+        self.assertEqual(ReferralStats.objects.rebuild(), 3)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def assertMatchesRebuild(self):
+        incremental = {pk: counts for pk, counts in self.snapshot().items()
+                       if counts != (0, 0)}
+        ReferralStats.objects.rebuild()
+        self.assertEqual(incremental, self.snapshot())
+
+    def test_inviter_change_in_admin_moves_subtree(self):
+        admin = User.objects.create_superuser("+79174044300", "pass")
+        self.client.force_login(admin)
+        response = self.client.post(
+            f"/admin/accounts/user/{self.a1.pk}/change/",
+            {"phone_number": self.a1.phone_number,
+             "invite_code": self.a1.invite_code,
+             "invited_by": self.orphan.pk},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.snapshot()[self.orphan.pk], (2, 3))
+        self.assertEqual(self.snapshot()[self.root.pk], (0, 0))
+        self.assertMatchesRebuild()
+
+    def test_delete_subtracts_subtree(self):
+        self.b1.delete()
+        self.assertEqual(self.snapshot()[self.root.pk], (1, 1))
+        self.assertMatchesRebuild()
+
+    def test_bulk_delete_within_one_tree(self):
+        leaf = User.objects.create_user("+79174044153", invited_by=self.b1)
+        # Удаляется потомок через поколение или прямой приглашённый
+        for users in ([self.a1.pk, leaf.pk], [self.a1.pk, self.b1.pk]):
+            with self.subTest(users=users):
+                with transaction.atomic():
+                    User.objects.filter(pk__in=users).delete()
+                    self.assertEqual(self.snapshot()[self.root.pk], (0, 0))
+                    self.assertMatchesRebuild()
+                    transaction.set_rollback(True)
+
+    def test_profile_reads_counts(self):
+        self.api_client.force_authenticate(self.root)
+        data = self.api_client.get("/accounts/api/profile/").json()
+        self.assertEqual(data["invited_count"], 1)
+        self.assertEqual(data["total_referrals"], 2)
+
+
+@override_settings(INVITEES_PAGE_SIZE=2)
+class InviteesPaginationTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        self.api_client = APIClient()
+        self.user = User.objects.get(pk=1)
+        self.phones = [f"+7917404415{i}" for i in range(5)]
+        for phone in self.phones:
+            User.objects.create_user(phone, invited_by=self.user)
+        self.api_client.force_authenticate(self.user)
+
+    def test_profile_returns_first_page(self):
+        data = self.api_client.get("/accounts/api/profile/").json()
+        self.assertEqual(data["invited_count"], 5)
+        self.assertEqual(data["invited_users"], self.phones[:2])
+        self.assertIn("/accounts/api/profile/invitees/?after=",
+                      data["invited_users_next"])
+
+    def test_keyset_pages_cover_all_invitees(self):
+        collected = []
+        url = "/accounts/api/profile/invitees/"
+        while url:
+            response = self.api_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            collected.extend(response.data["results"])
+            url = response.data["next"]
+        self.assertEqual(collected, self.phones)
+
+    def test_rejects_invalid_cursor_and_limit(self):
+        url = "/accounts/api/profile/invitees/"
+        for query in ("limit=-1", "limit=0", "after=-1", "after=x",
+                      "limit=2.5"):
+            response = self.api_client.get(f"{url}?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_page_size_clamped(self):
+        self.assertEqual(
+            User.objects.invitees_page(self.user, limit=-1),
+            (self.phones[:1], User.objects.get(
+                phone_number=self.phones[0]).pk),
+        )
+
+    def test_ndjson_export(self):
+        response = self.api_client.get(
+            "/accounts/api/profile/invitees/?export=ndjson"
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["phone_number"] for line in lines],
+            self.phones,
+        )
+
+    @override_settings(ASYNC_VIEWS=True)
+    def test_ndjson_export_streams_async_under_asgi(self):
+        response = self.api_client.get(
+            "/accounts/api/profile/invitees/?export=ndjson"
+        )
+        self.assertTrue(response.is_async)
+
+        async def consume():
+            return [line async for line in response.streaming_content]
+
+        lines = b"".join(async_to_sync(consume)()).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["phone_number"] for line in lines],
+            self.phones,
+        )
+
+
+class StatelessAuthenticationTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        cache.delete_pattern("auth_token_version_*")
+        token_versions.clear()
+        self.api_client = APIClient()
+        self.user = User.objects.get(pk=1)
+        self.refresh = ClaimsRefreshToken.for_user(self.user)
+        self.authorize(self.refresh.access_token)
+
+    def authorize(self, token):
+        self.api_client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+
+    def test_cached_profile_without_db_queries(self):
+        self.assertEqual(
+            self.refresh.access_token["phone_number"], self.user.phone_number
+        )
+        self.api_client.get("/accounts/api/profile/")
+        with self.assertNumQueries(0):
+            response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["invite_code"],
+                         self.user.invite_code)
+
+    def test_deactivation_revokes_token(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 401)
+
+        response = self.api_client.post("/accounts/api/token/refresh/",
+                                        {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh_issues_fresh_claims(self):
+        self.user.phone_number = "+79174044199"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 401)
+
+        response = self.api_client.post("/accounts/api/token/refresh/",
+                                        {"refresh": str(self.refresh)})
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.data["access"])
+        self.assertEqual(access["phone_number"], "+79174044199")
+        self.authorize(access)
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["phone_number"], "+79174044199")
+
+    def test_revocation_from_other_process_after_local_ttl(self):
+        # Версию сдвинул другой воркер: этот процесс ещё помнит старую
+        self.api_client.get("/accounts/api/profile/")
+        cache.set(f"auth_token_version_{self.user.pk}",
+                  self.refresh.access_token["ver"] + 1)
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 200)
+
+        with self.settings(AUTH_TOKEN_VERSION_CACHE_TTL=0):
+            response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_without_claims_checked_in_db(self):
+        self.authorize(AccessToken.for_user(self.user))
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 401)
+
+
+class ProfileCacheTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        self.api_client = APIClient()
+        self.user = User.objects.get(pk=1)
+        self.api_client.force_authenticate(self.user)
+
+    def test_conditional_get_returns_304(self):
+        response = self.api_client.get("/accounts/api/profile/")
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.api_client.get("/accounts/api/profile/",
+                                           HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_activation_invalidates_inviter_profile(self):
+        etag = self.api_client.get("/accounts/api/profile/")["ETag"]
+        invitee = User.objects.create_user("+79174044170")
+        self.api_client.force_authenticate(invitee)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.api_client.post(
+                "/accounts/api/activate-invite/",
+                {"invite_code": self.user.invite_code},
+            )
+
+        self.api_client.force_authenticate(self.user)
+        response = self.api_client.get("/accounts/api/profile/",
+                                       HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("+79174044170", response.json()["invited_users"])
+
+    def test_cache_miss_builds_profile_from_primary(self):
+        pinned = []
+
+        def build(user):
+            pinned.append(db_router._routing_state.get().pinned)
+            return build_profile(user)
+
+        with patch("accounts.profile_cache.build_profile",
+                   side_effect=build):
+            get_profile_json(self.user)
+            get_profile_json(self.user)
+        self.assertEqual(pinned, [True])
+
+    def test_invalidation_during_build_skips_cache_write(self):
+        def build(user):
+            data = build_profile(user)
+            # Коммит и сброс кэша, пока собирается профиль
+            invalidate_profiles([user.pk])
+            return data
+
+        with patch("accounts.profile_cache.build_profile",
+                   side_effect=build):
+            get_profile_json(self.user)
+        self.assertIsNone(cache.get(f"profile_json_{self.user.pk}"))
+
+        with patch("accounts.profile_cache.build_profile",
+                   wraps=build_profile) as mock_build:
+            get_profile_json(self.user)
+            get_profile_json(self.user)
+        mock_build.assert_called_once()
+
+    def test_async_invalidation_during_build_skips_cache_write(self):
+        async def build(user):
+            data = await abuild_profile(user)
+            await sync_to_async(invalidate_profiles)([user.pk])
+            return data
+
+        with patch("accounts.profile_cache.abuild_profile",
+                   side_effect=build):
+            async_to_sync(aget_profile_json)(self.user)
+        self.assertIsNone(cache.get(f"profile_json_{self.user.pk}"))
+
+    def test_invite_code_change_invalidates_own_profile(self):
+        self.api_client.get("/accounts/api/profile/")
+        self.user.invite_code = "ZZZZZZ"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        data = self.api_client.get("/accounts/api/profile/").json()
+        self.assertEqual(data["invite_code"], "ZZZZZZ")
+
+
+class UserAdminTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser("+79174044300", "pass")
+        self.client.force_login(self.admin)
+
+    def changelist(self, **params):
+        return self.client.get("/admin/accounts/user/", params)
+
+    def found(self, query):
+        return {user.phone_number
+                for user in self.changelist(q=query).context["cl"].result_list}
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        inviter = User.objects.get(pk=1)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.changelist().status_code, 200)
+        for i in range(20):
+            User.objects.create_user(f"+7917404420{i:02d}",
+                                     invited_by=inviter)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.changelist().status_code, 200)
+        self.assertEqual(len(many), len(few))
+
+    def test_search(self):
+        user = User.objects.get(pk=1)
+        self.assertEqual(self.found(user.invite_code.lower()),
+                         {user.phone_number})
+        self.assertEqual(self.found("+7 (917) 404-41-44"), {"+79174044144"})
+        self.assertIn("+79174044144", self.found("+7917"))
+        self.assertNotIn("+79174044300", self.found("+7917404414"))
+        self.assertIn("+79174044144", self.found("4044"))
+        self.assertEqual(self.found("+7000"), set())
+
+    @unittest.skipUnless(connection.vendor == "postgresql",
+                         "Оценка числа строк есть только в PostgreSQL")
+    def test_estimated_count_skips_count_query(self):
+        paginator = EstimatedCountPaginator(User.objects.order_by("pk"), 100)
+        with self.settings(ADMIN_EXACT_COUNT_LIMIT=0), \
+                CaptureQueriesContext(connection) as queries:
+            self.assertGreater(paginator.count, 0)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0]["sql"].startswith("EXPLAIN"))
+
+        paginator = EstimatedCountPaginator(User.objects.order_by("pk"), 100)
+        self.assertEqual(paginator.count, User.objects.count())
+
+
+class OpenAPISchemaTests(SimpleTestCase):
+
+    def setUp(self):
+        drf_yasg._schemas.clear()
+        self.addCleanup(drf_yasg._schemas.clear)
+
+    def test_schema_generated_once_with_etag(self):
+        with patch("referral_project.drf_yasg.generate_schema",
+                   wraps=drf_yasg.generate_schema) as generate:
+            response = self.client.get("/swagger.json")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("/otp/request/",
+                          response.json()["paths"])
+            etag = response["ETag"]
+
+            response = self.client.get("/swagger.json",
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(self.client.get("/swagger.yaml").status_code,
+                             200)
+        self.assertEqual(generate.call_count, 2)
+
+    def test_command_output_is_served(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(OPENAPI_SCHEMA_DIR=directory):
+            call_command("generate_openapi_schema", stdout=StringIO())
+            with open(drf_yasg.schema_path(".json"), "rb") as f:
+                expected = f.read()
+            with patch("referral_project.drf_yasg.generate_schema") as gen:
+                response = self.client.get("/swagger.json")
+        gen.assert_not_called()
+        self.assertEqual(response.content, expected)
+
+    def test_ui_loads_cached_schema(self):
+        response = self.client.get("/swagger/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "/swagger.json")
+
+    def test_schema_describes_async_routes(self):
+        code = (
+            "import django, json; django.setup(); "
+            "from referral_project.drf_yasg import generate_schema; "
+            "print(generate_schema('.json').decode())"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True,
+            text=True, env={**os.environ, "WEB_SERVER": "asgi"},
+        ).stdout
+        paths = json.loads(output)["paths"]
+        self.assertIn("/profile/", paths)
+        self.assertIn("/activate-invite/", paths)
+
+    def test_urls_do_not_import_drf_yasg_views(self):
+        code = (
+            "import sys, django; django.setup(); "
+            "import referral_project.urls; "
+            "assert 'drf_yasg.views' not in sys.modules"
+        )
+        subprocess.run([sys.executable, "-c", code], check=True)
+
+
+class MetricsTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        cache.delete_pattern("otp_*")
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_route_latency(self):
+        labels = {"method": "GET", "route": "accounts/api/profile/",
+                  "status": "200"}
+        before = self.sample("http_request_duration_seconds_count", **labels)
+        api_client = APIClient()
+        api_client.force_authenticate(User.objects.get(pk=1))
+        api_client.get("/accounts/api/profile/")
+        self.assertEqual(
+            self.sample("http_request_duration_seconds_count", **labels),
+            before + 1,
+        )
+
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'route="accounts/api/profile/"')
+
+    def test_sms_gateway_status_and_retries(self):
+        server = StubSMSAeroServer(error_rate=1.0).start()
+        self.addCleanup(server.stop)
+        client = SMSAeroClient(url=server.url, email="test", api_key="test",
+                               backoff_factor=0, max_retries=2)
+        self.addCleanup(client.close)
+        labels = {"operation": "send", "status": "503"}
+        before = self.sample("sms_gateway_request_duration_seconds_count",
+                             **labels)
+        retries = self.sample("sms_gateway_retries_total", operation="send")
+
+        client.send("79174044144", "Тест")
+        self.assertEqual(
+            self.sample("sms_gateway_request_duration_seconds_count",
+                        **labels),
+            before + 1,
+        )
+        self.assertEqual(
+            self.sample("sms_gateway_retries_total", operation="send"),
+            retries + 2,
+        )
+
+    def test_otp_cache_hits_and_misses(self):
+        def count(operation, result):
+            return self.sample("otp_cache_requests_total",
+                               operation=operation, result=result)
+
+        before = {key: count(*key) for key in
+                  [("issue", "stored"), ("verify", "hit"),
+                   ("verify", "miss")]}
+        otp_store.issue(79174044144, "1234")
+        otp_store.verify(79174044144, "0000")
+        otp_store.verify(79174044145, "1234")
+        for key, value in before.items():
+            self.assertEqual(count(*key), value + 1, key)
+
+    def test_celery_task_duration(self):
+        labels = {"task": "accounts.tasks.flush_sms_buffer",
+                  "state": "SUCCESS"}
+        before = self.sample("celery_task_duration_seconds_count", **labels)
+        flush_sms_buffer.apply()
+        self.assertEqual(
+            self.sample("celery_task_duration_seconds_count", **labels),
+            before + 1,
+        )
+
+    def test_metrics_aggregate_across_processes(self):
+        code = (
+            "import django; django.setup(); "
+            "from referral_project import metrics; "
+            "metrics.OTP_CACHE_REQUESTS.labels('verify', 'hit').inc()"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": directory}
+            for _ in range(2):
+                subprocess.run([sys.executable, "-c", code], env=env,
+                               check=True)
+            with patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory):
+                response = self.client.get("/metrics")
+        self.assertContains(
+            response,
+            'otp_cache_requests_total{operation="verify",result="hit"} 2.0',
+        )
+
+
+class RequestProfilingTests(TestCase):
+    fixtures = ['test_users.json']
+    profile_url = "/accounts/api/profile/"
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        self.api_client = APIClient()
+        self.api_client.force_authenticate(User.objects.get(pk=1))
+
+    def test_profile_counts(self):
+        with capture_profiles() as profiles:
+            self.api_client.get(self.profile_url)
+            self.api_client.get(self.profile_url)
+        cold, cached = profiles
+        self.assertEqual(cold.view, "api_profile")
+        # Строка профиля, статистика и первая страница приглашённых
+        self.assertEqual(cold.counts(), {"queries": 3, "redis": 2, "http": 0})
+        self.assertEqual(cached.counts(),
+                         {"queries": 0, "redis": 1, "http": 0})
+
+    def test_outbound_http_counted(self):
+        server = StubSMSAeroServer(error_rate=1.0).start()
+        self.addCleanup(server.stop)
+        client = SMSAeroClient(url=server.url, email="test", api_key="test",
+                               backoff_factor=0, max_retries=1)
+        self.addCleanup(client.close)
+
+        def view(request):
+            client.send("79174044144", "Тест")
+            return HttpResponse()
+
+        with capture_profiles() as profiles:
+            RequestProfilingMiddleware(view)(RequestFactory().get("/"))
+        # Повтор после ответа 503 — отдельный HTTP-запрос
+        self.assertEqual(profiles[0].http, 2)
+        self.assertIsNone(profiles[0].view)
+
+    def test_savepoints_and_script_loads_not_counted(self):
+        redis = get_redis_connection("default")
+        script = redis.register_script("return 1")
+        redis.script_flush()
+
+        def view(request):
+            with transaction.atomic():
+                User.objects.count()
+            script()
+            return HttpResponse()
+
+        with capture_profiles() as profiles:
+            RequestProfilingMiddleware(view)(RequestFactory().get("/"))
+        self.assertEqual(profiles[0].counts(),
+                         {"queries": 1, "redis": 1, "http": 0})
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=1,
+                       REQUEST_PROFILER="cprofile")
+    def test_cprofile_skips_async_requests(self):
+        self.assertIsNone(Sampler.maybe_start(async_mode=True))
+        sampler = Sampler.maybe_start()
+        self.assertIsNotNone(sampler)
+        sampler.stop()
+
+    @override_settings(REQUEST_BUDGETS={"api_profile": {"queries": 2}},
+                       REQUEST_BUDGETS_STRICT=True)
+    def test_budget_exceeded_fails_in_tests(self):
+        with self.assertRaisesMessage(BudgetExceeded, "queries 3 из 2"):
+            self.api_client.get(self.profile_url)
+
+    @override_settings(REQUEST_BUDGETS={"api_profile": {"queries": 2}},
+                       REQUEST_BUDGETS_STRICT=False)
+    def test_budget_exceeded_logged(self):
+        labels = {"route": "accounts/api/profile/", "resource": "queries"}
+        before = REGISTRY.get_sample_value("request_budget_exceeded_total",
+                                           labels) or 0
+        with self.assertLogs("referral_project.profiling", "WARNING") as logs:
+            response = self.api_client.get(self.profile_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("queries 3 из 2", logs.output[0])
+        self.assertEqual(
+            REGISTRY.get_sample_value("request_budget_exceeded_total",
+                                      labels),
+            before + 1,
+        )
+        # Профиль из кэша укладывается в бюджет
+        with self.assertNoLogs("referral_project.profiling", "WARNING"):
+            self.api_client.get(self.profile_url)
+
+    def test_slow_request_profile_saved(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(REQUEST_PROFILE_SAMPLE_RATE=1,
+                                   REQUEST_PROFILE_SLOW_MS=0,
+                                   REQUEST_PROFILE_DIR=directory):
+                self.api_client.get(self.profile_url)
+            [name] = os.listdir(directory)
+            self.assertIn("-api_profile-", name)
+            self.assertTrue(name.endswith(".prof"))
+            stats = pstats.Stats(os.path.join(directory, name))
+        self.assertIn("get_profile_json",
+                      {function for _, _, function in stats.stats})
+
+    @override_settings(REQUEST_PROFILE_SAMPLE_RATE=1,
+                       REQUEST_PROFILE_SLOW_MS=10_000)
+    def test_fast_request_profile_discarded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(REQUEST_PROFILE_DIR=directory):
+                self.api_client.get(self.profile_url)
+            self.assertEqual(os.listdir(directory), [])
+
+
+class InviteCodeTests(TestCase):
+
+    def test_permutation_is_bijective(self):
+        permutation = FeistelPermutation("test-key")
+        numbers = range(BLOCK_SIZE, BLOCK_SIZE * 5)
+        codes = {permutation.permute(number) for number in numbers}
+        self.assertEqual(len(codes), len(numbers))
+        for number in numbers[:100]:
+            self.assertEqual(
+                permutation.invert(permutation.permute(number)), number
+            )
+
+    def test_encode_roundtrip(self):
+        code = encode(2 ** 40 - 1)
+        self.assertEqual(code, "ZZZZZZZZ")
+        self.assertEqual(decode(code), 2 ** 40 - 1)
+        self.assertEqual(decode(encode(12345)), 12345)
+
+    def test_allocator_reserves_blocks(self):
+        allocator = InviteCodeAllocator(key="test-key")
+        codes = [allocator.next_code() for _ in range(BLOCK_SIZE + 1)]
+        self.assertEqual(len(set(codes)), len(codes))
+        self.assertEqual(InviteCodeBlock.objects.count(), 2)
+        for code in codes:
+            self.assertEqual(len(code), 8)
+            self.assertTrue(set(code) <= set(ALPHABET))
+
+    def test_allocator_refuses_changed_key(self):
+        InviteCodeAllocator(key="test-key").next_code()
+        with self.assertRaises(ImproperlyConfigured):
+            InviteCodeAllocator(key="other-key").next_code()
+        self.assertEqual(InviteCodeBlock.objects.count(), 1)
+
+    def test_create_user_assigns_code(self):
+        first = User.objects.create_user("+79174044180")
+        second = User.objects.create_user("+79174044181")
+        self.assertEqual(len(first.invite_code), 8)
+        self.assertNotEqual(first.invite_code, second.invite_code)
+
+
+class UserImportTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def test_bulk_import_links_inviters(self):
+        rows = [
+            # Пригласивший из того же файла идёт позже приглашённого
+            {"phone_number": "+7 917 404-41-91",
+             "invited_by": "+79174044190"},
+            {"phone_number": "+79174044190", "invited_by": "+79174044144"},
+            {"phone_number": "12345"},
+            {"phone_number": "+79174044190"},
+            {"phone_number": "+79174044145"},
+            {"phone_number": "+79174044192", "invited_by": "+79990000000"},
+        ]
+        stats = User.objects.bulk_import(rows, chunk_size=2)
+
+        self.assertEqual((stats.read, stats.created, stats.linked,
+                          stats.rejected), (6, 3, 2, 4))
+        invitee = User.objects.get(phone_number="+79174044191")
+        self.assertEqual(invitee.invited_by.phone_number, "+79174044190")
+        self.assertEqual(len(invitee.invite_code), 8)
+        self.assertFalse(invitee.has_usable_password())
+        self.assertEqual(
+            ReferralStats.objects.for_user(1).total_descendants, 2
+        )
+
+    def test_bulk_import_rejects_cycles(self):
+        rows = [
+            {"phone_number": "+79174044201", "invited_by": "+79174044202"},
+            {"phone_number": "+79174044202", "invited_by": "+79174044201"},
+            {"phone_number": "+79174044203", "invited_by": "+79174044204"},
+            {"phone_number": "+79174044204", "invited_by": "+79174044205"},
+            {"phone_number": "+79174044205", "invited_by": "+79174044203"},
+        ]
+        # Порция целиком — цикл внутри порции; по одной строке — через
+        # ссылки, уже записанные в БД
+        for chunk_size in (10, 1):
+            with self.subTest(chunk_size=chunk_size):
+                User.objects.filter(phone_number__in=[
+                    row["phone_number"] for row in rows
+                ]).delete()
+                rejects = []
+                stats = User.objects.bulk_import(
+                    rows, chunk_size=chunk_size,
+                    reject=lambda line, row, reason: rejects.append(
+                        (line, row["phone_number"], reason)
+                    ),
+                )
+                self.assertEqual((stats.created, stats.linked), (5, 3))
+                self.assertEqual(rejects, [
+                    (2, "+79174044202", "cycle"),
+                    (5, "+79174044205", "cycle"),
+                ])
+                self.assertEqual(
+                    [user.phone_number for user in User.objects.ancestors(
+                        User.objects.get(phone_number="+79174044203")
+                    )],
+                    ["+79174044204", "+79174044205"],
+                )
+
+    @unittest.skipUnless(connection.vendor == "postgresql",
+                         "Нужен триггер accounts_user_prevent_cycle")
+    @override_settings(REFERRAL_MAX_DEPTH=1)
+    def test_bulk_import_rejects_cycle_found_by_trigger(self):
+        rows = [
+            {"phone_number": f"+7917404421{i}",
+             "invited_by": f"+7917404421{(i + 1) % 4}"}
+            for i in range(4)
+        ]
+        rejects = []
+        stats = User.objects.bulk_import(
+            rows, chunk_size=1,
+            reject=lambda line, row, reason: rejects.append((line, reason)),
+        )
+        self.assertEqual(stats.linked, 3)
+        self.assertEqual(rejects, [(4, "cycle")])
+
+    def test_command_writes_rejects(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source = os.path.join(tmp, "users.ndjson")
+            rejects = os.path.join(tmp, "rejects.csv")
+            with open(source, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"phone_number": "+79174044193"}) + "\n")
+                f.write(json.dumps({"phone_number": "bad"}) + "\n")
+                f.write('{"phone_number": "+79174044194"\n')
+                f.write(json.dumps(["+79174044194"]) + "\n")
+                f.write(json.dumps({"phone_number": "+79174044194"}) + "\n")
+            call_command("import_users", source, rejects=rejects,
+                         stdout=open(os.devnull, "w"))
+            with open(rejects, encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertTrue(
+            User.objects.filter(phone_number="+79174044193").exists()
+        )
+        self.assertTrue(
+            User.objects.filter(phone_number="+79174044194").exists()
+        )
+        self.assertEqual(rows, [
+            {"line": "2", "phone_number": "bad", "invited_by": "",
+             "reason": "invalid_phone"},
+            {"line": "3", "phone_number": "", "invited_by": "",
+             "reason": "invalid_json"},
+            {"line": "4", "phone_number": "", "invited_by": "",
+             "reason": "invalid_row"},
+        ])
+
+
+class InviteActivationTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("invite_code_*")
+        self.api_client = APIClient()
+        self.inviter = User.objects.get(pk=1)
+        self.user = User.objects.create_user("+79174044194")
+
+    def activate(self, user, code):
+        self.api_client.force_authenticate(user)
+        return self.api_client.post("/accounts/api/activate-invite/",
+                                    {"invite_code": code})
+
+    def test_activation_outcomes(self):
+        response = self.activate(self.user, "NOPE")
+        self.assertEqual(response.status_code, 404)
+        response = self.activate(self.user, self.user.invite_code)
+        self.assertEqual(response.status_code, 400)
+
+        response = self.activate(self.user, self.inviter.invite_code)
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.invited_by_id, self.inviter.pk)
+        self.assertEqual(
+            ReferralStats.objects.for_user(self.inviter).direct_count, 1
+        )
+
+        response = self.activate(self.user, "GHIJKL")
+        self.assertEqual(response.data["detail"],
+                         "Вы уже активировали инвайт-код.")
+
+    def test_cycle_is_rejected(self):
+        self.activate(self.user, self.inviter.invite_code)
+        response = self.activate(self.inviter, self.user.invite_code)
+        self.assertEqual(response.status_code, 400)
+        self.inviter.refresh_from_db()
+        self.assertIsNone(self.inviter.invited_by_id)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql",
+                     "Нужны блокировки строк PostgreSQL")
+class ConcurrentActivationTests(TransactionTestCase):
+    # Вне транзакции чтение может уйти в реплику (DB_REPLICA_HOSTS)
+    databases = "__all__"
+
+    @classmethod
+    def tearDownClass(cls):
+        # Пул реплики-зеркала держит соединения с тестовой БД и мешает
+        # её удалить
+        for alias in db_router.replica_aliases():
+            connections[alias].close_pool()
+        super().tearDownClass()
+
+    def run_parallel(self, calls):
+        def call(args):
+            try:
+                return User.objects.activate_invite(*args)[0]
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+            return list(pool.map(call, calls))
+
+    def test_single_winner_for_one_user(self):
+        user = User.objects.create_user("+79174044100")
+        inviters = [User.objects.create_user(f"+7917404420{i}")
+                    for i in range(8)]
+        outcomes = self.run_parallel(
+            [(User.objects.get(pk=user.pk), inviter.invite_code)
+             for inviter in inviters]
+        )
+        self.assertEqual(outcomes.count(User.objects.ACTIVATED), 1)
+        self.assertEqual(outcomes.count(User.objects.ALREADY_ACTIVATED), 7)
+        self.assertEqual(
+            sum(ReferralStats.objects.values_list("direct_count", flat=True)),
+            1,
+        )
+
+    def test_opposite_activations_do_not_create_cycle(self):
+        calls = []
+        for i in range(4):
+            a = User.objects.create_user(f"+7917404430{i}")
+            b = User.objects.create_user(f"+7917404431{i}")
+            calls += [(a, b.invite_code), (b, a.invite_code)]
+        outcomes = self.run_parallel(calls)
+        for i in range(0, len(outcomes), 2):
+            self.assertEqual(
+                sorted(outcomes[i:i + 2]),
+                sorted([User.objects.ACTIVATED, User.objects.CYCLE]),
+            )
+
+
+@override_settings(INVITE_FILTER_CAPACITY=1000, INVITE_FILTER_ERROR_RATE=0.01)
+class InviteFilterTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("invite_code_*")
+        self.api_client = APIClient()
+        self.user = User.objects.create_user("+79174044195")
+        self.api_client.force_authenticate(self.user)
+
+    def tearDown(self):
+        # Построенный фильтр не знает о пользователях других тестов
+        cache.delete_pattern("invite_code_*")
+
+    def activate(self, code):
+        return self.api_client.post("/accounts/api/activate-invite/",
+                                    {"invite_code": code})
+
+    def test_unknown_code_rejected_without_db(self):
+        call_command("rebuild_invite_filter", stdout=open(os.devnull, "w"))
+        self.assertTrue(invite_filter.might_exist("ABCDEF"))
+        with self.assertNumQueries(0):
+            response = self.activate("ZZZZZZZZ")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(invite_filter.stats()["rejected"], 1)
+
+        response = self.activate("ABCDEF")
+        self.assertEqual(response.status_code, 200)
+
+    def test_negative_cache_without_filter(self):
+        response = self.activate("ZZZZZZZZ")
+        self.assertEqual(response.status_code, 404)
+        with self.assertNumQueries(0):
+            response = self.activate("ZZZZZZZZ")
+        self.assertEqual(response.status_code, 404)
+        stats = invite_filter.stats()
+        self.assertEqual((stats["unavailable"], stats["db_misses"],
+                          stats["negative_hits"]), (1, 1, 1))
+
+    def test_new_codes_are_added(self):
+        invite_filter.rebuild(["ABCDEF", "GHIJKL"])
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user("+79174044196")
+        self.assertTrue(invite_filter.might_exist(user.invite_code))
+
+    def test_codes_added_during_rebuild_are_kept(self):
+        def codes():
+            yield "ABCDEF"
+            invite_filter.add(["MNPQRS"])
+            yield "GHIJKL"
+
+        invite_filter.rebuild(codes())
+        for code in ("ABCDEF", "GHIJKL", "MNPQRS"):
+            self.assertTrue(invite_filter.might_exist(code))
+
+    def test_missing_bitmap_falls_back_to_db(self):
+        invite_filter.rebuild(["ABCDEF"])
+        invite_filter.redis.delete(invite_filter.key("bloom"))
+        invite_filter.add(["GHIJKL"])
+        # Карта не создаётся заново частично заполненной
+        self.assertFalse(
+            invite_filter.redis.exists(invite_filter.key("bloom"))
+        )
+        self.assertTrue(invite_filter.might_exist("ABCDEF"))
+        self.assertEqual(invite_filter.stats()["unavailable"], 1)
+
+    async def test_async_check_counts_like_sync(self):
+        invite_filter.rebuild(["ABCDEF"])
+        invite_filter.record_miss("GHIJKL")
+        expected = {"ABCDEF": True, "ZZZZZZZZ": False, "GHIJKL": False}
+        for code, exists in expected.items():
+            self.assertIs(await invite_filter.amight_exist(code), exists)
+            self.assertIs(invite_filter.might_exist(code), exists)
+        stats = invite_filter.stats()
+        self.assertEqual((stats["passed"], stats["rejected"],
+                          stats["negative_hits"]), (2, 2, 2))
+
+
+class ConnectionPoolSettingsTests(SimpleTestCase):
+
+    def test_pool_checks_connections(self):
+        # Пул создаётся без открытия соединений, сервер БД не нужен
+        code = (
+            "import django; django.setup(); "
+            "from django.db import connection; "
+            "from psycopg_pool import ConnectionPool; "
+            "assert connection.pool._check is ConnectionPool.check_connection"
+        )
+        subprocess.run(
+            [sys.executable, "-c", code], check=True, capture_output=True,
+            env={**os.environ, "DB_CONN_MODE": "pool",
+                 "DJANGO_SETTINGS_MODULE": "referral_project.settings"},
+        )
+
+
+@patch("referral_project.db_router.replica_aliases",
+       return_value=["replica_0", "replica_1"])
+class ReplicaRoutingTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.delete_pattern("db_primary_*")
+        db_router._replica_checks.clear()
+        self.factory = RequestFactory()
+
+    def test_reads_go_to_fresh_replica(self, aliases):
+        with patch("referral_project.db_router.replica_is_fresh",
+                   side_effect=lambda alias: alias == "replica_1"):
+            self.assertEqual(router.db_for_read(User), "replica_1")
+        self.assertEqual(router.db_for_write(User), "default")
+
+    def test_lagging_replicas_fall_back_to_primary(self, aliases):
+        with patch("referral_project.db_router.measure_replica_lag",
+                   side_effect=[5.0, None]) as measure:
+            self.assertEqual(router.db_for_read(User), "default")
+            # Результат проверки кэшируется
+            self.assertEqual(router.db_for_read(User), "default")
+        self.assertEqual(measure.call_count, 2)
+
+    def test_no_replicas(self, aliases):
+        aliases.return_value = []
+        self.assertEqual(router.db_for_read(User), "default")
+        self.assertEqual(router.db_for_write(User), "default")
+
+    def test_use_primary(self, aliases):
+        with patch("referral_project.db_router.replica_is_fresh",
+                   return_value=True):
+            with db_router.use_primary():
+                self.assertEqual(router.db_for_read(User), "default")
+            self.assertNotEqual(router.db_for_read(User), "default")
+
+    @patch("referral_project.db_router.replica_is_fresh", return_value=True)
+    def test_read_your_writes(self, fresh, aliases):
+        user = User(pk=42, phone_number="+79174044195")
+        token = str(AccessToken.for_user(user))
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(User))
+            if request.method == "POST":
+                router.db_for_write(User)
+                reads.append(router.db_for_read(User))
+            request.user = user
+            return HttpResponse()
+
+        middleware = db_router.ReplicaRoutingMiddleware(view)
+        middleware(self.factory.get("/"))
+        response = middleware(self.factory.post("/"))
+        self.assertTrue(reads[0].startswith("replica_"))
+        # Запись в запросе переключает его чтения на основную БД
+        self.assertTrue(reads[1].startswith("replica_"))
+        self.assertEqual(reads[2], "default")
+        cookie = response.cookies[middleware.cookie_name]
+
+        # Тот же браузер читает из основной БД
+        request = self.factory.get("/")
+        request.COOKIES[middleware.cookie_name] = cookie.value
+        middleware(request)
+        self.assertEqual(reads[-1], "default")
+
+        # API-клиент с токеном того же пользователя — тоже
+        middleware(self.factory.get(
+            "/", HTTP_AUTHORIZATION=f"Bearer {token}"
+        ))
+        self.assertEqual(reads[-1], "default")
+
+        # Остальные читают из реплик
+        middleware(self.factory.get("/"))
+        self.assertTrue(reads[-1].startswith("replica_"))
+        self.assertIsNone(db_router._routing_state.get())
+
+    @patch("referral_project.db_router.replica_is_fresh", return_value=True)
+    def test_forged_pin_cookie_ignored(self, fresh, aliases):
+        reads = []
+
+        def view(request):
+            reads.append(router.db_for_read(User))
+            return HttpResponse()
+
+        middleware = db_router.ReplicaRoutingMiddleware(view)
+        for value in ("1", str(time.time() + 3600), "1:forged:signature"):
+            request = self.factory.get("/")
+            request.COOKIES[middleware.cookie_name] = value
+            middleware(request)
+            self.assertTrue(reads[-1].startswith("replica_"), value)
+
+        # Подпись старше REPLICA_STICKY_SECONDS не закрепляет клиента
+        response = HttpResponse()
+        response.set_signed_cookie(middleware.cookie_name, "1",
+                                   salt=middleware.cookie_salt)
+        request = self.factory.get("/")
+        request.COOKIES[middleware.cookie_name] = (
+            response.cookies[middleware.cookie_name].value
+        )
+        with patch("django.core.signing.time.time",
+                   return_value=time.time() + 3600):
+            middleware(request)
+        self.assertTrue(reads[-1].startswith("replica_"))
+
+    @patch("referral_project.db_router.replica_is_fresh", return_value=True)
+    async def test_read_your_writes_async(self, fresh, aliases):
+        user = User(pk=42, phone_number="+79174044195")
+        auth = {"Authorization": f"Bearer {AccessToken.for_user(user)}"}
+        reads = []
+
+        async def view(request):
+            if request.method == "POST":
+                router.db_for_write(User)
+            reads.append(router.db_for_read(User))
+            request.user = user
+            return HttpResponse()
+
+        middleware = db_router.ReplicaRoutingMiddleware(view)
+        factory = AsyncRequestFactory()
+        await middleware(factory.post("/", headers=auth))
+        await middleware(factory.get("/", headers=auth))
+        await middleware(factory.get("/"))
+        self.assertEqual(reads[:2], ["default", "default"])
+        self.assertTrue(reads[2].startswith("replica_"))
+
+    def test_middleware_disabled_without_replicas(self, aliases):
+        aliases.return_value = []
+        with self.assertRaises(MiddlewareNotUsed):
+            db_router.ReplicaRoutingMiddleware(lambda request: None)
+
+
+class AsyncViewTests(TestCase):
+    fixtures = ['test_users.json']
+
+    def setUp(self):
+        cache.delete_pattern("profile_json_*")
+        cache.delete_pattern("invite_code_*")
+        cache.delete_pattern("ratelimit_*")
+        cache.delete_pattern("otp_*")
+        self.factory = AsyncRequestFactory()
+        self.user = User.objects.create_user("+79174044195")
+        self.auth = {"Authorization":
+                     f"Bearer {AccessToken.for_user(self.user)}"}
+
+    def browser_request(self, data, session=None):
+        request = self.factory.post("/accounts/login/", data)
+        request.user = AnonymousUser()
+        request.session = session or import_module(
+            settings.SESSION_ENGINE
+        ).SessionStore()
+        request._messages = FallbackStorage(request)
+        return request
+
+    async def test_profile(self):
+        view = AsyncUserProfileView.as_view()
+        response = await view(self.factory.get("/", headers=self.auth))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["phone_number"],
+                         self.user.phone_number)
+
+        response = await view(self.factory.get("/", headers={
+            "If-None-Match": response["ETag"], **self.auth
+        }))
+        self.assertEqual(response.status_code, 304)
+
+        response = await view(self.factory.get("/"))
+        self.assertEqual(response.status_code, 401)
+
+    async def test_profile_claims_token(self):
+        await sync_to_async(cache.delete_pattern)("auth_token_version_*")
+        token = await sync_to_async(
+            lambda: str(ClaimsRefreshToken.for_user(self.user).access_token)
+        )()
+        view = AsyncUserProfileView.as_view()
+        request = self.factory.get(
+            "/", headers={"Authorization": f"Bearer {token}"}
+        )
+        self.assertEqual((await view(request)).status_code, 200)
+
+        await sync_to_async(token_versions.bump)(self.user.pk)
+        self.assertEqual((await view(request)).status_code, 401)
+
+    async def test_profile_matches_sync_view(self):
+        inviter = await User.objects.aget(invite_code="ABCDEF")
+        await User.objects.filter(pk=self.user.pk).aupdate(
+            invited_by=inviter
+        )
+        self.user.invited_by_id = inviter.pk
+        response = await AsyncUserProfileView.as_view()(
+            self.factory.get("/", headers=self.auth)
+        )
+        # Синхронный кэш читает запись async-клиента
+        cached = await sync_to_async(cache.get)(
+            f"profile_json_{self.user.pk}"
+        )
+        self.assertEqual(cached, (response["ETag"], response.content))
+
+        await sync_to_async(cache.delete_pattern)("profile_json_*")
+        expected = await sync_to_async(get_profile_json)(self.user)
+        self.assertEqual(response["ETag"], expected[0])
+        self.assertEqual(json.loads(response.content)["invited_by"],
+                         inviter.phone_number)
+
+    async def test_activate_invite(self):
+        view = AsyncActivateInviteCodeView.as_view()
+
+        def post(code):
+            return view(self.factory.post(
+                "/", {"invite_code": code},
+                content_type="application/json", headers=self.auth
+            ))
+
+        self.assertEqual((await post("ZZZZZZZZ")).status_code, 404)
+        response = await post("ABCDEF")
+        self.assertEqual(response.status_code, 200)
+        inviter_code = await User.objects.filter(pk=self.user.pk).values_list(
+            "invited_by__invite_code", flat=True
+        ).aget()
+        self.assertEqual(inviter_code, "ABCDEF")
+        self.assertEqual((await post("ABCDEF")).status_code, 400)
+
+    @patch("accounts.tasks.send_otp_sms.apply_async")
+    async def test_login(self, apply_async):
+        request = self.browser_request({"phone_number": "+79174044195"})
+        response = await AsyncLoginView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Введите код из SMS")
+        phone = await request.session.aget("phone_number")
+        self.assertEqual(phone, 79174044195)
+        code = apply_async.call_args.kwargs["args"][1]
+        self.assertEqual(apply_async.call_args.kwargs["args"], (phone, code))
+        self.assertEqual(await otp_store.averify(phone, code),
+                         otp_store.VERIFIED)
+
+        await otp_store.aissue(phone, "1234")
+        request = self.browser_request({"code": "1234"}, request.session)
+        response = await AsyncLoginView.as_view()(request)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(request.user, self.user)
+
+    @patch("accounts.tasks.send_otp_sms.apply_async")
+    async def test_login_invalid_phone_skips_phone_limits(self,
+                                                          apply_async):
+        await sync_to_async(cache.delete_pattern)("ratelimit_*")
+        request = self.browser_request({"phone_number": "12345"})
+        response = await AsyncLoginView.as_view()(request)
+        self.assertContains(response, "Введите корректный номер телефона")
+        apply_async.assert_not_called()
+        self.assertEqual(await sync_to_async(cache.keys)("ratelimit_*"),
+                         ["ratelimit_otp_ip_127.0.0.1"])
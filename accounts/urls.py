@@ -1,31 +1,76 @@
+from django.conf import settings
 from django.contrib.auth.views import LogoutView
 from django.urls import path
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from .views import (
     ActivateInviteCodeAPIView,
+    AsyncActivateInviteCodeView,
+    AsyncLoginView,
+    AsyncUserProfileView,
+    BroadcastAPIView,
+    BroadcastDetailAPIView,
+    InviteesAPIView,
     LoginView,
+    OTPRequestAPIView,
+    OTPVerifyAPIView,
     SendSMSView,
     UserProfileAPIView,
     index,
     profile,
 )
 
-urlpatterns = [
-    path("", index, name="index"),
-    path("login/", LoginView.as_view(), name="login"),
-    path("profile-page/", profile, name="profile_page"),
-    path("logout/", LogoutView.as_view(), name="logout"),
-    path("api/profile/", UserProfileAPIView.as_view(), name="api_profile"),
-    path(
-        "api/activate-invite/",
-        ActivateInviteCodeAPIView.as_view(),
-        name="api_activate_invite",
-    ),
-    path("api/token/", TokenObtainPairView.as_view(),
-         name="token_obtain_pair"),
-    path("api/token/refresh/",
-         TokenRefreshView.as_view(),
-         name="token_refresh"),
-    path("send-sms/", SendSMSView.as_view(), name="send_sms"),
-]
+
+def build_urlpatterns(async_views):
+    """
+    Маршруты приложения.
+
+    Под ASGI нагруженные представления работают в цикле событий, под WSGI
+    async-представление выполнялось бы в отдельном цикле на каждый запрос.
+    """
+    if async_views:
+        login_view = AsyncLoginView
+        profile_view = AsyncUserProfileView
+        activate_invite_view = AsyncActivateInviteCodeView
+    else:
+        login_view = LoginView
+        profile_view = UserProfileAPIView
+        activate_invite_view = ActivateInviteCodeAPIView
+
+    return [
+        path("", index, name="index"),
+        path("login/", login_view.as_view(), name="login"),
+        path("profile-page/", profile, name="profile_page"),
+        path("logout/", LogoutView.as_view(), name="logout"),
+        path("api/profile/", profile_view.as_view(), name="api_profile"),
+        path("api/profile/invitees/", InviteesAPIView.as_view(),
+             name="api_profile_invitees"),
+        path("api/otp/request/", OTPRequestAPIView.as_view(),
+             name="api_otp_request"),
+        path("api/otp/verify/", OTPVerifyAPIView.as_view(),
+             name="api_otp_verify"),
+        path(
+            "api/activate-invite/",
+            activate_invite_view.as_view(),
+            name="api_activate_invite",
+        ),
+        path("api/token/", TokenObtainPairView.as_view(),
+             name="token_obtain_pair"),
+        path("api/token/refresh/",
+             TokenRefreshView.as_view(),
+             name="token_refresh"),
+        path("send-sms/", SendSMSView.as_view(), name="send_sms"),
+        path("api/broadcast/", BroadcastAPIView.as_view(),
+             name="api_broadcast"),
+        path(
+            "api/broadcast/<int:pk>/",
+            BroadcastDetailAPIView.as_view(),
+            name="api_broadcast_detail",
+        ),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.ASYNC_VIEWS)
+# Async-варианты — обычные View, их не видит генератор схемы OpenAPI,
+# поэтому схема строится по представлениям DRF (см. schema_urls.py)
+schema_urlpatterns = build_urlpatterns(async_views=False)
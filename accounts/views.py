@@ -1,30 +1,87 @@
+import json
 import logging
 import random
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth import get_user_model, login, logout
-from django.core.cache import cache
+from django.contrib.auth import alogin, get_user_model, login, logout
 from django.shortcuts import redirect, render
 from django.views import View
-from django.http import HttpResponseNotAllowed
+from django.http import (
+    HttpResponse,
+    HttpResponseNotAllowed,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.utils.http import parse_etags
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.generics import RetrieveAPIView
+from rest_framework.permissions import (
+    AllowAny,
+    IsAdminUser,
+    IsAuthenticated,
+)
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from phonenumbers import (
-    parse,
-    is_valid_number,
-    PhoneNumberFormat,
-    format_number,
-    NumberParseException,
-)
 
-from .utils import send_sms
+from .authentication import ClaimsRefreshToken, StatelessJWTAuthentication
+from .invite_filter import invite_filter
+from .models import SMSCampaign
+from .otp import otp_store
+from .phones import InvalidPhoneNumber, normalize_phone
+from .profile_cache import (
+    aget_profile_json,
+    get_profile_json,
+    invitees_next_url,
+)
+from .ratelimit import (
+    RateLimitExceeded,
+    acheck_otp_ip_limit,
+    acheck_otp_rate_limit,
+    check_otp_ip_limit,
+    check_otp_rate_limit,
+)
+from .serializers import (
+    PhoneNumberSerializer,
+    SMSCampaignSerializer,
+    VerificationCodeSerializer,
+)
+from .signals import invalidate_on_commit
+from .tasks import (
+    aenqueue_otp_sms,
+    enqueue_otp_sms,
+    queue_sms,
+    run_broadcast,
+)
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
+def send_verification_code(phone_number_int):
+    """
+    Выдача нового кода подтверждения и постановка SMS в очередь.
+
+    :param phone_number_int: Номер телефона в формате E.164 без знака '+'.
+    :return: ``False``, если номер заблокирован после неверных попыток.
+    """
+    verification_code = str(random.randint(1000, 9999))
+    if not otp_store.issue(phone_number_int, verification_code):
+        return False
+
+    # SMS отправляет воркер Celery, ответ не ждёт шлюз
+    enqueue_otp_sms(phone_number_int, verification_code)
+    logger.debug(
+        f"Отправка SMS с кодом {verification_code} на номер "
+        f"{phone_number_int} поставлена в очередь"
+    )
+    return True
+
+
 def index(request):
     return render(request, "accounts/index.html")
 
@@ -36,89 +93,205 @@ def profile(request):
 
 
 class LoginView(View):
+    """
+    Вход по SMS-коду для браузера.
+
+    Ответы собраны в отдельные методы, которые использует и
+    :class:`AsyncLoginView`.
+    """
 
     def get(self, request):
         # Сбрасываем состояние для нового запроса
-        return render(request, "accounts/login.html", {"code_sent": False})
+        return self.page(request, code_sent=False)
 
     def post(self, request):
         if "phone_number" in request.POST:
             # Обработка запроса на отправку SMS
             phone_number = request.POST.get("phone_number")
             try:
-                # Проверка и форматирование номера телефона
-                parsed_number = parse(phone_number, None)
-                if not is_valid_number(parsed_number):
-                    raise ValueError("Некорректный номер телефона")
-
-                phone_number_int = int(
-                    format_number(parsed_number, PhoneNumberFormat.E164)
-                    .replace("+", "")
-                )
-                verification_code = str(random.randint(1000, 9999))
-                cache_key = f"sms_code_{phone_number_int}"
-                cache.set(cache_key, verification_code, timeout=300)
-
-                send_sms(
-                    phone=phone_number_int,
-                    message=(
-                        f"Ваш код подтверждения: {verification_code}"
-                    ),
-                )
-                logger.debug(
-                    f"Отправка SMS с кодом {verification_code} на номер "
-                    f"{phone_number_int}"
-                )
+                # Лимит на IP проверяем до разбора номера, лимиты на номер
+                # — по нормализованному номеру: разные записи одного
+                # номера расходуют один лимит
+                check_otp_ip_limit(request.META.get("REMOTE_ADDR"))
+                phone_number_int = int(normalize_phone(phone_number)[1:])
+                check_otp_rate_limit(phone_number_int)
+                if not send_verification_code(phone_number_int):
+                    return self.phone_locked(request)
 
                 request.session["phone_number"] = phone_number_int
-                messages.success(
-                    request, "Код подтверждения отправлен на ваш телефон."
-                )
-                return render(request, "accounts/login.html",
-                              {"code_sent": True})
-
-            except NumberParseException:
-                messages.error(request, "Введите корректный номер телефона.")
-                return render(request, "accounts/login.html",
-                              {"code_sent": False})
+                return self.code_sent(request)
             except Exception as e:
-                logger.error(f"Непредвиденная ошибка: {e}")
-                messages.error(
-                    request,
-                    "Произошла ошибка при отправке SMS. Пожалуйста, "
-                    "попробуйте позже.",
-                )
-                return render(request, "accounts/login.html",
-                              {"code_sent": False})
+                return self.code_request_failed(request, phone_number, e)
 
         elif "code" in request.POST:
             # Обработка кода подтверждения
             code = request.POST.get("code")
             phone_number = request.session.get("phone_number")
-            cache_key = f"sms_code_{phone_number}"
-            expected_code = cache.get(cache_key)
-
-            # Логирование введенного и ожидаемого кода
-            logger.debug(
-                f"Введенный код: {code}, Ожидаемый код: {expected_code} "
-                f"для номера: {phone_number}"
-            )
-
-            if expected_code == code:
-                try:
-                    user = User.objects.get(phone_number=phone_number)
-                    login(request, user)
-                    cache.delete(cache_key)
-                    messages.success(request, "Вы успешно вошли.")
-                    return redirect("profile_page")
-                except User.DoesNotExist:
-                    messages.error(request, "Пользователь не найден.")
-                    return render(request, "accounts/login.html",
-                                  {"code_sent": True})
-            else:
-                messages.error(request, "Неверный код подтверждения.")
-                return render(request, "accounts/login.html",
-                              {"code_sent": True})
+            # Проверка и погашение кода за один запрос к Redis
+            result = otp_store.verify(phone_number, code)
+            self.log_verification(code, result, phone_number)
+
+            if result != otp_store.VERIFIED:
+                return self.verification_failed(request, result)
+            try:
+                user = User.objects.get(phone_number=f"+{phone_number}")
+            except User.DoesNotExist:
+                return self.user_not_found(request)
+            login(request, user)
+            return self.logged_in(request)
+
+    def page(self, request, code_sent, status=status.HTTP_200_OK):
+        return render(request, "accounts/login.html",
+                      {"code_sent": code_sent}, status=status)
+
+    def code_sent(self, request):
+        messages.success(
+            request, "Код подтверждения отправлен на ваш телефон."
+        )
+        return self.page(request, code_sent=True)
+
+    def phone_locked(self, request):
+        messages.error(
+            request,
+            "Слишком много неверных попыток. Повторите позже.",
+        )
+        return self.page(request, code_sent=False,
+                         status=status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def code_request_failed(self, request, phone_number, error):
+        if isinstance(error, RateLimitExceeded):
+            logger.warning(
+                f"Отклонён запрос кода для {phone_number}: {error}"
+            )
+            messages.error(
+                request,
+                "Слишком много запросов кода. Повторите через "
+                f"{error.retry_after} с.",
+            )
+            return self.page(request, code_sent=False,
+                             status=status.HTTP_429_TOO_MANY_REQUESTS)
+        if isinstance(error, InvalidPhoneNumber):
+            messages.error(request, "Введите корректный номер телефона.")
+            return self.page(request, code_sent=False)
+        logger.error(f"Непредвиденная ошибка: {error}")
+        messages.error(
+            request,
+            "Произошла ошибка при отправке SMS. Пожалуйста, "
+            "попробуйте позже.",
+        )
+        return self.page(request, code_sent=False)
+
+    def log_verification(self, code, result, phone_number):
+        logger.debug(
+            f"Введенный код: {code}, результат проверки: {result} "
+            f"для номера: {phone_number}"
+        )
+
+    def verification_failed(self, request, result):
+        if result == otp_store.LOCKED:
+            messages.error(
+                request,
+                "Слишком много неверных попыток. Повторите позже.",
+            )
+            return self.page(request, code_sent=False)
+        if result == otp_store.EXPIRED:
+            messages.error(
+                request, "Срок действия кода истёк. Запросите новый код."
+            )
+            return self.page(request, code_sent=False)
+        messages.error(request, "Неверный код подтверждения.")
+        return self.page(request, code_sent=True)
+
+    def user_not_found(self, request):
+        messages.error(request, "Пользователь не найден.")
+        return self.page(request, code_sent=True)
+
+    def logged_in(self, request):
+        messages.success(request, "Вы успешно вошли.")
+        return redirect("profile_page")
+
+
+class OTPRequestAPIView(APIView):
+    """Запрос кода подтверждения для входа по номеру телефона."""
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        try:
+            check_otp_ip_limit(request.META.get("REMOTE_ADDR"))
+            serializer = PhoneNumberSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            phone_number = int(serializer.validated_data["phone_number"][1:])
+            check_otp_rate_limit(phone_number)
+        except RateLimitExceeded as e:
+            return Response(
+                {"detail": "Слишком много запросов кода."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+
+        if not send_verification_code(phone_number):
+            return Response(
+                {"detail": "Слишком много неверных попыток. "
+                           "Повторите позже."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+        return Response(
+            {"detail": "Код подтверждения отправлен на ваш телефон."},
+            status=status.HTTP_200_OK,
+        )
+
+
+class OTPVerifyAPIView(APIView):
+    """
+    Проверка кода подтверждения и выдача пары JWT-токенов.
+
+    Представление не использует сессии Django, поэтому вход через API
+    не создаёт записей в таблице сессий.
+    """
+
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        serializer = VerificationCodeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phone_number = serializer.validated_data["phone_number"]
+        result = otp_store.verify(int(phone_number[1:]),
+                                  serializer.validated_data["code"])
+
+        if result == otp_store.LOCKED:
+            return Response(
+                {"detail": "Слишком много неверных попыток. "
+                           "Повторите позже."},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+        if result == otp_store.EXPIRED:
+            return Response(
+                {"detail": "Срок действия кода истёк. Запросите новый код."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if result != otp_store.VERIFIED:
+            return Response(
+                {"detail": "Неверный код подтверждения."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            user = User.objects.get(phone_number=phone_number,
+                                    is_active=True)
+        except User.DoesNotExist:
+            return Response(
+                {"detail": "Пользователь не найден."},
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        refresh = ClaimsRefreshToken.for_user(user)
+        return Response(
+            {"refresh": str(refresh), "access": str(refresh.access_token)},
+            status=status.HTTP_200_OK,
+        )
 
 
 class LogoutView(View):
@@ -132,56 +305,152 @@ class LogoutView(View):
 
 
 class UserProfileAPIView(APIView):
+    """
+    Профиль текущего пользователя.
+
+    Ответ берётся из кэша готовым JSON и поддерживает условный GET: при
+    совпадении ``If-None-Match`` возвращается 304 без тела.
+    """
+
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        data = {
-            "phone_number": user.phone_number,
-            "invite_code": user.invite_code,
-            "invited_by": (
-                user.invited_by.phone_number if user.invited_by else None
-            ),
-            "invited_users": user.invitees.values_list("phone_number", flat=True),
-        }
-        return Response(data, status=status.HTTP_200_OK)
+        return profile_response(request, *get_profile_json(request.user))
 
 
-class ActivateInviteCodeAPIView(APIView):
+def profile_response(request, etag, body):
+    """Ответ с профилем или 304, если у клиента та же версия."""
+    if_none_match = parse_etags(request.headers.get("If-None-Match", ""))
+    if etag in if_none_match or "*" in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    return response
+
+
+class InviteesAPIView(APIView):
+    """
+    Список приглашённых текущего пользователя.
+
+    Пагинация по ключу: ``?after=<курсор>&limit=<n>``. С параметром
+    ``?export=ndjson`` весь список отдаётся потоком, по одному JSON-объекту
+    на строку, без сборки ответа в памяти.
+    """
+
     permission_classes = [IsAuthenticated]
 
-    def post(self, request):
-        invite_code = request.data.get("invite_code")
-        user = request.user
+    def get(self, request):
+        if request.query_params.get("export") == "ndjson":
+            return self.export(request.user)
 
-        if not invite_code:
+        limit = request.query_params.get("limit")
+        try:
+            after = int(request.query_params.get("after", 0))
+            limit = None if limit is None else int(limit)
+        except ValueError:
+            after = -1
+        if after < 0 or (limit is not None and limit < 1):
             return Response(
-                {"detail": "Инвайт-код не предоставлен."},
+                {"detail": "Параметр after должен быть неотрицательным "
+                           "числом, limit — положительным."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        results, next_cursor = User.objects.invitees_page(
+            request.user, after=after, limit=limit
+        )
+        return Response(
+            {
+                "results": results,
+                "next": invitees_next_url(next_cursor, limit),
+            },
+            status=status.HTTP_200_OK,
+        )
 
-        try:
-            inviter = User.objects.get(invite_code=invite_code)
-        except User.DoesNotExist:
-            return Response(
-                {"detail": "Инвайт-код не найден."},
-                status=status.HTTP_404_NOT_FOUND,
+    def export(self, user):
+        phones = (
+            User.objects.filter(invited_by_id=user.pk)
+            .order_by("pk")
+            .values_list("phone_number", flat=True)
+        )
+        # Сервер ASGI читает синхронный итератор целиком в память, а WSGI —
+        # асинхронный, поэтому тип итератора выбирается по серверу
+        if settings.ASYNC_VIEWS:
+            lines = self.aexport_lines(phones)
+        else:
+            lines = (
+                self.export_line(phone)
+                for phone in phones.iterator(chunk_size=2000)
             )
+        return StreamingHttpResponse(lines,
+                                     content_type="application/x-ndjson")
+
+    @classmethod
+    async def aexport_lines(cls, phones):
+        async for phone in phones.aiterator(chunk_size=2000):
+            yield cls.export_line(phone)
+
+    @staticmethod
+    def export_line(phone):
+        return json.dumps({"phone_number": phone}) + "\n"
+
+
+ACTIVATION_ERRORS = {
+    User.objects.CODE_NOT_FOUND: (
+        "Инвайт-код не найден.", status.HTTP_404_NOT_FOUND
+    ),
+    User.objects.ALREADY_ACTIVATED: (
+        "Вы уже активировали инвайт-код.", status.HTTP_400_BAD_REQUEST
+    ),
+    User.objects.OWN_CODE: (
+        "Нельзя использовать свой собственный инвайт-код.",
+        status.HTTP_400_BAD_REQUEST,
+    ),
+    User.objects.CYCLE: (
+        "Нельзя активировать код пользователя, которого пригласили вы.",
+        status.HTTP_400_BAD_REQUEST,
+    ),
+}
+
+
+def activate_invite(user, invite_code):
+    """
+    Активация инвайт-кода со сбросом кэша профилей по цепочке.
+
+    :return: Результат :meth:`UserManager.activate_invite`.
+    """
+    outcome, chain = User.objects.activate_invite(user, invite_code)
+    if outcome == User.objects.ACTIVATED:
+        # UPDATE без сигналов модели; цепочку пригласивших уже прочитало
+        # обновление статистики
+        invalidate_on_commit([user.pk] + chain)
+    return outcome
 
-        if user.invited_by:
-            return Response(
-                {"detail": "Вы уже активировали инвайт-код."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
 
-        if inviter == user:
+class ActivateInviteCodeAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        invite_code = request.data.get("invite_code")
+        user = request.user
+
+        if not invite_code:
             return Response(
-                {"detail": "Нельзя использовать свой собственный инвайт-код."},
+                {"detail": "Инвайт-код не предоставлен."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        user.invited_by = inviter
-        user.save()
+        invite_code = str(invite_code)
+        # Несуществующий код отсекается фильтром Блума без запроса к БД
+        if not invite_filter.might_exist(invite_code):
+            outcome = User.objects.CODE_NOT_FOUND
+        else:
+            outcome = activate_invite(user, invite_code)
+            if outcome == User.objects.CODE_NOT_FOUND:
+                invite_filter.record_miss(invite_code)
+        if outcome != User.objects.ACTIVATED:
+            detail, code = ACTIVATION_ERRORS[outcome]
+            return Response({"detail": detail}, status=code)
 
         return Response(
             {"detail": "Инвайт-код успешно активирован."},
@@ -198,19 +467,183 @@ class SendSMSView(View):
         phone = request.POST.get("phone")
         message = request.POST.get("message")
 
+        if "broadcast" in request.POST:
+            # Рассылка всем пользователям доступна только персоналу
+            if not request.user.is_staff:
+                messages.error(request, "Недостаточно прав для рассылки.")
+                return redirect("send_sms")
+            campaign = SMSCampaign.objects.create(message=message)
+            run_broadcast.delay(campaign.pk)
+            messages.success(
+                request, f"Рассылка #{campaign.pk} поставлена в очередь."
+            )
+            return redirect("send_sms")
+
         if not phone.startswith("+") or not phone[1:].isdigit():
             messages.error(request, "Неверный формат номера телефона.")
             return redirect("send_sms")
 
-        response = send_sms(phone=phone, message=message)
+        # Отправляется пакетом вместе с другими SMS за SMS_BATCH_WINDOW,
+        # без ожидания шлюза в запросе
+        queue_sms(phone, message)
+        messages.success(request, "SMS поставлено в очередь на отправку.")
+        return redirect("send_sms")
+
+
+class BroadcastAPIView(APIView):
+    permission_classes = [IsAdminUser]
 
-        if response and response.get("status") == "success":
-            messages.success(request, "SMS успешно отправлено!")
+    def post(self, request):
+        serializer = SMSCampaignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        campaign = serializer.save()
+        run_broadcast.delay(campaign.pk)
+        return Response(
+            SMSCampaignSerializer(campaign).data,
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class BroadcastDetailAPIView(RetrieveAPIView):
+    permission_classes = [IsAdminUser]
+    queryset = SMSCampaign.objects.all()
+    serializer_class = SMSCampaignSerializer
+
+
+# Асинхронные варианты нагруженных представлений. Подключаются в urls.py
+# при WEB_SERVER=asgi: пока запрос ждёт Redis или PostgreSQL, воркер
+# uvicorn обслуживает другие запросы, а не держит поток на каждый из них.
+
+
+async def asend_verification_code(phone_number_int):
+    """Асинхронный вариант :func:`send_verification_code`."""
+    verification_code = str(random.randint(1000, 9999))
+    if not await otp_store.aissue(phone_number_int, verification_code):
+        return False
+
+    await aenqueue_otp_sms(phone_number_int, verification_code)
+    logger.debug(
+        f"Отправка SMS с кодом {verification_code} на номер "
+        f"{phone_number_int} поставлена в очередь"
+    )
+    return True
+
+
+class AsyncLoginView(LoginView):
+
+    async def get(self, request):
+        return super().get(request)
+
+    async def post(self, request):
+        if "phone_number" in request.POST:
+            phone_number = request.POST.get("phone_number")
+            try:
+                await acheck_otp_ip_limit(request.META.get("REMOTE_ADDR"))
+                phone_number_int = int(normalize_phone(phone_number)[1:])
+                await acheck_otp_rate_limit(phone_number_int)
+                if not await asend_verification_code(phone_number_int):
+                    return self.phone_locked(request)
+
+                await request.session.aset("phone_number", phone_number_int)
+                return self.code_sent(request)
+            except Exception as e:
+                return self.code_request_failed(request, phone_number, e)
+
+        elif "code" in request.POST:
+            code = request.POST.get("code")
+            phone_number = await request.session.aget("phone_number")
+            result = await otp_store.averify(phone_number, code)
+            self.log_verification(code, result, phone_number)
+
+            if result != otp_store.VERIFIED:
+                return self.verification_failed(request, result)
+            try:
+                user = await User.objects.aget(
+                    phone_number=f"+{phone_number}"
+                )
+            except User.DoesNotExist:
+                return self.user_not_found(request)
+            await alogin(request, user)
+            return self.logged_in(request)
+
+
+class AsyncAPIView(View):
+    """
+    База async-представлений API с аутентификацией по JWT.
+
+    Как и у APIView, ошибки возвращаются в виде ``{"detail": ...}``, а
+    CSRF-проверка отключена: API не использует сессионные cookie.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        user = await self.authenticate(request)
+        if user is None:
+            response = JsonResponse(
+                {"detail": "Учетные данные не были предоставлены."},
+                status=status.HTTP_401_UNAUTHORIZED,
+            )
+            response["WWW-Authenticate"] = 'Bearer realm="api"'
+            return response
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+    async def authenticate(self, request):
+        authentication = StatelessJWTAuthentication()
+        header = authentication.get_header(request)
+        raw_token = header and authentication.get_raw_token(header)
+        if not raw_token:
+            return None
+        try:
+            token = authentication.get_validated_token(raw_token)
+            return await authentication.aget_user(token)
+        except AuthenticationFailed:
+            return None
+
+    def request_data(self, request):
+        if request.content_type == "application/json":
+            try:
+                return json.loads(request.body or b"{}")
+            except ValueError:
+                return {}
+        return request.POST
+
+
+class AsyncUserProfileView(AsyncAPIView):
+    """Асинхронный вариант :class:`UserProfileAPIView`."""
+
+    async def get(self, request):
+        return profile_response(
+            request, *await aget_profile_json(request.user)
+        )
+
+
+class AsyncActivateInviteCodeView(AsyncAPIView):
+    """Асинхронный вариант :class:`ActivateInviteCodeAPIView`."""
+
+    async def post(self, request):
+        invite_code = self.request_data(request).get("invite_code")
+        if not invite_code:
+            return JsonResponse(
+                {"detail": "Инвайт-код не предоставлен."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        invite_code = str(invite_code)
+        if not await invite_filter.amight_exist(invite_code):
+            outcome = User.objects.CODE_NOT_FOUND
         else:
-            error_message = response.get("error", "Неизвестная ошибка")
-            messages.error(
-                request,
-                f"Ошибка при отправке SMS: {error_message}"
+            # Транзакция с повторами целиком выполняется в одном потоке
+            outcome = await sync_to_async(activate_invite)(
+                request.user, invite_code
             )
+            if outcome == User.objects.CODE_NOT_FOUND:
+                await invite_filter.arecord_miss(invite_code)
+        if outcome != User.objects.ACTIVATED:
+            detail, code = ACTIVATION_ERRORS[outcome]
+            return JsonResponse({"detail": detail}, status=code)
 
-        return redirect("send_sms")
+        return JsonResponse({"detail": "Инвайт-код успешно активирован."})
@@ -0,0 +1,188 @@
+"""
+Нагрузочное сравнение WSGI и ASGI на одном воркере gunicorn.
+
+Запускает gunicorn с WEB_SERVER=wsgi (gthread, --threads потоков) и с
+WEB_SERVER=asgi (воркер uvicorn с async-представлениями) и при разном
+числе одновременных клиентов запрашивает профиль по JWT. Между
+приложением и Redis можно вставить задержку (--redis-latency-ms), как у
+Redis в соседней зоне доступности. Нужны доступные PostgreSQL и Redis
+(DB_*, REDIS_HOST, REDIS_PORT)::
+
+    python -m benchmarks.asgi_views --concurrency 1,8,32,128 \\
+        --requests 2000 --threads 4 --redis-latency-ms 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from rest_framework_simplejwt.tokens import AccessToken  # noqa: E402
+
+PHONE = "+79990000002"
+
+
+async def redis_proxy(port, latency):
+    """TCP-прокси к Redis с задержкой каждого запроса приложения."""
+    async def pipe(reader, writer, delay):
+        try:
+            while data := await reader.read(65536):
+                if delay:
+                    await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(
+            os.getenv("REDIS_HOST", "redis"),
+            int(os.getenv("REDIS_PORT", 6379)),
+        )
+        await asyncio.gather(
+            pipe(client_reader, server_writer, latency),
+            pipe(server_reader, client_writer, 0),
+        )
+
+    return await asyncio.start_server(handle, "127.0.0.1", port)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"gunicorn не запустился на порту {port}")
+
+
+async def get(port, request):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(request)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status = int(response.split(b" ", 2)[1])
+    assert status == 200, response[:200]
+
+
+async def load(port, token, concurrency, requests):
+    request = (
+        "GET /accounts/api/profile/ HTTP/1.1\r\n"
+        "Host: localhost\r\n"
+        f"Authorization: Bearer {token}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode()
+    latencies = []
+
+    async def client(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            await get(port, request)
+            latencies.append(time.perf_counter() - started)
+
+    per_client = max(1, requests // concurrency)
+    started = time.perf_counter()
+    await asyncio.gather(*[client(per_client) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(
+            latencies[int(len(latencies) * 0.99) - 1] * 1000, 2
+        ),
+    }
+
+
+async def run_server(server, args, token, redis_port):
+    port = free_port()
+    env = {
+        **os.environ,
+        "WEB_SERVER": server,
+        "WEB_CONCURRENCY": "1",
+        "GUNICORN_THREADS": str(args.threads),
+        "GUNICORN_BIND": f"127.0.0.1:{port}",
+        "ALLOWED_HOSTS": "localhost",
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(redis_port),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        await wait_for_port(port)
+        # Прогрев: профиль попадает в кэш, открываются соединения
+        await load(port, token, 4, 100)
+        return [await load(port, token, concurrency, args.requests)
+                for concurrency in args.concurrency]
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def run(args, token):
+    redis_port = free_port()
+    proxy = await redis_proxy(redis_port, args.redis_latency_ms / 1000)
+    try:
+        return {
+            server: await run_server(server, args, token, redis_port)
+            for server in ("wsgi", "asgi")
+        }
+    finally:
+        proxy.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--concurrency", default="1,8,32,128",
+                        help="Числа одновременных клиентов через запятую.")
+    parser.add_argument("--requests", type=int, default=2000,
+                        help="Запросов на каждый уровень нагрузки.")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="Потоки воркера gthread для WSGI.")
+    parser.add_argument("--redis-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    User = get_user_model()
+    user = (User.objects.filter(phone_number=PHONE).first()
+            or User.objects.create_user(PHONE))
+    try:
+        results = asyncio.run(run(args, str(AccessToken.for_user(user))))
+    finally:
+        user.delete()
+    print(json.dumps({
+        "benchmark": "asgi_views",
+        "threads": args.threads,
+        "redis_latency_ms": args.redis_latency_ms,
+        "results": results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
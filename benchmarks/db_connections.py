@@ -0,0 +1,118 @@
+"""
+Бенчмарк режимов соединения с PostgreSQL.
+
+Для каждого значения DB_CONN_MODE (см. settings.py) запускает отдельный
+процесс, который, как воркер gthread, из нескольких потоков запрашивает
+профиль через тестовый клиент Django. После каждого запроса соединения
+закрываются или возвращаются в пул так же, как под gunicorn::
+
+    python -m benchmarks.db_connections --requests 2000 --threads 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PHONE = "+79990000001"
+
+
+def sessions(connection):
+    # pg_stat_database.sessions есть начиная с PostgreSQL 14. Статистику
+    # завершившиеся процессы сбрасывают с задержкой
+    time.sleep(1)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_stat_clear_snapshot()")
+        cursor.execute(
+            "SELECT sessions FROM pg_stat_database "
+            "WHERE datname = current_database()"
+        )
+        return cursor.fetchone()[0]
+
+
+def run_worker(requests, threads):
+    import django
+
+    django.setup()
+    from django.contrib.auth import get_user_model
+    from django.db import close_old_connections, connection, connections
+    from django.test import Client
+    from django.test.utils import setup_test_environment
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    setup_test_environment()
+    User = get_user_model()
+    user = (User.objects.filter(phone_number=PHONE).first()
+            or User.objects.create_user(PHONE))
+    token = str(AccessToken.for_user(user))
+
+    def work(count):
+        client = Client(HTTP_AUTHORIZATION=f"Bearer {token}")
+        for _ in range(count):
+            response = client.get("/accounts/api/profile/")
+            assert response.status_code == 200, response.status_code
+            # Тестовый клиент отключает этот обработчик request_finished,
+            # вызываем его сами, как это делает WSGIHandler
+            close_old_connections()
+        connections.close_all()
+
+    before = sessions(connection)
+    connections.close_all()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(work, [requests // threads] * threads))
+    elapsed = time.perf_counter() - started
+    opened = sessions(connection) - before
+
+    user.delete()
+    total = requests // threads * threads
+    return {
+        "mode": os.environ["DB_CONN_MODE"],
+        "seconds": round(elapsed, 3),
+        "requests": total,
+        "requests_per_second": round(total / elapsed, 1),
+        "db_sessions_opened": opened,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--modes", default="none,persistent,pool",
+                        help="Режимы через запятую; pgbouncer требует "
+                             "запущенного PgBouncer.")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.requests, args.threads)))
+        return
+
+    results = []
+    for mode in args.modes.split(","):
+        env = {
+            **os.environ,
+            "DB_CONN_MODE": mode,
+            "WEB_CONCURRENCY": "1",
+            "GUNICORN_THREADS": str(args.threads),
+        }
+        env.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.db_connections", "--worker",
+             "--requests", str(args.requests),
+             "--threads", str(args.threads)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    print(json.dumps({"benchmark": "db_connections",
+                      "threads": args.threads, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Нагрузочный бенчмарк входа, профиля и активации инвайт-кода без сети.
+
+Создаёт отдельную БД (см. ``benchmarks/settings.py``) с деревьями
+приглашений из ``--users`` пользователей глубиной ``--depth``, поднимает
+заглушку SMSAero и воркер Celery в потоке и через тестовый клиент Django
+прогоняет сценарии из пула потоков для каждого значения ``--concurrency``:
+
+* ``login`` — запрос кода и ввод кода в шаблонном ``LoginView``;
+* ``profile`` — ``UserProfileAPIView`` с access-токеном;
+* ``activate`` — ``ActivateInviteCodeAPIView`` новым пользователем с кодом
+  случайного пользователя из дерева.
+
+Для каждого представления выводит JSON: запросы в секунду, задержки
+p50/p95/p99, запросы к БД, команды Redis и исходящие HTTP-запросы на
+запрос (``referral_project.profiling``). С ``--baseline``
+сравнивает результат с прошлым прогоном и завершается с кодом 1 при
+регрессии::
+
+    python -m benchmarks.endpoints --users 10000 --depth 10 \\
+        --concurrency 1,8 --output bench.json
+    python -m benchmarks.endpoints --baseline bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Один процесс с потоками, как воркер gthread: пул соединений с БД на
+# все потоки бенчмарка
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.settings")
+os.environ.setdefault("WEB_CONCURRENCY", "1")
+os.environ.setdefault("GUNICORN_THREADS", "64")
+
+import django  # noqa: E402
+
+django.setup()
+
+from celery.contrib.testing.worker import start_worker  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, connections  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils import timezone  # noqa: E402
+from django_redis import get_redis_connection  # noqa: E402
+
+from accounts.authentication import ClaimsRefreshToken  # noqa: E402
+from accounts.otp import otp_store  # noqa: E402
+from benchmarks.stub_smsaero import StubSMSAeroServer  # noqa: E402
+from referral_project.celery import app as celery_app  # noqa: E402
+from referral_project.profiling import capture_profiles  # noqa: E402
+
+User = get_user_model()
+# Номера дерева приглашений и новых пользователей для активации
+TREE_PREFIX = "+7999"
+FRESH_PREFIX = "+7998"
+LOGIN_URL = "/accounts/login/"
+PROFILE_URL = "/accounts/api/profile/"
+ACTIVATE_URL = "/accounts/api/activate-invite/"
+# Запросы к БД и команды Redis растут на доли, задержки шумят сильнее
+COUNT_TOLERANCE = 0.05
+
+
+class Recorder:
+    """Задержки и счётчики запросов по представлениям."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def measure(self, endpoint, call, expected_status):
+        with capture_profiles() as profiles:
+            started = time.perf_counter()
+            response = call()
+            elapsed = time.perf_counter() - started
+        [profile] = profiles
+        sample = (
+            elapsed,
+            profile.queries,
+            profile.redis,
+            profile.http,
+            response.status_code != expected_status,
+        )
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(sample)
+        return response
+
+    def summary(self, concurrency, seconds):
+        results = []
+        for endpoint, samples in self.samples.items():
+            latencies = sorted(sample[0] * 1000 for sample in samples)
+            count = len(samples)
+            results.append({
+                "endpoint": endpoint,
+                "concurrency": concurrency,
+                "requests": count,
+                "errors": sum(sample[4] for sample in samples),
+                "rps": round(count / seconds, 1),
+                "latency_ms": {
+                    "mean": round(statistics.fmean(latencies), 3),
+                    **percentiles(latencies),
+                    "max": round(latencies[-1], 3),
+                },
+                "queries_per_request": round(
+                    sum(sample[1] for sample in samples) / count, 2
+                ),
+                "cache_calls_per_request": round(
+                    sum(sample[2] for sample in samples) / count, 2
+                ),
+                "http_calls_per_request": round(
+                    sum(sample[3] for sample in samples) / count, 2
+                ),
+            })
+        return results
+
+
+def percentiles(latencies):
+    if len(latencies) < 2:
+        value = round(latencies[0], 3)
+        return {"p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {name: round(cuts[i - 1], 3)
+            for name, i in (("p50", 50), ("p95", 95), ("p99", 99))}
+
+
+def seed(users, depth, rng):
+    """
+    Деревья приглашений: пользователи уровня k приглашены случайными
+    пользователями уровня k - 1, корни — пользователи уровня 0.
+
+    :return: Список id пользователей дерева.
+    """
+    per_level = max(1, users // (depth + 1))
+    now = timezone.now()
+    levels = []
+    number = 0
+    for _ in range(depth + 1):
+        batch = []
+        for _ in range(per_level):
+            inviter = rng.choice(levels[-1]) if levels else None
+            batch.append(User(
+                phone_number=f"{TREE_PREFIX}{number:07d}",
+                password="!",
+                invite_code=User.objects.generate_invite_code(),
+                invited_by_id=inviter,
+                invited_at=now if inviter else None,
+            ))
+            number += 1
+        created = User.objects.bulk_create(batch, batch_size=1000)
+        levels.append([user.pk for user in created])
+    call_command("rebuild_referral_stats", stdout=io.StringIO())
+    call_command("rebuild_invite_filter", stdout=io.StringIO())
+    return [pk for level in levels for pk in level]
+
+
+def access_token(user):
+    return str(ClaimsRefreshToken.for_user(user).access_token)
+
+
+class LoginScenario:
+    """Запрос кода и вход по коду из Redis, новая сессия на каждый вход."""
+
+    name = "login"
+
+    def __init__(self, user_ids, rng):
+        self.phones = list(
+            User.objects.filter(pk__in=user_ids)
+            .values_list("phone_number", flat=True)
+        )
+        self.rng = rng
+        self.redis = get_redis_connection("default")
+        self.sms_expected = 0
+
+    def prepare(self, requests):
+        # Разные номера в одном прогоне, иначе потоки перезапишут коды
+        # друг друга
+        phones = self.rng.sample(self.phones,
+                                 min(requests, len(self.phones)))
+        self.sms_expected += requests
+        return [phones[i % len(phones)] for i in range(requests)]
+
+    def run(self, phone, recorder):
+        client = Client()
+        recorder.measure(
+            "login_request",
+            lambda: client.post(LOGIN_URL, {"phone_number": phone}),
+            200,
+        )
+        code = self.redis.hget(otp_store.key(int(phone[1:])), "code")
+        recorder.measure(
+            "login_verify",
+            lambda: client.post(LOGIN_URL, {"code": (code or b"").decode()}),
+            302,
+        )
+
+
+class ProfileScenario:
+    """Профиль случайного пользователя дерева."""
+
+    name = "profile"
+    sample_size = 1000
+
+    def __init__(self, user_ids, rng):
+        sample = rng.sample(user_ids, min(self.sample_size, len(user_ids)))
+        self.tokens = [access_token(user)
+                       for user in User.objects.filter(pk__in=sample)]
+        self.rng = rng
+
+    def prepare(self, requests):
+        return [self.rng.choice(self.tokens) for _ in range(requests)]
+
+    def run(self, token, recorder):
+        client = Client(headers={"Authorization": f"Bearer {token}"})
+        recorder.measure("profile", lambda: client.get(PROFILE_URL), 200)
+
+
+class ActivateScenario:
+    """Активация кода случайного пользователя дерева новым пользователем."""
+
+    name = "activate"
+
+    def __init__(self, user_ids, rng):
+        self.codes = list(
+            User.objects.filter(pk__in=user_ids)
+            .values_list("invite_code", flat=True)
+        )
+        self.rng = rng
+        self.created = 0
+
+    def prepare(self, requests):
+        calls = []
+        for _ in range(requests):
+            user = User.objects.create_user(
+                f"{FRESH_PREFIX}{self.created:07d}"
+            )
+            self.created += 1
+            calls.append((access_token(user), self.rng.choice(self.codes)))
+        return calls
+
+    def run(self, call, recorder):
+        token, code = call
+        client = Client(headers={"Authorization": f"Bearer {token}"})
+        recorder.measure(
+            "activate",
+            lambda: client.post(ACTIVATE_URL, {"invite_code": code}),
+            200,
+        )
+
+
+SCENARIOS = {
+    scenario.name: scenario
+    for scenario in (LoginScenario, ProfileScenario, ActivateScenario)
+}
+
+
+def wait_for_sms(stub, expected, timeout=30):
+    """Ожидание, пока воркер Celery отправит все коды в заглушку."""
+    deadline = time.monotonic() + timeout
+    while (stub.stats()["messages"] < expected
+           and time.monotonic() < deadline):
+        time.sleep(0.05)
+
+
+def run_scenario(scenario, requests, concurrency):
+    """
+    Прогон сценария из пула потоков.
+
+    :return: Список результатов по представлениям сценария.
+    """
+    calls = scenario.prepare(requests)
+    recorder = Recorder()
+    chunks = [calls[i::concurrency] for i in range(concurrency)]
+
+    def worker(chunk):
+        try:
+            for call in chunk:
+                scenario.run(call, recorder)
+        finally:
+            connections.close_all()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, chunks))
+    return recorder.summary(concurrency, time.perf_counter() - started)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Регрессии относительно прошлого прогона.
+
+    Задержка p95 и пропускная способность сравниваются с относительным
+    допуском ``tolerance``, число запросов к БД и команд Redis — почти
+    точно.
+
+    :return: Список описаний регрессий.
+    """
+    previous = {(row["endpoint"], row["concurrency"]): row
+                for row in baseline["results"]}
+    regressions = []
+    for row in results:
+        old = previous.get((row["endpoint"], row["concurrency"]))
+        if old is None:
+            continue
+        name = f"{row['endpoint']} x{row['concurrency']}"
+        p95, old_p95 = row["latency_ms"]["p95"], old["latency_ms"]["p95"]
+        if p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 {old_p95} -> {p95} мс")
+        if row["rps"] < old["rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: rps {old['rps']} -> {row['rps']}"
+            )
+        for field in ("queries_per_request", "cache_calls_per_request",
+                      "http_calls_per_request"):
+            if field not in old:
+                continue
+            if row[field] > old[field] + COUNT_TOLERANCE:
+                regressions.append(
+                    f"{name}: {field} {old[field]} -> {row[field]}"
+                )
+    return regressions
+
+
+def environment(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "redis": "redis" if settings.BENCH_REDIS_URL else "fakeredis",
+        "cpu_count": os.cpu_count(),
+        "users": args.users,
+        "depth": args.depth,
+        "seed": args.seed,
+        "requests": args.requests,
+        "sms_latency": args.sms_latency,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--depth", type=int, default=10,
+                        help="Глубина деревьев приглашений.")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="Итераций сценария на каждый уровень "
+                             "параллельности.")
+    parser.add_argument("--concurrency", default="1,8",
+                        help="Число потоков через запятую.")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="Итераций сценария до замера.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sms-latency", type=float, default=0.0,
+                        help="Задержка ответа заглушки SMSAero, секунды.")
+    parser.add_argument("--output", help="Файл для результата в JSON.")
+    parser.add_argument("--baseline",
+                        help="Результат прошлого прогона для сравнения.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Допустимое ухудшение задержки и rps.")
+    args = parser.parse_args()
+    levels = [int(value) for value in args.concurrency.split(",")]
+    rng = random.Random(args.seed)
+
+    creation = connection.creation
+    database_name = connection.settings_dict["NAME"]
+    creation.create_test_db(verbosity=0, autoclobber=True)
+    stub = StubSMSAeroServer(latency=args.sms_latency).start()
+    settings.SMSAERO_URL = stub.url
+    results = []
+    try:
+        user_ids = seed(args.users, args.depth, rng)
+        with start_worker(celery_app, pool="threads", concurrency=4,
+                          perform_ping_check=False,
+                          queues=["celery", "otp", "sms"]):
+            for name in args.scenarios.split(","):
+                scenario = SCENARIOS[name](user_ids, rng)
+                run_scenario(scenario, args.warmup, 1)
+                for concurrency in levels:
+                    results.extend(
+                        run_scenario(scenario, args.requests, concurrency)
+                    )
+                if isinstance(scenario, LoginScenario):
+                    wait_for_sms(stub, scenario.sms_expected)
+        sms = stub.stats()
+    finally:
+        stub.stop()
+        connections.close_all()
+        creation.destroy_test_db(database_name, verbosity=0)
+
+    report = {
+        "benchmark": "endpoints",
+        "environment": environment(args),
+        "sms_gateway": sms,
+        "results": results,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(results, json.load(f),
+                                            args.tolerance)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
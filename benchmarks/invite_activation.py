@@ -0,0 +1,94 @@
+"""
+Нагрузочный тест параллельной активации инвайт-кодов.
+
+Создаёт пользователей и активирует коды из пула потоков: каждый
+пользователь пытается активировать несколько случайных кодов, в том числе
+коды своих приглашённых. После прогона проверяется, что у каждого
+пользователя не больше одного пригласившего, счётчики совпадают с
+таблицей и в дереве нет циклов. Созданные пользователи удаляются::
+
+    python -m benchmarks.invite_activation --users 2000 --threads 16
+"""
+import argparse
+import json
+import os
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from accounts.models import ReferralStats  # noqa: E402
+
+User = get_user_model()
+PREFIX = "+3"
+
+
+def activate(args):
+    user, code = args
+    try:
+        return User.objects.activate_invite(user, code)[0]
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=3,
+                        help="Попыток активации на пользователя.")
+    parser.add_argument("--threads", type=int, default=16)
+    args = parser.parse_args()
+
+    User.objects.filter(phone_number__startswith=PREFIX).delete()
+    users = [User.objects.create_user(f"{PREFIX}{i:012d}")
+             for i in range(args.users)]
+    calls = [
+        (user, random.choice(users).invite_code)
+        for user in users for _ in range(args.attempts)
+    ]
+    random.shuffle(calls)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        outcomes = Counter(pool.map(activate, calls))
+    elapsed = time.perf_counter() - started
+
+    imported = User.objects.filter(phone_number__startswith=PREFIX)
+    invited = imported.filter(invited_by__isnull=False).count()
+    direct = sum(
+        ReferralStats.objects.filter(user__in=imported)
+        .values_list("direct_count", flat=True)
+    )
+    cycles = sum(
+        1 for user in imported.filter(invited_by__isnull=False)
+        if any(a.pk == user.pk for a in User.objects.ancestors(user))
+    )
+    imported.delete()
+
+    print(json.dumps({
+        "benchmark": "invite_activation",
+        "vendor": connection.vendor,
+        "users": args.users,
+        "threads": args.threads,
+        "attempts": len(calls),
+        "seconds": round(elapsed, 3),
+        "attempts_per_second": round(len(calls) / elapsed, 1),
+        "outcomes": dict(outcomes),
+        "invited_users": invited,
+        "activated_matches_invited": outcomes[User.objects.ACTIVATED]
+        == invited,
+        "direct_count_matches": direct == invited,
+        "cycles": cycles,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Бенчмарк создания пользователей при большом числе существующих кодов.
+
+Наполняет таблицу пользователей (по умолчанию 10 млн строк с кодами
+старого формата из 6 hex-символов), затем сравнивает скорость
+``create_user`` со старым генератором (uuid4, повтор при конфликте) и с
+блочным аллокатором. Все изменения откатываются в конце::
+
+    python -m benchmarks.invite_codes --existing 10000000 --users 2000
+"""
+import argparse
+import json
+import os
+import time
+import uuid
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
+django.setup()
+
+from django.contrib.auth import get_user_model  # noqa: E402
+from django.db import IntegrityError, connection, transaction  # noqa: E402
+
+from accounts.invite_codes import invite_code_allocator  # noqa: E402
+
+User = get_user_model()
+CHUNK = 50000
+
+
+def seed(existing):
+    """Пользователи с уникальными кодами старого формата."""
+    table = User._meta.db_table
+    started = time.perf_counter()
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table}
+                    (password, is_superuser, phone_number, invite_code,
+                     is_active, is_staff)
+                SELECT '!', false, '+1' || lpad(i::text, 12, '0'),
+                       upper(lpad(to_hex(i), 6, '0')), true, false
+                FROM generate_series(1, %s) AS i
+                """,
+                [existing],
+            )
+    else:
+        for start in range(1, existing + 1, CHUNK):
+            User.objects.bulk_create(
+                User(password="!", phone_number=f"+1{i:012d}",
+                     invite_code=f"{i:06X}")
+                for i in range(start, min(start + CHUNK, existing + 1))
+            )
+    return round(time.perf_counter() - started, 1)
+
+
+def legacy_code():
+    return uuid.uuid4().hex[:6].upper()
+
+
+def create_users(name, generate, users, offset):
+    collisions = 0
+    started = time.perf_counter()
+    for i in range(users):
+        while True:
+            try:
+                with transaction.atomic():
+                    User.objects.create_user(f"+2{offset + i:012d}",
+                                             invite_code=generate())
+                break
+            except IntegrityError:
+                collisions += 1
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "seconds": round(elapsed, 3),
+        "users_per_second": round(users / elapsed, 1),
+        "collisions": collisions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--existing", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    with transaction.atomic():
+        seed_seconds = seed(args.existing)
+        results = [
+            create_users("uuid4_hex6_retry", legacy_code, args.users, 0),
+            create_users("feistel_block_allocator",
+                         invite_code_allocator.next_code, args.users,
+                         args.users),
+        ]
+        transaction.set_rollback(True)
+
+    print(json.dumps({
+        "benchmark": "invite_codes",
+        "vendor": connection.vendor,
+        "existing_users": args.existing,
+        "seed_seconds": seed_seconds,
+        "users": args.users,
+        # Доля занятого пространства старых кодов: вероятность конфликта
+        # на одну попытку
+        "legacy_occupancy": round(args.existing / 16 ** 6, 3),
+        "results": results,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Записи в БД на один вход через шаблонный LoginView.
+
+Для каждого значения SESSION_BACKEND (см. settings.py) запускает отдельный
+процесс, который проходит полный вход через тестовый клиент Django:
+страница входа, запрос кода, ввод кода, страница профиля, выход. Считает
+INSERT/UPDATE/DELETE и все запросы к БД на один вход. SMS не
+отправляются: код перехватывается до постановки в очередь. Нужны
+доступные PostgreSQL и Redis::
+
+    python -m benchmarks.session_writes --logins 200
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from unittest.mock import patch
+
+PHONE_PREFIX = "+7999001"
+
+
+def run_worker(logins):
+    import django
+
+    django.setup()
+    from django.contrib.auth import get_user_model
+    from django.db import connection
+    from django.test import Client, override_settings
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    User = get_user_model()
+    phones = [f"{PHONE_PREFIX}{i:04d}" for i in range(logins)]
+    User.objects.filter(phone_number__in=phones).delete()
+    for phone in phones:
+        User.objects.create_user(phone)
+
+    counts = {"writes": 0, "queries": 0}
+
+    def count(execute, sql, params, many, context):
+        counts["queries"] += 1
+        if sql.lstrip().split(None, 1)[0].upper() in (
+            "INSERT", "UPDATE", "DELETE"
+        ):
+            counts["writes"] += 1
+        return execute(sql, params, many, context)
+
+    codes = {}
+
+    def capture(phone, code):
+        codes[phone] = code
+
+    started = time.perf_counter()
+    # Лимиты выдачи кодов не участвуют в замере
+    with override_settings(OTP_RATE_LIMITS={}), \
+            patch("accounts.views.enqueue_otp_sms", capture), \
+            connection.execute_wrapper(count):
+        for phone in phones:
+            client = Client()
+            client.get("/accounts/login/")
+            client.post("/accounts/login/", {"phone_number": phone})
+            response = client.post("/accounts/login/",
+                                   {"code": codes[int(phone[1:])]})
+            assert response.status_code == 302, response.status_code
+            assert client.get("/accounts/profile-page/").status_code == 200
+            client.post("/accounts/logout/")
+    elapsed = time.perf_counter() - started
+
+    User.objects.filter(phone_number__in=phones).delete()
+    return {
+        "session_backend": os.environ["SESSION_BACKEND"],
+        "logins": logins,
+        "seconds": round(elapsed, 3),
+        "logins_per_second": round(logins / elapsed, 1),
+        "db_writes_per_login": round(counts["writes"] / logins, 2),
+        "db_queries_per_login": round(counts["queries"] / logins, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--backends", default="db,cached_db,cache",
+                        help="Значения SESSION_BACKEND через запятую.")
+    parser.add_argument("--worker", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.logins)))
+        return
+
+    results = []
+    for backend in args.backends.split(","):
+        env = {**os.environ, "SESSION_BACKEND": backend}
+        env.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.session_writes", "--worker",
+             "--logins", str(args.logins)],
+            env=env, check=True, capture_output=True, text=True,
+        ).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+
+    print(json.dumps({"benchmark": "session_writes", "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
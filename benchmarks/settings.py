@@ -0,0 +1,116 @@
+"""
+Настройки для бенчмарка ``benchmarks.endpoints``, без внешних сервисов.
+
+БД — файл SQLite во временном каталоге или PostgreSQL при
+``BENCH_DATABASE=postgresql`` (параметры DB_* из settings.py; бенчмарк
+создаёт и удаляет отдельную тестовую БД). Redis — fakeredis в памяти
+процесса или настоящий при заданном ``BENCH_REDIS_URL``. Брокер Celery —
+в памяти, задачи выполняет воркер в потоке бенчмарка.
+"""
+import os
+import tempfile
+
+from django.core.exceptions import ImproperlyConfigured
+
+# Ключ перестановки инвайт-кодов обязателен без DEBUG
+os.environ.setdefault("INVITE_CODE_KEY", "benchmark")
+
+from referral_project.settings import *  # noqa: E402,F401,F403
+from referral_project.settings import (  # noqa: E402
+    DATABASES as _BASE_DATABASES,
+    REQUEST_BUDGETS,
+)
+
+DEBUG = False
+ALLOWED_HOSTS = ["testserver"]
+CORS_ALLOWED_ORIGINS = []
+
+if os.getenv("BENCH_DATABASE", "sqlite") == "sqlite":
+    _db_path = os.path.join(tempfile.gettempdir(), "referral_bench.sqlite3")
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": _db_path,
+            # Соединение на поток живёт весь прогон, как в пуле
+            "CONN_MAX_AGE": None,
+            # Параллельные записи ждут блокировку, а не падают с ошибкой
+            "OPTIONS": {"timeout": 30, "transaction_mode": "IMMEDIATE"},
+            "TEST": {"NAME": _db_path},
+        }
+    }
+    # Без триггера PostgreSQL цикл в дереве приглашений проверяется двумя
+    # запросами перед активацией
+    REQUEST_BUDGETS = {
+        **REQUEST_BUDGETS,
+        "api_activate_invite": {
+            **REQUEST_BUDGETS["api_activate_invite"],
+            "queries": REQUEST_BUDGETS["api_activate_invite"]["queries"] + 2,
+        },
+    }
+else:
+    # Реплики не участвуют в замере
+    DATABASES = {"default": _BASE_DATABASES["default"]}
+
+BENCH_REDIS_URL = os.getenv("BENCH_REDIS_URL")
+if BENCH_REDIS_URL:
+    _redis_url = BENCH_REDIS_URL.rstrip("/")
+    _pool_kwargs = {}
+    _async_pool_kwargs = {}
+else:
+    try:
+        import fakeredis
+        import fakeredis.aioredis
+    except ImportError as e:
+        raise ImproperlyConfigured(
+            "Для бенчмарка без Redis нужен fakeredis с Lua: "
+            "pip install 'fakeredis[lua]', либо задайте BENCH_REDIS_URL"
+        ) from e
+    _server = fakeredis.FakeServer()
+    _redis_url = "redis://localhost:6379"
+    _pool_kwargs = {
+        "connection_class": fakeredis.FakeConnection,
+        "server": _server,
+    }
+    _async_pool_kwargs = {
+        "connection_class": fakeredis.aioredis.FakeConnection,
+        "server": _server,
+    }
+
+CACHES = {
+    "default": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"{_redis_url}/1",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "CONNECTION_POOL_KWARGS": _pool_kwargs,
+        },
+    },
+    "sessions": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": f"{_redis_url}/2",
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "SERIALIZER": "accounts.sessions.CompactJSONSerializer",
+            "CONNECTION_POOL_KWARGS": _pool_kwargs,
+        },
+    },
+}
+ASYNC_REDIS_URL = CACHES["default"]["LOCATION"]
+ASYNC_REDIS_POOL_KWARGS = _async_pool_kwargs
+
+CELERY_BROKER_URL = "memory://"
+CELERY_RESULT_BACKEND = "cache+memory://"
+# Брокер в памяти опрашивает очередь раз в секунду по умолчанию
+CELERY_BROKER_TRANSPORT_OPTIONS = {"polling_interval": 0.01}
+
+# Лимиты выдачи кодов сработали бы на первых сотнях входов
+OTP_RATE_LIMITS = {}
+OTP_COUNTRY_RATE_LIMITS = {}
+# Фильтр Блума на 10 млн кодов для бенчмарка избыточен
+INVITE_FILTER_CAPACITY = int(os.getenv("INVITE_FILTER_CAPACITY", 1_000_000))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "root": {"level": "WARNING"},
+}
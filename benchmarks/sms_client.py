@@ -0,0 +1,96 @@
+"""
+Бенчмарк клиента SMSAero против локальной заглушки шлюза.
+
+Сравнивает прежнюю отправку (новый ``requests.post`` на каждое SMS)
+с пулом соединений :class:`accounts.sms.SMSAeroClient` в синхронном
+и asyncio-режимах::
+
+    python -m benchmarks.sms_client --messages 500 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from accounts.sms import SMSAeroClient
+from benchmarks.stub_smsaero import StubSMSAeroServer
+
+PHONE = "79990000000"
+TEXT = "Ваш код подтверждения: 1234"
+
+
+def _per_call(url):
+    def send(phone, message):
+        response = requests.post(
+            url, auth=("bench", "bench"),
+            data={"number": phone, "text": message},
+        )
+        return response.json()
+    return send
+
+
+def _run_threads(send, messages, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: send(PHONE, TEXT), range(messages)))
+
+
+async def _run_async(client, messages, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await client.asend(PHONE, TEXT)
+
+    await asyncio.gather(*(one() for _ in range(messages)))
+
+
+def _measure(server, name, func):
+    before = server.stats()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    after = server.stats()
+    requests_made = after["requests"] - before["requests"]
+    return {
+        "name": name,
+        "seconds": round(elapsed, 4),
+        "requests": requests_made,
+        "requests_per_second": round(requests_made / elapsed, 1),
+        "new_connections": after["connections"] - before["connections"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="Задержка ответа заглушки в секундах.")
+    args = parser.parse_args()
+
+    server = StubSMSAeroServer(latency=args.latency).start()
+    client = SMSAeroClient(url=server.url, email="bench", api_key="bench",
+                           pool_size=args.concurrency)
+    results = [
+        _measure(server, "per_call_requests_post",
+                 lambda: _run_threads(_per_call(server.url), args.messages,
+                                      args.concurrency)),
+        _measure(server, "pooled_client_sync",
+                 lambda: _run_threads(client.send, args.messages,
+                                      args.concurrency)),
+        _measure(server, "pooled_client_async",
+                 lambda: asyncio.run(_run_async(client, args.messages,
+                                                args.concurrency))),
+    ]
+    client.close()
+    server.stop()
+    print(json.dumps({"benchmark": "sms_client", "messages": args.messages,
+                      "concurrency": args.concurrency, "results": results},
+                     ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Локальная заглушка шлюза SMSAero для бенчмарков и отладки.
+
+Запуск отдельным процессом::
+
+    python -m benchmarks.stub_smsaero --port 8025 --latency 0.05
+
+После этого достаточно указать::
+
+    SMSAERO_URL=http://127.0.0.1:8025/v2/sms/send
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class StubSMSAeroHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = parse_qs(self.rfile.read(length).decode())
+        server = self.server
+        with server.lock:
+            server.requests_total += 1
+            server.connections.add(self.client_address)
+        if server.latency:
+            time.sleep(server.latency)
+
+        if random.random() < server.error_rate:
+            status = 503
+            payload = {"success": False, "message": "Service unavailable"}
+        else:
+            numbers = body.get("numbers[]") or body.get("number") or []
+            status = 200
+            payload = {
+                "success": True,
+                "status": "success",
+                "data": [
+                    {"id": random.randint(1, 10**9), "number": number}
+                    for number in numbers
+                ],
+                "message": None,
+            }
+            with server.lock:
+                server.messages_total += len(numbers)
+
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubSMSAeroServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, error_rate=0.0):
+        super().__init__(address, StubSMSAeroHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.requests_total = 0
+        self.messages_total = 0
+        self.connections = set()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v2/sms/send"
+
+    def start(self):
+        """Запуск сервера в фоновом потоке."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "requests": self.requests_total,
+                "messages": self.messages_total,
+                "connections": len(self.connections),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Задержка ответа в секундах.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Доля ответов 503.")
+    args = parser.parse_args()
+    server = StubSMSAeroServer((args.host, args.port), args.latency,
+                               args.error_rate)
+    print(f"Заглушка SMSAero слушает {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
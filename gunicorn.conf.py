@@ -0,0 +1,52 @@
+# Конфигурация gunicorn. Число воркеров и потоков читается из тех же
+# переменных окружения, что и в settings.py, где по ним считается размер
+# пула соединений с БД на воркер.
+import glob
+import os
+import socket
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", 2 * os.cpu_count() + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+if os.getenv("WEB_SERVER", "wsgi") == "asgi":
+    # Один цикл событий uvicorn на воркер, потоки не используются
+    wsgi_app = "referral_project.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    wsgi_app = "referral_project.wsgi:application"
+    worker_class = "gthread" if threads > 1 else "sync"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 30))
+# Пул соединений создаётся лениво в каждом воркере после fork, поэтому
+# приложение не загружается в мастер-процессе заранее
+preload_app = False
+# Перезапуск воркеров ограничивает рост памяти; разброс не даёт им
+# перезапуститься одновременно
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 5000))
+max_requests_jitter = max_requests // 10
+
+
+# Метрики воркеров пишутся в общий каталог, см. referral_project/metrics.py.
+# Файл процесса называется по имени хоста и PID, как в metrics.py
+def metrics_process_id(pid):
+    return f"{socket.gethostname()}-{pid}"
+
+
+def on_starting(server):
+    path = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    os.makedirs(path, exist_ok=True)
+    # Файлы прошлого запуска этого контейнера: новые воркеры с теми же PID
+    # продолжили бы их значения. Каталог общий с воркерами Celery, поэтому
+    # файлы других контейнеров не трогаем
+    pattern = f"*_{metrics_process_id('*')}.db"
+    for name in glob.glob(os.path.join(path, pattern)):
+        os.remove(name)
+
+
+def child_exit(server, worker):
+    # Значения gauge умершего воркера больше не учитываются в /metrics
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(metrics_process_id(worker.pid))
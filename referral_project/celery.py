@@ -6,3 +6,6 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "referral_project.settings")
 app = Celery("referral_project")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
+
+# Время выполнения задач (сигналы task_prerun/task_postrun)
+from . import metrics  # noqa: E402,F401
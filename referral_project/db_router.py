@@ -0,0 +1,235 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from accounts import async_cache
+
+logger = logging.getLogger(__name__)
+
+# Отставание реплики в секундах; 0, если всё полученное уже применено
+REPLICA_LAG_SQL = """
+SELECT CASE
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END
+"""
+
+_routing_state = contextvars.ContextVar("db_routing_state", default=None)
+_replica_checks = {}
+_replica_checks_lock = threading.Lock()
+
+
+class RoutingState:
+    """Состояние маршрутизации в рамках одного запроса."""
+
+    def __init__(self, pinned=False):
+        # Все чтения идут в основную БД
+        self.pinned = pinned
+        # В запросе была запись
+        self.wrote = False
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES
+            if alias.startswith("replica_")]
+
+
+@contextmanager
+def use_primary():
+    """Все чтения внутри блока выполняются в основной БД."""
+    token = _routing_state.set(RoutingState(pinned=True))
+    try:
+        yield
+    finally:
+        _routing_state.reset(token)
+
+
+def measure_replica_lag(alias):
+    """
+    Отставание реплики в секундах.
+
+    :return: ``0`` для СУБД без репликации (например, SQLite при локальной
+        проверке) и для основной БД; ``None``, если реплика недоступна.
+    """
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return 0
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(REPLICA_LAG_SQL)
+            lag = cursor.fetchone()[0]
+    except DatabaseError as e:
+        logger.warning(f"Реплика {alias} недоступна: {e}")
+        return None
+    # Не в режиме восстановления, то есть это не реплика
+    return float(lag or 0)
+
+
+def replica_is_fresh(alias):
+    """
+    Реплика доступна и отстаёт не больше чем на ``REPLICA_MAX_LAG``.
+
+    Результат проверки кэшируется в процессе на
+    ``REPLICA_LAG_CHECK_INTERVAL`` секунд.
+    """
+    now = time.monotonic()
+    checked = _replica_checks.get(alias)
+    if checked and now - checked[0] < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return checked[1]
+    with _replica_checks_lock:
+        lag = measure_replica_lag(alias)
+        fresh = lag is not None and lag <= settings.REPLICA_MAX_LAG
+        if lag is not None and not fresh:
+            logger.warning(
+                f"Реплика {alias} отстаёт на {lag:.1f} с, чтение из "
+                f"основной БД"
+            )
+        _replica_checks[alias] = (now, fresh)
+    return fresh
+
+
+class PrimaryReplicaRouter:
+    """
+    Чтение из реплик (алиасы ``replica_*``), запись в основную БД.
+
+    Чтение идёт в основную БД, если:
+
+    * в текущем запросе уже была запись или запрос закреплён за основной
+      БД после недавней записи того же клиента
+      (:class:`ReplicaRoutingMiddleware`);
+    * открыта транзакция в основной БД;
+    * все реплики недоступны или отстают.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if not replicas:
+            return None
+        state = _routing_state.get()
+        if state is not None and state.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        fresh = [alias for alias in replicas if replica_is_fresh(alias)]
+        return random.choice(fresh) if fresh else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _routing_state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Чтение своих записей: после записи клиент на ``REPLICA_STICKY_SECONDS``
+    секунд закрепляется за основной БД.
+
+    Браузер получает подписанную cookie (истечение проверяется по метке
+    времени подписи, подделанная cookie игнорируется), для API-клиентов с
+    JWT отметка хранится в кэше по id пользователя из токена. Под ASGI кэш
+    читается асинхронно. Без настроенных реплик middleware отключается.
+    """
+
+    cookie_name = "db_primary"
+    cookie_salt = "referral_project.db_router"
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        user_id = self.token_user_id(request)
+        state = RoutingState(pinned=self.cookie_pinned(request) or bool(
+            user_id and cache.get(self.pin_key(user_id))
+        ))
+        token = _routing_state.set(state)
+        try:
+            response = self.get_response(request)
+            if state.wrote:
+                user_id = self.pin(request, response)
+                if user_id:
+                    cache.set(self.pin_key(user_id), 1,
+                              timeout=settings.REPLICA_STICKY_SECONDS)
+        finally:
+            _routing_state.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        user_id = self.token_user_id(request)
+        state = RoutingState(pinned=self.cookie_pinned(request) or bool(
+            user_id and await async_cache.aget(self.pin_key(user_id))
+        ))
+        token = _routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+            if state.wrote:
+                user_id = self.pin(request, response)
+                if user_id:
+                    await async_cache.aset(
+                        self.pin_key(user_id), 1,
+                        timeout=settings.REPLICA_STICKY_SECONDS,
+                    )
+        finally:
+            _routing_state.reset(token)
+        return response
+
+    @staticmethod
+    def pin_key(user_id):
+        return f"db_primary_{user_id}"
+
+    def cookie_pinned(self, request):
+        return request.get_signed_cookie(
+            self.cookie_name, default=None, salt=self.cookie_salt,
+            max_age=settings.REPLICA_STICKY_SECONDS,
+        ) is not None
+
+    def token_user_id(self, request):
+        from rest_framework_simplejwt.exceptions import TokenError
+        from rest_framework_simplejwt.tokens import AccessToken
+
+        header = request.headers.get("Authorization", "")
+        if not header.startswith("Bearer "):
+            return None
+        try:
+            return AccessToken(header[len("Bearer "):])["user_id"]
+        except (TokenError, KeyError):
+            return None
+
+    def pin(self, request, response):
+        """
+        Закрепление клиента за основной БД после записи.
+
+        :return: id пользователя, которого нужно отметить в кэше.
+        """
+        ttl = settings.REPLICA_STICKY_SECONDS
+        response.set_signed_cookie(self.cookie_name, "1",
+                                   salt=self.cookie_salt, max_age=ttl,
+                                   httponly=True, samesite="Lax")
+        # Пользователь уже определён представлением
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            return user.pk
+        return None
@@ -1,17 +1,111 @@
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import permissions
+import functools
+import hashlib
+import os
+import threading
 
-# Настройка Swagger и ReDoc для документации API
-schema_view = get_schema_view(
-    openapi.Info(
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition, require_safe
+
+# drf_yasg импортируется только при первом обращении к документации:
+# воркеры, которые её не отдают, не тратят на него время при старте
+
+# Форматы схемы: суффикс URL -> (кодек drf_yasg, Content-Type)
+SCHEMA_FORMATS = {
+    ".json": ("OpenAPICodecJson", "application/json"),
+    ".yaml": ("OpenAPICodecYaml", "application/yaml"),
+}
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
         title="Referral API",
         default_version="v1",
         description="API documentation for the Referral system.",
         terms_of_service="https://www.google.com/policies/terms/",
         contact=openapi.Contact(email="contact@referral.local"),
         license=openapi.License(name="BSD License"),
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny, ),
-)
+    )
+
+
+def generate_schema(fmt):
+    """
+    Сборка схемы OpenAPI обходом всех представлений DRF.
+
+    :param fmt: Суффикс формата из ``SCHEMA_FORMATS``.
+    :return: Схема в байтах.
+    """
+    from drf_yasg import codecs
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    generator = OpenAPISchemaGenerator(
+        api_info(), urlconf="referral_project.schema_urls"
+    )
+    schema = generator.get_schema(request=None, public=True)
+    codec = getattr(codecs, SCHEMA_FORMATS[fmt][0])(validators=[])
+    return codec.encode(schema)
+
+
+def schema_path(fmt):
+    return os.path.join(settings.OPENAPI_SCHEMA_DIR, f"openapi{fmt}")
+
+
+def get_schema(fmt):
+    """
+    Схема и её ETag, один раз на процесс.
+
+    Схема читается из файла, собранного командой
+    ``generate_openapi_schema`` при деплое, а без него генерируется при
+    первом запросе.
+
+    :return: Кортеж (ETag, схема в байтах).
+    """
+    cached = _schemas.get(fmt)
+    if cached is None:
+        with _schemas_lock:
+            cached = _schemas.get(fmt)
+            if cached is None:
+                try:
+                    with open(schema_path(fmt), "rb") as f:
+                        body = f.read()
+                except FileNotFoundError:
+                    body = generate_schema(fmt)
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                cached = _schemas[fmt] = (etag, body)
+    return cached
+
+
+@require_safe
+@condition(etag_func=lambda request, format: get_schema(format)[0])
+def schema_view(request, format):
+    """Схема OpenAPI в JSON или YAML с поддержкой условного GET."""
+    _, body = get_schema(format)
+    return HttpResponse(body, content_type=SCHEMA_FORMATS[format][1])
+
+
+@functools.cache
+def _ui_view(renderer):
+    from drf_yasg.views import get_schema_view
+    from rest_framework import permissions
+
+    view = get_schema_view(
+        api_info(),
+        public=True,
+        permission_classes=(permissions.AllowAny, ),
+    )
+    # Страница интерфейса не строит схему, а загружает её со schema_view
+    # (SPEC_URL в SWAGGER_SETTINGS и REDOC_SETTINGS)
+    return view.with_ui(renderer, cache_timeout=0)
+
+
+def swagger_ui(request):
+    return _ui_view("swagger")(request)
+
+
+def redoc_ui(request):
+    return _ui_view("redoc")(request)
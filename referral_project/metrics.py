@@ -0,0 +1,161 @@
+"""
+Метрики приложения в формате Prometheus.
+
+Под gunicorn и в воркерах Celery значения пишутся в общий каталог
+``PROMETHEUS_MULTIPROC_DIR`` (режим multiprocess prometheus_client), и
+``/metrics`` в любом воркере отдаёт сумму по всем процессам. Переменная
+должна быть задана до запуска процессов; без неё метрики считаются в
+памяти процесса, как при локальной разработке и в тестах.
+"""
+import os
+import socket
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun
+from django.http import HttpResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    values,
+)
+
+
+def multiprocess_dir():
+    return os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+if multiprocess_dir():
+    # Каталог общий для контейнеров web и celery, а PID в них совпадают:
+    # в имя файла процесса добавляем имя хоста (id контейнера)
+    values.ValueClass = values.MultiProcessValue(
+        lambda: f"{socket.gethostname()}-{os.getpid()}"
+    )
+
+# Redis отвечает за доли миллисекунды, шлюз SMS — за секунды
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                0.25, 0.5, 1)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса.",
+    ["method", "route", "status"],
+)
+SMS_GATEWAY_DURATION = Histogram(
+    "sms_gateway_request_duration_seconds",
+    "Время запроса к шлюзу SMSAero вместе с повторами.",
+    ["operation", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+SMS_GATEWAY_RETRIES = Counter(
+    "sms_gateway_retries_total",
+    "Повторные запросы к шлюзу SMSAero.",
+    ["operation"],
+)
+OTP_CACHE_DURATION = Histogram(
+    "otp_cache_duration_seconds",
+    "Время обращения к Redis за кодом подтверждения.",
+    ["operation"],
+    buckets=FAST_BUCKETS,
+)
+OTP_CACHE_REQUESTS = Counter(
+    "otp_cache_requests_total",
+    "Обращения к кодам подтверждения. Проверка: hit — код найден, "
+    "miss — нет или истёк; выдача: stored; locked — номер заблокирован.",
+    ["operation", "result"],
+)
+REQUEST_BUDGET_EXCEEDED = Counter(
+    "request_budget_exceeded_total",
+    "Запросы, превысившие бюджет REQUEST_BUDGETS по ресурсу: queries, "
+    "redis или http.",
+    ["route", "resource"],
+)
+CELERY_TASK_DURATION = Histogram(
+    "celery_task_duration_seconds",
+    "Время выполнения задачи Celery.",
+    ["task", "state"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+
+
+def metrics_view(request):
+    """Все метрики в текстовом формате Prometheus."""
+    registry = REGISTRY
+    if multiprocess_dir():
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry),
+                        content_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """
+    Гистограмма времени ответа по маршрутам.
+
+    Метка ``route`` — шаблон URL (``accounts/api/profile/``), а не путь
+    запроса, поэтому число рядов не растёт с числом пользователей.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, started):
+        match = request.resolver_match
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method,
+            route=match.route if match else "<unmatched>",
+            status=response.status_code,
+        ).observe(time.perf_counter() - started)
+
+
+def observe_otp(operation, started, result):
+    OTP_CACHE_DURATION.labels(operation).observe(
+        time.perf_counter() - started
+    )
+    OTP_CACHE_REQUESTS.labels(operation, result).inc()
+
+
+_task_started = {}
+_task_started_lock = threading.Lock()
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    with _task_started_lock:
+        _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def _observe_task(task_id=None, task=None, state=None, **kwargs):
+    with _task_started_lock:
+        started = _task_started.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_DURATION.labels(task.name, state or "UNKNOWN").observe(
+            time.perf_counter() - started
+        )
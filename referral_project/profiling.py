@@ -0,0 +1,368 @@
+"""
+Ресурсы, которые тратит один запрос: запросы к БД, команды Redis и
+исходящие HTTP-запросы.
+
+``RequestProfilingMiddleware`` считает их для каждого запроса и сверяет с
+бюджетом представления из ``REQUEST_BUDGETS``. Превышение пишется в лог
+и в метрику ``request_budget_exceeded_total``, а при
+``REQUEST_BUDGETS_STRICT`` (тесты, см. ``referral_project.test_runner``)
+становится ошибкой ``BudgetExceeded``. С ``REQUEST_PROFILE_SAMPLE_RATE``
+часть запросов выполняется под профилировщиком, и профили медленных
+сохраняются в ``REQUEST_PROFILE_DIR``.
+"""
+import contextvars
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import redis
+import redis.asyncio
+import urllib3
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .metrics import REQUEST_BUDGET_EXCEEDED
+
+logger = logging.getLogger(__name__)
+
+# Счётчики и методы клиентов, вызов которых увеличивает счётчик. Конвейер
+# Redis уходит одним запросом и считается одной командой; повторы
+# urllib3 считаются отдельными HTTP-запросами. Вызов Lua-скрипта —
+# одна команда: NOSCRIPT и SCRIPT LOAD при первом вызове в процессе не
+# считаются.
+INSTRUMENTED = (
+    (redis.Redis, "execute_command", "redis"),
+    (redis.client.Pipeline, "execute", "redis"),
+    (redis.asyncio.Redis, "execute_command", "redis"),
+    (redis.asyncio.client.Pipeline, "execute", "redis"),
+    (urllib3.connectionpool.HTTPConnectionPool, "urlopen", "http"),
+)
+
+_current = contextvars.ContextVar("request_profile", default=None)
+_collectors = contextvars.ContextVar("request_profile_collectors",
+                                     default=())
+_install_lock = threading.Lock()
+_installed = False
+# Профилировщик работает не больше чем в одном запросе процесса
+_sampling_lock = threading.Lock()
+
+
+class BudgetExceeded(AssertionError):
+    """Запрос потратил больше ресурсов, чем разрешено его бюджетом."""
+
+
+class RequestProfile:
+    """Ресурсы, потраченные одним запросом."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        # Имя URL представления, None для неизвестного пути
+        self.view = None
+        self.queries = 0
+        self.redis = 0
+        self.http = 0
+        self.duration = 0.0
+
+    def counts(self):
+        return {"queries": self.queries, "redis": self.redis,
+                "http": self.http}
+
+    def over_budget(self, budget):
+        """
+        Превышения бюджета.
+
+        :param budget: Словарь ``{"queries": n, "redis": n, "http": n}``,
+            отсутствующий ключ — без ограничения.
+        :return: Словарь {ресурс: (потрачено, лимит)} для превышенных.
+        """
+        counts = self.counts()
+        return {
+            resource: (counts[resource], limit)
+            for resource, limit in budget.items()
+            if counts[resource] > limit
+        }
+
+    def __repr__(self):
+        return (f"<RequestProfile {self.method} {self.view or self.path} "
+                f"queries={self.queries} redis={self.redis} "
+                f"http={self.http}>")
+
+
+# Точки сохранения в тестах (TestCase оборачивает каждый тест в
+# транзакцию), а без них BEGIN и COMMIT не проходят через курсор
+SAVEPOINT_SQL = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+def _count(resource, delta=1):
+    profile = _current.get()
+    if profile is not None:
+        setattr(profile, resource, getattr(profile, resource) + delta)
+
+
+def _count_query(execute, sql, params, many, context):
+    if not sql.startswith(SAVEPOINT_SQL):
+        _count("queries")
+    return execute(sql, params, many, context)
+
+
+def _wrap_connection(connection):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _wrap_connection(connection)
+
+
+def _counted(method, resource):
+    if inspect.iscoroutinefunction(method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            if args[1:2] == ("SCRIPT LOAD", ):
+                return await method(*args, **kwargs)
+            _count(resource)
+            try:
+                return await method(*args, **kwargs)
+            except redis.exceptions.NoScriptError:
+                _count(resource, -1)
+                raise
+    else:
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if args[1:2] == ("SCRIPT LOAD", ):
+                return method(*args, **kwargs)
+            _count(resource)
+            try:
+                return method(*args, **kwargs)
+            except redis.exceptions.NoScriptError:
+                _count(resource, -1)
+                raise
+    return wrapper
+
+
+def install():
+    """
+    Подключение счётчиков к соединениям с БД и клиентам Redis и HTTP.
+
+    Вызывается один раз на процесс при создании middleware. Вне запроса
+    счётчики ничего не делают.
+    """
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_on_connection_created)
+        # Соединения, открытые до установки, сигнал уже не увидит
+        for connection in connections.all(initialized_only=True):
+            _wrap_connection(connection)
+        for cls, name, resource in INSTRUMENTED:
+            setattr(cls, name, _counted(getattr(cls, name), resource))
+        _installed = True
+
+
+@contextmanager
+def capture_profiles():
+    """
+    Сбор профилей запросов, выполненных в блоке ``with``, для тестов::
+
+        with capture_profiles() as profiles:
+            self.client.get("/accounts/api/profile/")
+        self.assertLessEqual(profiles[0].queries, 3)
+
+    Профили собираются в текущем контексте (потоке или задаче asyncio),
+    поэтому параллельные запросы из других потоков в список не попадают.
+    """
+    profiles = []
+    token = _collectors.set(_collectors.get() + (profiles, ))
+    try:
+        yield profiles
+    finally:
+        _collectors.reset(token)
+
+
+class Sampler:
+    """
+    Профилировщик одного запроса: cProfile или pyinstrument.
+
+    Под ASGI запросы выполняются вперемешку в одном цикле событий, и
+    cProfile записал бы в профиль чужие запросы, а работу в потоках
+    ``sync_to_async`` не увидел бы вовсе. Поэтому async-запросы
+    профилируются только pyinstrument в асинхронном режиме, который
+    относит время к задаче запроса; с cProfile они не профилируются.
+    """
+
+    def __init__(self, kind, async_mode=False):
+        self.kind = kind
+        if kind == "pyinstrument":
+            from pyinstrument import Profiler
+
+            self.profiler = Profiler(
+                async_mode="enabled" if async_mode else "disabled"
+            )
+        else:
+            self.profiler = cProfile.Profile()
+
+    @classmethod
+    def maybe_start(cls, async_mode=False):
+        """
+        Запуск профилировщика для доли ``REQUEST_PROFILE_SAMPLE_RATE``
+        запросов.
+
+        :param async_mode: Запрос выполняется в цикле событий (ASGI).
+        :return: Запущенный Sampler или None.
+        """
+        rate = settings.REQUEST_PROFILE_SAMPLE_RATE
+        if not rate or random.random() >= rate:
+            return None
+        if async_mode and settings.REQUEST_PROFILER != "pyinstrument":
+            return None
+        if not _sampling_lock.acquire(blocking=False):
+            return None
+        try:
+            sampler = cls(settings.REQUEST_PROFILER, async_mode)
+            sampler.start()
+        except Exception:
+            _sampling_lock.release()
+            raise
+        return sampler
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        try:
+            if self.kind == "pyinstrument":
+                self.profiler.stop()
+            else:
+                self.profiler.disable()
+        finally:
+            _sampling_lock.release()
+
+    def dump(self, profile):
+        """
+        Сохранение профиля в ``REQUEST_PROFILE_DIR``: ``.prof`` для cProfile
+        (``python -m pstats``, snakeviz), ``.html`` для pyinstrument.
+
+        :return: Путь к файлу.
+        """
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        name = (f"{stamp}-{profile.view or 'unmatched'}-"
+                f"{profile.duration * 1000:.0f}ms-{os.getpid()}")
+        path = os.path.join(settings.REQUEST_PROFILE_DIR, name)
+        if self.kind == "pyinstrument":
+            path += ".html"
+            with open(path, "w") as f:
+                f.write(self.profiler.output_html())
+        else:
+            path += ".prof"
+            self.profiler.dump_stats(path)
+        return path
+
+
+class RequestProfilingMiddleware:
+    """
+    Подсчёт запросов к БД, команд Redis и исходящих HTTP-запросов на
+    запрос, проверка бюджетов ``REQUEST_BUDGETS`` и выборочное
+    профилирование медленных запросов.
+
+    Бюджет задаётся по имени URL, поэтому синхронный и асинхронный
+    варианты представления делят один бюджет. Ответы с потоковым телом
+    учитываются только до начала отдачи тела. Под ASGI профилируется
+    только pyinstrument, см. :class:`Sampler`.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if (settings.REQUEST_PROFILE_SAMPLE_RATE
+                and settings.REQUEST_PROFILER == "pyinstrument"):
+            try:
+                import pyinstrument  # noqa: F401
+            except ImportError as e:
+                raise ImproperlyConfigured(
+                    "REQUEST_PROFILER=pyinstrument требует пакет "
+                    "pyinstrument"
+                ) from e
+        install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile(request.method, request.path)
+        token = _current.set(profile)
+        sampler = Sampler.maybe_start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profile.duration = time.perf_counter() - started
+            if sampler:
+                sampler.stop()
+            _current.reset(token)
+        self.finish(request, profile, sampler)
+        return response
+
+    async def __acall__(self, request):
+        profile = RequestProfile(request.method, request.path)
+        token = _current.set(profile)
+        sampler = Sampler.maybe_start(async_mode=True)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            profile.duration = time.perf_counter() - started
+            if sampler:
+                sampler.stop()
+            _current.reset(token)
+        self.finish(request, profile, sampler)
+        return response
+
+    @staticmethod
+    def finish(request, profile, sampler):
+        match = request.resolver_match
+        profile.view = match.view_name if match else None
+        for profiles in _collectors.get():
+            profiles.append(profile)
+
+        slow_ms = settings.REQUEST_PROFILE_SLOW_MS
+        if sampler and profile.duration * 1000 >= slow_ms:
+            path = sampler.dump(profile)
+            logger.info(
+                f"Медленный запрос {profile.method} {profile.path} "
+                f"({profile.duration * 1000:.0f} мс), профиль: {path}"
+            )
+
+        budget = settings.REQUEST_BUDGETS.get(profile.view)
+        exceeded = profile.over_budget(budget) if budget else {}
+        if not exceeded:
+            return
+        for resource in exceeded:
+            REQUEST_BUDGET_EXCEEDED.labels(match.route, resource).inc()
+        details = ", ".join(
+            f"{resource} {used} из {limit}"
+            for resource, (used, limit) in exceeded.items()
+        )
+        message = (f"Запрос {profile.method} {profile.path} превысил "
+                   f"бюджет {profile.view}: {details}")
+        if settings.REQUEST_BUDGETS_STRICT:
+            raise BudgetExceeded(message)
+        logger.warning(message)
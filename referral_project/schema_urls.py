@@ -0,0 +1,14 @@
+"""
+URLconf для генератора схемы OpenAPI.
+
+Повторяет подключение маршрутов API из ``urls.py``, но всегда с
+представлениями DRF: async-варианты, включаемые при ``WEB_SERVER=asgi``,
+генератор не описывает.
+"""
+from django.urls import include, path
+
+from accounts.urls import schema_urlpatterns
+
+urlpatterns = [
+    path("accounts/", include(schema_urlpatterns)),
+]
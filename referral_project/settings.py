@@ -1,5 +1,7 @@
+import copy
 import os
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -12,7 +14,9 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your_default_secret_key")
 # Отладка
 DEBUG = os.getenv("DEBUG", "False") == "True"
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [
+    host for host in os.getenv("ALLOWED_HOSTS", "").split(",") if host
+]
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -31,6 +35,12 @@ AUTH_USER_MODEL = "accounts.User"
 
 # Middleware
 MIDDLEWARE = [
+    # Время ответа с учётом всех остальных middleware
+    "referral_project.metrics.MetricsMiddleware",
+    # Запросы к БД, команды Redis и HTTP-запросы всех middleware ниже
+    "referral_project.profiling.RequestProfilingMiddleware",
+    # Первым, чтобы учитывать записи всех остальных middleware (сессии)
+    "referral_project.db_router.ReplicaRoutingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -73,6 +83,78 @@ DATABASES = {
     }
 }
 
+# Режим соединений с БД (DB_CONN_MODE):
+#   pool       — пул psycopg 3 в каждом процессе (по умолчанию);
+#   persistent — одно постоянное соединение на поток с проверкой
+#                перед запросом;
+#   pgbouncer  — постоянные соединения к PgBouncer в режиме transaction,
+#                без серверных курсоров;
+#   none       — новое соединение на каждый запрос.
+DB_CONN_MODE = os.getenv("DB_CONN_MODE", "pool")
+# Сервер приложений (WEB_SERVER): wsgi — воркеры gunicorn sync/gthread,
+# asgi — воркеры uvicorn под gunicorn с async-представлениями входа,
+# профиля и активации инвайт-кода. Те же переменные, что и ниже, читает
+# gunicorn.conf.py.
+WEB_SERVER = os.getenv("WEB_SERVER", "wsgi")
+ASYNC_VIEWS = WEB_SERVER == "asgi"
+# Воркеры и потоки gunicorn и общий лимит соединений веб-процессов к
+# PostgreSQL
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 2 * os.cpu_count() + 1))
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", 1))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", 80))
+
+if DB_CONN_MODE == "pool":
+    # Воркер gthread одновременно обслуживает не больше GUNICORN_THREADS
+    # запросов, воркер ASGI — сколько угодно; все воркеры вместе не
+    # должны превышать лимит БД. Под ASGI режим persistent не подходит:
+    # поток запроса живёт только до конца запроса.
+    DB_POOL_SIZE = DB_MAX_CONNECTIONS // WEB_CONCURRENCY
+    if not ASYNC_VIEWS:
+        DB_POOL_SIZE = min(GUNICORN_THREADS, DB_POOL_SIZE)
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": 1,
+            "max_size": max(1, DB_POOL_SIZE),
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", 10)),
+        },
+    }
+    # С пулом Django передаёт CONN_HEALTH_CHECKS в ConnectionPool как
+    # check=ConnectionPool.check_connection: пул пингует соединение при
+    # выдаче и заменяет разорванное. Сам check в OPTIONS["pool"] не
+    # указывается — Django задаёт этот аргумент сам
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+elif DB_CONN_MODE in ("persistent", "pgbouncer"):
+    DATABASES["default"]["CONN_MAX_AGE"] = int(
+        os.getenv("DB_CONN_MAX_AGE", 60)
+    )
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+    if DB_CONN_MODE == "pgbouncer":
+        DATABASES["default"]["DISABLE_SERVER_SIDE_CURSORS"] = True
+
+# Реплики для чтения: хосты через запятую, остальные параметры как у
+# основной БД. Алиасы replica_0, replica_1, ... использует
+# PrimaryReplicaRouter; в тестах реплики указывают на тестовую основную БД.
+DB_REPLICA_HOSTS = [
+    host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",")
+    if host.strip()
+]
+for i, host in enumerate(DB_REPLICA_HOSTS):
+    DATABASES[f"replica_{i}"] = {
+        **copy.deepcopy(DATABASES["default"]),
+        "HOST": host,
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["referral_project.db_router.PrimaryReplicaRouter"]
+# Реплика, отстающая больше чем на REPLICA_MAX_LAG секунд, исключается из
+# чтения; отставание проверяется не чаще раза в REPLICA_LAG_CHECK_INTERVAL
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 2))
+REPLICA_LAG_CHECK_INTERVAL = float(
+    os.getenv("REPLICA_LAG_CHECK_INTERVAL", 5)
+)
+# Сколько секунд после записи клиент читает из основной БД
+REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME":
@@ -98,6 +180,12 @@ STATIC_URL = "/static/"
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
+# Схема OpenAPI, собранная командой generate_openapi_schema при деплое
+OPENAPI_SCHEMA_DIR = os.path.join(STATIC_ROOT, "openapi")
+# Интерфейсы документации загружают готовую схему, а не строят её заново
+SWAGGER_SETTINGS = {"SPEC_URL": ("schema-json", {"format": ".json"})}
+REDOC_SETTINGS = {"SPEC_URL": ("schema-json", {"format": ".json"})}
+
 # Конфигурация Redis для кэширования
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = os.getenv('REDIS_PORT', 6379)
@@ -109,13 +197,56 @@ CACHES = {
         "OPTIONS": {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
-    }
+    },
+    # Сессии в отдельной базе Redis (или отдельном инстансе с
+    # персистентностью): очистка кэша не разлогинивает пользователей
+    "sessions": {
+        "BACKEND": "django_redis.cache.RedisCache",
+        "LOCATION": (os.getenv("SESSION_REDIS_URL")
+                     or f"redis://{REDIS_HOST}:{REDIS_PORT}/2"),
+        "OPTIONS": {
+            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            "SERIALIZER": "accounts.sessions.CompactJSONSerializer",
+        }
+    },
+}
+
+# Сессии шаблонного входа (LoginView): cache — только Redis, запрос и
+# проверка кода не пишут в БД; cached_db — запись в БД, чтение из Redis;
+# db — таблица django_session
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "cache")
+SESSION_ENGINE = f"django.contrib.sessions.backends.{SESSION_BACKEND}"
+SESSION_CACHE_ALIAS = "sessions"
+# Сообщения короткие и живут до следующей страницы: храним их в cookie,
+# не трогая сессию
+MESSAGE_STORAGE = "django.contrib.messages.storage.cookie.CookieStorage"
+
+# Клиент redis.asyncio для async-представлений, та же база, что у кэша
+ASYNC_REDIS_URL = CACHES["default"]["LOCATION"]
+ASYNC_REDIS_POOL_KWARGS = {
+    "max_connections": int(os.getenv("ASYNC_REDIS_MAX_CONNECTIONS", 100)),
 }
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES":
-    ("rest_framework_simplejwt.authentication.JWTAuthentication", )
+    ("accounts.authentication.StatelessJWTAuthentication", )
+}
+
+# Access-токен несёт данные пользователя в claims, и API не читает таблицу
+# пользователей на каждый запрос (см. accounts.authentication)
+SIMPLE_JWT = {
+    "TOKEN_USER_CLASS": "accounts.authentication.ClaimsUser",
+    "TOKEN_OBTAIN_SERIALIZER":
+    "accounts.authentication.ClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER":
+    "accounts.authentication.ClaimsTokenRefreshSerializer",
 }
+# Сколько секунд процесс не перечитывает версию токенов пользователя из
+# Redis, то есть задержка отзыва токенов; и сколько версий помнит
+AUTH_TOKEN_VERSION_CACHE_TTL = int(
+    os.getenv("AUTH_TOKEN_VERSION_CACHE_TTL", 5)
+)
+AUTH_TOKEN_VERSION_CACHE_SIZE = 100_000
 
 # Логирование
 LOGGING = {
@@ -145,7 +276,138 @@ CORS_ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "").split(",")
 CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
 CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND",
                                   "redis://redis:6379/0")
+# Коды подтверждения уходят через отдельную очередь с высшим приоритетом,
+# чтобы массовые рассылки не задерживали вход пользователей
+CELERY_TASK_ROUTES = {
+    "accounts.tasks.send_otp_sms": {"queue": "otp"},
+    "accounts.tasks.flush_sms_buffer": {"queue": "sms"},
+    "accounts.tasks.run_broadcast": {"queue": "sms"},
+}
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    "priority_steps": list(range(10)),
+    "queue_order_strategy": "priority",
+    # Неподтверждённая задача (acks_late) через столько секунд доставляется
+    # повторно. Должно быть больше BROADCAST_LEASE_SECONDS: повторно
+    # доставленная рассылка при живом исполнителе только откладывается
+    "visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 3600)),
+}
 
 # SMSAERO настройки
+SMSAERO_URL = os.getenv("SMSAERO_URL", "https://gate.smsaero.ru/v2/sms/send")
 SMSAERO_EMAIL = os.getenv("SMSAERO_EMAIL")
 SMSAERO_API_KEY = os.getenv("SMSAERO_API_KEY")
+# Таймауты (секунды), повторы и размер пула соединений клиента SMSAero
+SMSAERO_CONNECT_TIMEOUT = float(os.getenv("SMSAERO_CONNECT_TIMEOUT", 3.05))
+SMSAERO_READ_TIMEOUT = float(os.getenv("SMSAERO_READ_TIMEOUT", 10))
+SMSAERO_MAX_RETRIES = int(os.getenv("SMSAERO_MAX_RETRIES", 2))
+SMSAERO_BACKOFF_FACTOR = float(os.getenv("SMSAERO_BACKOFF_FACTOR", 0.3))
+SMSAERO_POOL_SIZE = int(os.getenv("SMSAERO_POOL_SIZE", 10))
+# Максимум номеров в одном запросе массовой отправки
+SMSAERO_BULK_SIZE = int(os.getenv("SMSAERO_BULK_SIZE", 50))
+# Ограничение скорости шлюза (сообщений в секунду)
+SMSAERO_RATE_LIMIT = float(os.getenv("SMSAERO_RATE_LIMIT", 100))
+
+# Массовые рассылки: размер порции получателей и число потоков отправки
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 2000))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 8))
+# Рассылку без новых контрольных точек дольше этого времени (секунды)
+# может продолжить другой исполнитель. Должно быть больше времени отправки
+# одной порции: BROADCAST_CHUNK_SIZE / SMSAERO_RATE_LIMIT и таймауты шлюза
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", 300))
+# Размер порции строк при массовом импорте пользователей
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 5000))
+
+# Время жизни кода подтверждения (секунды) и приоритет его отправки
+OTP_CODE_TTL = 300
+OTP_SMS_PRIORITY = 0
+# Число неверных попыток ввода кода и время блокировки номера (секунды)
+OTP_MAX_ATTEMPTS = 5
+OTP_LOCK_TIME = 900
+# Лимиты выдачи кодов: (число запросов, период в секундах)
+OTP_RATE_LIMITS = {
+    "ip": (20, 3600),
+    "phone": (5, 3600),
+    "country": (2000, 60),
+}
+# Отдельные лимиты для кодов стран, например {"7": (5000, 60)}
+OTP_COUNTRY_RATE_LIMITS = {}
+
+# Нормализация номеров: размер LRU-кэша и регионы, метаданные которых
+# загружаются при старте воркера
+PHONE_NORMALIZE_CACHE_SIZE = 10000
+PHONE_PRELOAD_REGIONS = ["RU"]
+
+# Ограничения обхода дерева приглашений
+REFERRAL_MAX_DEPTH = 20
+REFERRAL_RESULT_LIMIT = 10000
+# Размер страницы списка приглашённых (по умолчанию и максимальный)
+INVITEES_PAGE_SIZE = 50
+INVITEES_MAX_PAGE_SIZE = 500
+# Ключ перестановки инвайт-кодов. Менять его нельзя: новые коды могут
+# совпасть с уже выданными. Задаётся отдельно от SECRET_KEY, чтобы смена
+# SECRET_KEY не меняла коды; только при отладке берётся SECRET_KEY
+INVITE_CODE_KEY = os.getenv("INVITE_CODE_KEY")
+if not INVITE_CODE_KEY:
+    if not DEBUG:
+        raise ImproperlyConfigured("Не задан INVITE_CODE_KEY")
+    INVITE_CODE_KEY = SECRET_KEY
+# Фильтр Блума по инвайт-кодам: ожидаемое число кодов и допустимая доля
+# ложноположительных ответов. Время (секунды), на которое запоминается
+# код, не найденный в БД
+INVITE_FILTER_CAPACITY = int(os.getenv("INVITE_FILTER_CAPACITY", 10_000_000))
+INVITE_FILTER_ERROR_RATE = float(os.getenv("INVITE_FILTER_ERROR_RATE", 0.001))
+INVITE_CODE_MISS_TTL = 60
+# Время жизни (секунды) закэшированного JSON профиля; кэш также
+# сбрасывается сигналами при изменении приглашений
+PROFILE_CACHE_TTL = int(os.getenv("PROFILE_CACHE_TTL", 3600))
+# Админка: с какой оценки числа строк список пользователей показывает
+# оценку планировщика вместо точного COUNT(*)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", 10_000))
+# Бюджеты запросов по имени URL: запросы к БД (queries), команды Redis
+# (redis) и исходящие HTTP-запросы (http) на один запрос, с учётом
+# промаха кэша. Превышение пишется в лог, в тестах это ошибка
+# (REQUEST_BUDGETS_STRICT, см. referral_project/test_runner.py). Лимиты
+# равны ожидаемым значениям, чтобы лишний запрос (N+1) был заметен сразу.
+# Публикация задачи в брокер Redis — две команды (SMEMBERS привязок и
+# LPUSH); с репликами запрос с JWT читает отметку чтения своих записей,
+# а запись ставит её (ReplicaRoutingMiddleware)
+_BROKER_PUBLISH = 2 if CELERY_BROKER_URL.startswith("redis") else 0
+_REPLICA_PIN = 1 if DB_REPLICA_HOSTS else 0
+REQUEST_BUDGETS = {
+    # Номер: лимит на IP, лимиты на номер, код, статус SMS и публикация;
+    # код: проверка, сессия и пользователь
+    "login": {"queries": 2, "redis": max(7, 6 + _BROKER_PUBLISH),
+              "http": 0},
+    "api_otp_request": {"queries": 0, "redis": 4 + _BROKER_PUBLISH,
+                        "http": 0},
+    "api_otp_verify": {"queries": 1, "redis": 2, "http": 0},
+    # Промах кэша: пользователь по старому токену без claims, строка
+    # профиля, статистика и первая страница приглашённых
+    "api_profile": {"queries": 4, "redis": 2 + _REPLICA_PIN, "http": 0},
+    "api_profile_invitees": {"queries": 1, "redis": _REPLICA_PIN,
+                             "http": 0},
+    # В PostgreSQL, точки сохранения не считаются: пользователь по
+    # старому токену, UPDATE ... RETURNING и пять запросов статистики
+    # Redis: проверка кода одним Lua-скриптом, в первый раз с NOSCRIPT и
+    # загрузкой
+    "api_activate_invite": {"queries": 7, "redis": 3 + 2 * _REPLICA_PIN,
+                            "http": 0},
+    "token_refresh": {"queries": 1, "redis": 1, "http": 0},
+}
+REQUEST_BUDGETS_STRICT = False
+TEST_RUNNER = "referral_project.test_runner.BudgetTestRunner"
+# Выборочное профилирование: доля запросов под профилировщиком (0 —
+# выключено), профилировщик (cprofile или pyinstrument), с какой
+# длительности (мс) профиль сохраняется и куда
+REQUEST_PROFILE_SAMPLE_RATE = float(
+    os.getenv("REQUEST_PROFILE_SAMPLE_RATE", 0)
+)
+REQUEST_PROFILER = os.getenv("REQUEST_PROFILER", "cprofile")
+REQUEST_PROFILE_SLOW_MS = float(os.getenv("REQUEST_PROFILE_SLOW_MS", 500))
+REQUEST_PROFILE_DIR = os.getenv("REQUEST_PROFILE_DIR",
+                                "/tmp/request-profiles")
+# Окно (секунды) и размер пакета при объединении SMS из буфера
+SMS_BATCH_WINDOW = float(os.getenv("SMS_BATCH_WINDOW", 1))
+SMS_BATCH_MAX = int(os.getenv("SMS_BATCH_MAX", 500))
+# Сколько секунд хранится статус SMS из буфера
+SMS_STATUS_TTL = int(os.getenv("SMS_STATUS_TTL", 3600))
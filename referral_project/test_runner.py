@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class BudgetTestRunner(DiscoverRunner):
+    """
+    Тесты, в которых запрос превысил бюджет ``REQUEST_BUDGETS``, падают с
+    ``BudgetExceeded``, а не только пишут предупреждение в лог.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._budgets_strict = settings.REQUEST_BUDGETS_STRICT
+        settings.REQUEST_BUDGETS_STRICT = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.REQUEST_BUDGETS_STRICT = self._budgets_strict
+        super().teardown_test_environment(**kwargs)
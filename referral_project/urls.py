@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.urls import include, path, re_path
 
-from .drf_yasg import schema_view  # Импортируем schema_view из drf_yasg.py
+from .drf_yasg import redoc_ui, schema_view, swagger_ui
+from .metrics import metrics_view
 from accounts.views import index
 
 urlpatterns = [
@@ -12,17 +13,13 @@ urlpatterns = [
     # Swagger JSON/YAML
     re_path(
         r"^swagger(?P<format>\.json|\.yaml)$",
-        schema_view.without_ui(cache_timeout=0),
+        schema_view,
         name="schema-json",
     ),
     # Swagger UI
-    path(
-        "swagger/",
-        schema_view.with_ui("swagger", cache_timeout=0),
-        name="schema-swagger-ui",
-    ),
+    path("swagger/", swagger_ui, name="schema-swagger-ui"),
     # ReDoc UI
-    path("redoc/",
-         schema_view.with_ui("redoc", cache_timeout=0),
-         name="schema-redoc"),
+    path("redoc/", redoc_ui, name="schema-redoc"),
+    # Метрики для Prometheus
+    path("metrics", metrics_view, name="metrics"),
 ]